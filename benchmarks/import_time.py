@@ -0,0 +1,87 @@
+"""
+Benchmark the startup time of the hvantk CLI, and check that Hail (and PySpark) are not
+imported by `import hvantk` or `hvantk --help`.
+
+Every measurement runs in a fresh interpreter. Exits with status 1 if Hail is loaded at startup
+or if the median startup time exceeds `--max_seconds`.
+
+Usage:
+    python -m benchmarks.import_time --repeat 5 --max_seconds 1.0
+
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Modules that must not be loaded at startup
+HEAVY_MODULES = ('hail', 'pyspark', 'py4j')
+
+CASES = {
+    'import hvantk': 'import hvantk',
+    'hvantk --help': ('import sys\n'
+                      'from hvantk.hvantk import cli\n'
+                      'try:\n'
+                      '    cli(["--help"], standalone_mode=False)\n'
+                      'except SystemExit:\n'
+                      '    pass\n'),
+    'hvantk <unknown command>': ('import sys\n'
+                                 'from hvantk.hvantk import cli\n'
+                                 'try:\n'
+                                 '    cli(["mktable"], standalone_mode=False)\n'
+                                 'except Exception:\n'
+                                 '    pass\n'),
+}
+
+
+def _run_case(code: str) -> tuple:
+    """
+    Run `code` in a fresh interpreter and return its wall time and the heavy modules it loaded.
+    """
+    check = (f'\nimport json, sys\n'
+             f'print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]), file=sys.stderr)\n')
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable, '-c', code + check], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr)
+    return elapsed, json.loads(p.stderr.strip().splitlines()[-1])
+
+
+def main(args):
+    failed = False
+    for name, code in CASES.items():
+        times = []
+        loaded = []
+        for _ in range(args.repeat):
+            elapsed, loaded = _run_case(code)
+            times.append(elapsed)
+        median = statistics.median(times)
+        print(f'{name}: {median:.3f}s (median of {args.repeat})')
+
+        if loaded:
+            print(f'  FAIL: heavy modules loaded at startup: {", ".join(loaded)}')
+            failed = True
+        if args.max_seconds is not None and median > args.max_seconds:
+            print(f'  FAIL: startup time above {args.max_seconds:.3f}s')
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the hvantk CLI.')
+
+    parser.add_argument('--repeat', help='Number of runs per case',
+                        type=int, default=5)
+
+    parser.add_argument('--max_seconds', help='Maximum median startup time (seconds)',
+                        type=float, default=None)
+
+    main(parser.parse_args())
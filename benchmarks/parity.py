@@ -0,0 +1,196 @@
+"""
+Check that the optimized annotation paths give the same output as the per-source annotators,
+on synthetic data under local-mode Hail.
+
+The synthetic reference tables cover the even variants of the universe only (see
+`benchmarks.synthetic`), so about half of the input variants are absent from every reference
+table, which is where shortcuts (e.g. pre-joined tables) tend to diverge. The numpy RNA-seq
+engine is also checked against the hail engine. Exits with status 1 if any field differs.
+
+Usage:
+    python -m benchmarks.parity --work_dir /tmp/hvantk-parity --n_rows 10000
+
+"""
+
+import argparse
+import os
+import sys
+
+import hail as hl
+
+from hvantk.commands.annotate_features import annotate_variants
+from hvantk.utils import annotate, dataset, make_tables
+from benchmarks import synthetic
+from benchmarks.run import run_builders
+
+
+# Variant-level fields annotated by both the per-source annotators and the variant bundle
+VARIANT_FIELDS = ['clinvar_clnsig', 'ccr_pct', 'gnomad_af_genomes', 'ppi_site']
+
+
+def _same(a: hl.expr.Expression,
+          b: hl.expr.Expression) -> hl.expr.BooleanExpression:
+    """Both missing, or equal (up to float rounding for numeric fields, NaN equal to NaN; element-wise
+    for dicts and arrays)."""
+    if a.dtype in (hl.tfloat32, hl.tfloat64):
+        a, b = hl.float64(a), hl.float64(b)
+        eq = (hl.abs(a - b) <= 1e-6) | (hl.is_nan(a) & hl.is_nan(b))
+    elif isinstance(a.dtype, hl.tdict):
+        eq = ((a.key_set() == b.key_set()) &
+              hl.all(hl.array(a.key_set()).map(lambda k: _same(a[k], b.get(k)))))
+    elif isinstance(a.dtype, hl.tarray):
+        eq = (hl.len(a) == hl.len(b)) & hl.all(hl.zip(a, b).map(lambda x: _same(x[0], x[1])))
+    else:
+        eq = a == b
+    return hl.coalesce(eq, hl.is_missing(a) & hl.is_missing(b))
+
+
+def compare_tables(expected: hl.Table,
+                   actual: hl.Table,
+                   fields: list) -> dict:
+    """
+    Compare the given fields of two tables with the same (unique) keys.
+
+    :param expected: Reference Hail Table
+    :param actual: Hail Table to check
+    :param fields: Fields to compare
+    :return: Dict with the number of differing rows per field (fields without differences are omitted),
+        and '<missing rows>' for keys of `expected` absent from `actual`
+    """
+    t = expected.select(*fields)
+    t = t.annotate(_actual=actual.select(*fields)[t.key])
+    counts = t.aggregate(hl.struct(**{f: hl.agg.count_where(~_same(t[f], t._actual[f])) for f in fields},
+                                   _n_missing=hl.agg.count_where(hl.is_missing(t._actual))))
+    diffs = {f: counts[f] for f in fields if counts[f] > 0}
+    if counts._n_missing > 0:
+        diffs['<missing rows>'] = counts._n_missing
+    return diffs
+
+
+def check_variant_bundle(t: hl.Table) -> dict:
+    """
+    Compare `annotate_variant_bundle` against the per-source variant-level annotators.
+
+    :param t: Input Hail Table keyed by `locus` and `alleles`, with a `TranscriptID` field
+    :return: Differences (see `compare_tables`)
+    """
+    per_source = annotate.annotate_clinvar_clnsig(t)
+    per_source = annotate.annotate_ccr(per_source)
+    per_source = annotate.annotate_gnomad_af(per_source)
+    per_source = annotate.annotate_ppi(per_source)
+    per_source = annotate.annotate_dbnsfp_scores(per_source, transcript_id_col='TranscriptID')
+
+    bundle = annotate.annotate_variant_bundle(t, transcript_id_col='TranscriptID')
+
+    score_fields = annotate.get_dbnsfp_score_fields(dataset.get_variant_bundle_ht())
+    return compare_tables(per_source, bundle, VARIANT_FIELDS + score_fields)
+
+
+def check_dedupe(t: hl.Table) -> dict:
+    """
+    Compare `annotate_variants` with `dedupe='on'` (distinct variants and genes annotated, then
+    joined back) against `dedupe='off'`, on an input with duplicate keys and missing genes.
+
+    :param t: Input Hail Table keyed by `locus` and `alleles`, with a `gene` field
+    :return: Differences (see `compare_tables`)
+    """
+    t = t.select(gene=hl.or_missing(t.locus.position % 7 != 0, t.gene))
+    t = t.union(t.head(t.count() // 2))
+    input_path = hl.utils.new_temp_file(extension='ht')
+    t.add_index('row_id').write(input_path)
+
+    outputs = {}
+    for dedupe in ('off', 'on'):
+        output_path = annotate_variants(input_path,
+                                        gene_col='gene',
+                                        output_ht=hl.utils.new_temp_file(),
+                                        dedupe=dedupe)
+        outputs[dedupe] = hl.read_table(output_path).key_by('row_id')
+
+    expected, actual = outputs['off'], outputs['on']
+    diffs = compare_tables(expected, actual, list(expected.row_value))
+    if hl.eval(expected.globals) != hl.eval(actual.globals):
+        diffs['<globals>'] = 1
+    if expected.row.dtype != actual.row.dtype:
+        diffs['<row type>'] = 1
+    return diffs
+
+
+def check_rnaseq_engines() -> dict:
+    """
+    Compare the RNA-seq table built by the numpy engine against the hail engine, on the
+    synthetic CPM file (with missing values, and groups where all values are missing).
+
+    :return: Differences (see `compare_tables`)
+    """
+    expected = make_tables.create_rnaseq_tb(engine='hail')
+    actual = make_tables.create_rnaseq_tb(engine='numpy')
+
+    diffs = compare_tables(expected, actual, list(expected.row_value))
+    if hl.eval(expected.globals) != hl.eval(actual.globals):
+        diffs['<globals>'] = 1
+    if expected.row.dtype != actual.row.dtype:
+        diffs['<row type>'] = 1
+    return diffs
+
+
+# Checks: name -> function of the input table returning the differences
+CHECKS = {
+    'variant_bundle': check_variant_bundle,
+    'dedupe': check_dedupe,
+    'rnaseq_engines': lambda t: check_rnaseq_engines(),
+}
+
+
+def main(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    hl.init(master=f'local[{args.cores}]',
+            default_reference='GRCh38',
+            tmp_dir=os.path.join(args.work_dir, 'tmp'),
+            quiet=True)
+    dataset.source_dir = args.work_dir
+
+    # write the synthetic annotation tables (no benchmark is reported)
+    run_builders(args.work_dir, args.n_ref_variants, args.n_genes, pattern='^$')
+
+    input_path = os.path.join(args.work_dir, f'parity.input.{args.n_rows}.ht')
+    input_ht = synthetic.generate_variant_ht(args.n_rows, args.n_genes)
+    input_ht = annotate.annotate_ensembl_gene(input_ht, gene_symbol_col='gene').checkpoint(input_path,
+                                                                                            overwrite=True)
+
+    failed = False
+    for name, check in CHECKS.items():
+        diffs = check(input_ht)
+        if diffs:
+            failed = True
+            print(f'{name}: FAIL ' + ', '.join(f'{f}: {n} rows' for f, n in diffs.items()))
+        else:
+            print(f'{name}: OK')
+
+    hl.stop()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Check the optimized annotation paths against the '
+                                                 'per-source annotators.')
+
+    parser.add_argument('--work_dir', help='Directory for synthetic data and intermediate tables',
+                        type=str, required=True)
+
+    parser.add_argument('--n_rows', help='Number of input variants',
+                        type=int, default=10_000)
+
+    parser.add_argument('--n_ref_variants', help='Number of variants in the reference tables',
+                        type=int, default=10_000)
+
+    parser.add_argument('--n_genes', help='Number of genes in the reference tables',
+                        type=int, default=500)
+
+    parser.add_argument('--cores', help='Number of local Spark cores',
+                        type=int, default=4)
+
+    main(parser.parse_args())
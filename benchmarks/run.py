@@ -0,0 +1,272 @@
+"""
+Benchmark the hvantk table builders and annotators on synthetic data under local-mode Hail.
+
+Each `create_*_tb` builder is timed from mini raw sources (writing the annotation tables used
+by the annotators), then each `annotate_*` function is timed on synthetic variant tables of
+the requested sizes. Results (wall time, Spark jobs/stages, input/shuffle bytes, peak memory
+growth) are written to JSON. With `--baseline`, results are compared against a previous run and
+the command exits with status 1 if any benchmark regressed.
+
+All benchmarks run in one process, so memory is reported as the growth of the process peak
+during each benchmark (see `hvantk.utils.profiling.measure`), not as the process peak itself.
+
+Usage:
+    python -m benchmarks.run --work_dir /tmp/hvantk-bench --sizes 1k 100k -o results.json
+    python -m benchmarks.run --work_dir /tmp/hvantk-bench --sizes 1k 100k -o results.json \
+        --baseline baseline.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+import hail as hl
+
+from hvantk import settings
+from hvantk.utils import annotate, dataset, make_tables
+from hvantk.utils.profiling import measure
+from benchmarks import synthetic
+
+
+# Input variant table sizes
+SIZES = {'1k': 1_000, '100k': 100_000, '10M': 10_000_000}
+
+
+def _builders(raw_dir: str,
+              ht_dir: str) -> list:
+    """
+    Table builders to benchmark: (name, function returning the table, output table name).
+    Derived builders come last, as they read the tables written by the others. The pseudo-bulk
+    builder is left out if its single-cell matrix was not written (h5py not installed).
+    """
+
+    def _read(name):
+        return hl.read_table(f'{ht_dir}/{name}')
+
+    pseudobulk_path = os.path.join(raw_dir, synthetic.PSEUDOBULK_FILE)
+    pseudobulk = [
+        ('create_scell_pseudobulk_tb', lambda: make_tables.create_scell_pseudobulk_tb(pseudobulk_path),
+         'scell.pseudobulk.ht'),
+    ] if os.path.exists(pseudobulk_path) else []
+
+    return [
+        ('create_gnomad_constraint_gene_metrics_tb', make_tables.create_gnomad_constraint_gene_metrics_tb,
+         'gnomad.metrics.ht'),
+        ('create_interactome_tb', make_tables.create_interactome_tb, 'interactome.GRCh38.ht'),
+        ('create_gene_ensembl_ann_tb', make_tables.create_gene_ensembl_ann_tb, 'gene.ann.ensembl.ht'),
+        ('create_clinvar_tb', make_tables.create_clinvar_tb, 'clinvar.GRCh38.ht'),
+        ('create_gevir_tb', make_tables.create_gevir_tb, 'gevir.metrics.ht'),
+        ('create_scell_deg_tb', make_tables.create_scell_deg_tb, 'scell.heart.degs.ht'),
+        ('create_hca_tb', make_tables.create_hca_tb, 'hca.heart.ht'),
+        ('create_rnaseq_tb[hail]', lambda: make_tables.create_rnaseq_tb(engine='hail'), 'rnaseq.human.ht'),
+        ('create_rnaseq_tb[numpy]', lambda: make_tables.create_rnaseq_tb(engine='numpy'), 'rnaseq.human.ht'),
+        ('create_gnomad_af_tb', make_tables.create_gnomad_af_tb, 'gnomad_3.0_sites_AF.ht'),
+        ('create_dbnsfp_tb', make_tables.create_dbnsfp_tb, 'dbNSFP4.1a_transcript.ht'),
+    ] + pseudobulk + [
+        ('create_gene_alias_tb', lambda: make_tables.create_gene_alias_tb(_read('gene.ann.ensembl.ht')),
+         'gene.alias.ensembl.ht'),
+        ('create_dbnsfp_variant_tb', lambda: make_tables.create_dbnsfp_variant_tb(_read('dbNSFP4.1a_transcript.ht')),
+         'dbNSFP4.1a_variant.ht'),
+        ('create_variant_bundle_tb',
+         lambda: make_tables.create_variant_bundle_tb(clinvar_tb=_read('clinvar.GRCh38.ht'),
+                                                      gnomad_af_tb=_read('gnomad_3.0_sites_AF.ht'),
+                                                      dbnsfp_tb=_read('dbNSFP4.1a_variant.ht')),
+         'variant.bundle.GRCh38.ht'),
+        ('create_gene_features_tb',
+         lambda: make_tables.create_gene_features_tb(gene_ensembl_tb=_read('gene.ann.ensembl.ht'),
+                                                     gevir_tb=_read('gevir.metrics.ht'),
+                                                     rnaseq_tb=_read('rnaseq.human.ht'),
+                                                     gnomad_metrics_tb=_read('gnomad.metrics.ht'),
+                                                     hca_tb=_read('hca.heart.ht'),
+                                                     deg_tb=_read('scell.heart.degs.ht')),
+         'gene.features.ht'),
+    ]
+
+
+# Annotators to benchmark, applied to an input with `gene`, `GeneID` and `TranscriptID` fields
+ANNOTATORS = [
+    ('annotate_variant_id', lambda t: annotate.annotate_variant_id(t)),
+    ('annotate_clinvar_clnsig', lambda t: annotate.annotate_clinvar_clnsig(t)),
+    ('annotate_ccr', lambda t: annotate.annotate_ccr(t)),
+    ('annotate_ppi', lambda t: annotate.annotate_ppi(t)),
+    ('annotate_gnomad_af', lambda t: annotate.annotate_gnomad_af(t)),
+    ('annotate_dbnsfp_scores', lambda t: annotate.annotate_dbnsfp_scores(t, transcript_id_col='TranscriptID')),
+    ('annotate_variant_bundle', lambda t: annotate.annotate_variant_bundle(t, transcript_id_col='TranscriptID')),
+    ('annotate_gevir', lambda t: annotate.annotate_gevir(t, gene_id_col='GeneID')),
+    ('annotate_rnaseq_expression', lambda t: annotate.annotate_rnaseq_expression(t, gene_id_col='GeneID')),
+    ('annotate_gnomad_constraint_metrics',
+     lambda t: annotate.annotate_gnomad_constraint_metrics(t, transcript_id_col='TranscriptID')),
+    ('annotate_degs', lambda t: annotate.annotate_degs(t, gene_symbol_col='gene')),
+    ('annotate_hca', lambda t: annotate.annotate_hca(t, gene_id_col='GeneID')),
+    ('annotate_gene_features',
+     lambda t: annotate.annotate_gene_features(t, gene_id_col='GeneID', transcript_id_col='TranscriptID')),
+]
+
+
+def _selected(name: str,
+              pattern: str) -> bool:
+    return pattern is None or re.search(pattern, name) is not None
+
+
+def run_builders(work_dir: str,
+                 n_ref_variants: int,
+                 n_genes: int,
+                 pattern: str = None) -> list:
+    """
+    Generate the synthetic sources and benchmark the table builders.
+    All annotation tables are written, even for builders that are not selected.
+    """
+    raw_dir = os.path.join(work_dir, 'raw')
+    ht_dir = os.path.join(work_dir, 'data', 'ht')
+
+    synthetic.write_raw_sources(raw_dir, n_ref_variants, n_genes)
+    synthetic.write_annotation_tables(work_dir, n_ref_variants, n_genes)
+    settings.set_raw_data_path(raw_dir)
+
+    results = []
+    for name, builder, output in _builders(raw_dir, ht_dir):
+        with measure() as metrics:
+            builder().write(f'{ht_dir}/{output}', overwrite=True)
+        if _selected(name, pattern):
+            results.append({'name': name, 'kind': 'builder', 'n_rows': n_ref_variants, **metrics})
+            print(f'{name}: {metrics["wall_time_s"]:.2f}s', file=sys.stderr)
+
+    return results
+
+
+def run_annotators(work_dir: str,
+                   n_rows: int,
+                   n_genes: int,
+                   pattern: str = None) -> list:
+    """
+    Benchmark the annotators on a synthetic variant table with `n_rows` rows.
+    """
+    input_path = os.path.join(work_dir, f'input.{n_rows}.ht')
+    output_path = os.path.join(work_dir, 'output.ht')
+
+    synthetic.generate_variant_ht(n_rows, n_genes).write(input_path, overwrite=True)
+
+    results = []
+
+    # gene/transcript IDs are needed by the gene-level annotators
+    with measure() as metrics:
+        annotate.annotate_ensembl_gene(hl.read_table(input_path), gene_symbol_col='gene').write(
+            f'{input_path}.ensembl.ht', overwrite=True)
+    if _selected('annotate_ensembl_gene', pattern):
+        results.append({'name': 'annotate_ensembl_gene', 'kind': 'annotator', 'n_rows': n_rows, **metrics})
+
+    for name, annotator in ANNOTATORS:
+        if not _selected(name, pattern):
+            continue
+        with measure() as metrics:
+            annotator(hl.read_table(f'{input_path}.ensembl.ht')).write(output_path, overwrite=True)
+        results.append({'name': name, 'kind': 'annotator', 'n_rows': n_rows, **metrics})
+        print(f'{name} ({n_rows} rows): {metrics["wall_time_s"]:.2f}s', file=sys.stderr)
+
+    return results
+
+
+def compare(results: list,
+            baseline: list,
+            tolerance: float = 0.2,
+            min_seconds: float = 1.0) -> list:
+    """
+    Compare benchmark results against a baseline. A benchmark regresses if its wall time grew
+    by more than `tolerance` (relative) and `min_seconds` (absolute), or if its shuffle bytes
+    grew by more than `tolerance`.
+
+    :param results: Current results
+    :param baseline: Baseline results
+    :param tolerance: Relative tolerance
+    :param min_seconds: Absolute wall time tolerance (seconds), to ignore noise on fast benchmarks
+    :return: List of regression messages
+    """
+    base = {(r['name'], r['n_rows']): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get((r['name'], r['n_rows']))
+        if b is None:
+            continue
+        if (r['wall_time_s'] > b['wall_time_s'] * (1 + tolerance) and
+                r['wall_time_s'] - b['wall_time_s'] > min_seconds):
+            regressions.append(f"{r['name']} ({r['n_rows']} rows): wall time "
+                               f"{b['wall_time_s']:.2f}s -> {r['wall_time_s']:.2f}s")
+        for field in ('shuffle_read_bytes', 'shuffle_write_bytes'):
+            if field in r and field in b and r[field] > b[field] * (1 + tolerance):
+                regressions.append(f"{r['name']} ({r['n_rows']} rows): {field} {b[field]} -> {r[field]}")
+    return regressions
+
+
+def main(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    hl.init(master=f'local[{args.cores}]',
+            default_reference='GRCh38',
+            tmp_dir=os.path.join(args.work_dir, 'tmp'),
+            quiet=True)
+    dataset.source_dir = args.work_dir
+
+    results = run_builders(args.work_dir, args.n_ref_variants, args.n_genes, args.only)
+    for size in args.sizes:
+        results.extend(run_annotators(args.work_dir, SIZES[size], args.n_genes, args.only))
+
+    report = {'environment': {'hail': hl.version(),
+                              'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'cores': args.cores,
+                              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    hl.stop()
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        for msg in regressions:
+            print(f'REGRESSION: {msg}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark hvantk annotators and table builders.')
+
+    parser.add_argument('--work_dir', help='Directory for synthetic data and intermediate tables',
+                        type=str, required=True)
+
+    parser.add_argument('--sizes', help='Input variant table sizes',
+                        nargs='+', choices=list(SIZES), default=['1k', '100k'])
+
+    parser.add_argument('--n_ref_variants', help='Number of variants in the reference tables',
+                        type=int, default=100_000)
+
+    parser.add_argument('--n_genes', help='Number of genes in the reference tables',
+                        type=int, default=2_000)
+
+    parser.add_argument('--only', help='Regular expression selecting the benchmarks to report',
+                        type=str, default=None)
+
+    parser.add_argument('--cores', help='Number of local Spark cores',
+                        type=int, default=4)
+
+    parser.add_argument('-o', '--output', help='Output JSON file with results',
+                        type=str, default='benchmark_results.json')
+
+    parser.add_argument('--baseline', help='Baseline JSON file to compare against',
+                        type=str, default=None)
+
+    parser.add_argument('--tolerance', help='Relative tolerance before flagging a regression',
+                        type=float, default=0.2)
+
+    parser.add_argument('--min_seconds', help='Absolute wall time tolerance (seconds)',
+                        type=float, default=1.0)
+
+    main(parser.parse_args())
@@ -0,0 +1,368 @@
+"""
+Synthetic data for the hvantk benchmarks.
+
+Generates variant tables of any size, mini raw sources for the table builders in
+`hvantk.utils.make_tables` (laid out as `settings.RAW_DATA_FILES`, plus a single-cell h5ad
+matrix if h5py is installed) and mini annotation tables for the sources without a builder
+(laid out as expected by `dataset.source_dir`).
+
+All sources are derived from the same deterministic variant universe: variant `idx` has a
+fixed locus, alleles and gene, so that joins between inputs and references overlap.
+Reference tables use the even indices only, i.e. about half of the input variants are found.
+
+"""
+
+import gzip
+import os
+import random
+import shutil
+
+import hail as hl
+import numpy as np
+
+from hvantk.settings import RAW_DATA_FILES
+from hvantk.utils.make_tables import DBNSFP_SCORE_FIELDS
+
+
+CONTIGS = [f'chr{i}' for i in range(1, 23)]
+BASES = ['A', 'C', 'G', 'T']
+
+# positions per contig
+CONTIG_SPAN = 50_000_000
+POSITION_MULTIPLIER = 104_729
+
+ORGANS = ['Heart', 'Brain', 'Liver']
+TIME_POINTS = ['4wpc', '10wpc', 'P0']
+DEG_CLUSTERS = ['C0', 'C5', 'C7', 'C10', 'C14']
+N_HCA_CATEGORIES = 13
+CELL_TYPES = ['Cardiomyocyte', 'Fibroblast', 'Endothelial cell', 'Smooth muscle cell']
+N_CELLS = 2_000
+GNOMAD_AN = 152_312
+
+# single-cell matrix for `create_scell_pseudobulk_tb` (relative to the raw data directory)
+PSEUDOBULK_FILE = 'rnaseq-expression/scell_heart_pseudobulk.h5ad'
+
+
+def gene_symbol(i: int) -> str:
+    return f'GENE{i}'
+
+
+def gene_id(i: int) -> str:
+    return f'ENSG{i:011d}'
+
+
+def transcript_id(i: int) -> str:
+    return f'ENST{i:011d}'
+
+
+def protein_id(i: int) -> str:
+    return f'ENSP{i:011d}'
+
+
+def variant(idx: int, n_genes: int) -> tuple:
+    """
+    Return (contig, position, ref, alt, gene index) of variant `idx` of the universe.
+    Must match `_variant_exprs`.
+    """
+    ref = idx % 4
+    return (CONTIGS[idx % len(CONTIGS)],
+            1 + (idx * POSITION_MULTIPLIER) % CONTIG_SPAN,
+            BASES[ref],
+            BASES[(ref + 1 + (idx // 4) % 3) % 4],
+            idx % n_genes)
+
+
+def _variant_exprs(idx: hl.expr.Int64Expression,
+                   n_genes: int) -> dict:
+    """
+    Hail expressions for the locus, alleles and gene index of variant `idx`.
+    Must match `variant`.
+    """
+    ref = hl.int32(idx % 4)
+    bases = hl.literal(BASES)
+    return dict(locus=hl.locus(hl.literal(CONTIGS)[hl.int32(idx % len(CONTIGS))],
+                               hl.int32(1 + (idx * POSITION_MULTIPLIER) % CONTIG_SPAN),
+                               reference_genome='GRCh38'),
+                alleles=hl.array([bases[ref], bases[(ref + 1 + hl.int32((idx // 4) % 3)) % 4]]),
+                gene_idx=hl.int32(idx % n_genes))
+
+
+def _universe_ht(n_rows: int,
+                 n_genes: int,
+                 step: int = 1,
+                 n_partitions: int = None) -> hl.Table:
+    ht = hl.utils.range_table(n_rows, n_partitions=n_partitions)
+    ht = ht.annotate(**_variant_exprs(hl.int64(ht.idx) * step, n_genes))
+    return (ht
+            .key_by('locus', 'alleles')
+            .distinct())
+
+
+def generate_variant_ht(n_rows: int,
+                        n_genes: int,
+                        n_partitions: int = None) -> hl.Table:
+    """
+    Generate an input variant table keyed by `locus` and `alleles`, with a gene symbol field
+    `gene` (the layout expected by `annotate_features`).
+
+    :param n_rows: Number of variants
+    :param n_genes: Number of genes in the universe
+    :param n_partitions: Number of partitions
+    :return: Hail Table
+    """
+    ht = _universe_ht(n_rows, n_genes, n_partitions=n_partitions)
+    return ht.select(gene=hl.literal('GENE') + hl.str(ht.gene_idx))
+
+
+def _score(x: hl.expr.NumericExpression,
+           salt: int) -> hl.expr.Float64Expression:
+    """Deterministic pseudo-random score in [0, 1) from an integer expression."""
+    return hl.float64(((hl.int64(x) + salt) * 2_654_435_761) % 1_000_003) / 1_000_003
+
+
+def write_annotation_tables(source_dir: str,
+                            n_ref_variants: int,
+                            n_genes: int):
+    """
+    Write mini annotation tables for the sources without a builder in `make_tables`
+    (CCR, the CHD de novo table and the CHD gene set), with the paths used by
+    `hvantk.utils.dataset`.
+
+    :param source_dir: Data directory (see `dataset.source_dir`)
+    :param n_ref_variants: Number of reference variants
+    :param n_genes: Number of genes in the universe
+    """
+    ht_dir = f'{source_dir}/data/ht'
+
+    with _open(os.path.join(source_dir, 'resources', 'geneset', 'CHD_genes_all.tsv')) as f:
+        for g in range(0, n_genes, 10):
+            f.write(f'{gene_symbol(g)}\n')
+
+    ref_ht = _universe_ht(n_ref_variants, n_genes, step=2)
+
+    ccr_ht = (ref_ht
+              .key_by('locus')
+              .distinct())
+    ccr_ht = ccr_ht.select(ccr_pct=100 * _score(ccr_ht.idx, 1))
+    ccr_ht.write(f'{ht_dir}/ccr.GRCh38.ht', overwrite=True)
+
+    generate_variant_ht(1000, n_genes).write(
+        f'{ht_dir}/DNM_Jin2017_Sifrim2016_GRCh38_lift.ht', overwrite=True)
+
+
+def _open(path: str, mode: str = 'wt'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+def _export_bgz(path: str,
+                output_path: str,
+                **kwargs):
+    """
+    Block-gzip a plain text file through Hail (as expected by the `force_bgz` imports), also
+    for outputs named `.gz`. `kwargs` are passed to `hl.import_table`.
+    """
+    bgz_path = output_path if output_path.endswith('.bgz') else f'{path}.bgz'
+    hl.import_table(path, **kwargs).export(bgz_path, header=not kwargs.get('no_header', False))
+    if bgz_path != output_path:
+        hl.hadoop_copy(bgz_path, output_path)
+
+
+def _write_dbnsfp(path_pattern: str,
+                  variants: list,
+                  n_genes: int,
+                  rng: random.Random):
+    """
+    Write per-chromosome dbNSFP chunks. One variant in three has a second transcript and one in
+    eleven has none, and Polyphen2 scores are aligned with (one or two) UniProt isoforms.
+    """
+    tmp_dir = os.path.join(os.path.dirname(path_pattern), 'tmp')
+
+    def _values(n):
+        return ';'.join('.' if rng.random() < 0.1 else f'{rng.random():.3f}' for _ in range(n))
+
+    id_columns = ['Ensembl_transcriptid', 'Ensembl_proteinid', 'Uniprot_acc_Polyphen2', 'MutationTaster_AAE']
+    by_contig = {}
+    for i, v in enumerate(variants):
+        by_contig.setdefault(v[0], []).append((i, v))
+
+    for contig, contig_variants in by_contig.items():
+        chrom = contig[len('chr'):]
+        plain_path = os.path.join(tmp_dir, f'dbnsfp.{chrom}.tsv')
+        with _open(plain_path) as f:
+            f.write('\t'.join(['#chr', 'pos(1-based)', 'ref', 'alt'] + id_columns + list(DBNSFP_SCORE_FIELDS)) + '\n')
+            for i, (_, pos, ref, alt, g) in contig_variants:
+                transcripts = [] if i % 11 == 0 else [g] if i % 3 else [g, g + n_genes]
+                ids = {'Ensembl_transcriptid': [transcript_id(t) for t in transcripts],
+                       'Ensembl_proteinid': [protein_id(t) for t in transcripts],
+                       'Uniprot_acc_Polyphen2': [f'P{g:05d}-{k}' for k in range(1 + i % 2)],
+                       'MutationTaster_AAE': [f'{ref}{pos % 1000}{alt}']}
+                # one value per ID of the column the score is aligned with
+                n_values = [1 if col is None else len(ids[col]) for col in DBNSFP_SCORE_FIELDS.values()]
+                scores = [_values(n) if n else '.' for n in n_values]
+                f.write('\t'.join([chrom, str(pos), ref, alt] +
+                                   [';'.join(ids[col]) or '.' for col in id_columns] + scores) + '\n')
+        _export_bgz(plain_path, path_pattern.replace('*', chrom))
+
+    shutil.rmtree(tmp_dir)
+
+
+def _write_gnomad_af(path_pattern: str,
+                     variants: list,
+                     rng: random.Random):
+    """
+    Write per-chromosome gnomad sites VCFs. One site in ten is multi-allelic.
+    """
+    tmp_dir = os.path.join(os.path.dirname(path_pattern), 'tmp')
+
+    header = ('##fileformat=VCFv4.2\n'
+              '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count">\n'
+              '##INFO=<ID=AN,Number=1,Type=Integer,Description="Total number of alleles">\n'
+              '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">\n'
+              '##INFO=<ID=AF_popmax,Number=A,Type=Float,Description="Maximum allele frequency">\n'
+              '##INFO=<ID=popmax,Number=A,Type=String,Description="Population with maximum AF">\n'
+              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+    by_contig = {}
+    for i, v in enumerate(variants):
+        by_contig.setdefault(v[0], []).append((i, v))
+
+    for contig, contig_variants in by_contig.items():
+        plain_path = os.path.join(tmp_dir, f'gnomad.{contig}.vcf')
+        with _open(plain_path) as f:
+            f.write(header)
+            for i, (_, pos, ref, alt, _) in contig_variants:
+                alts = [alt] if i % 10 else [alt, next(b for b in BASES if b not in (ref, alt))]
+                acs = [rng.randint(1, 1000) for _ in alts]
+                f.write(f'{contig}\t{pos}\t.\t{ref}\t{",".join(alts)}\t.\t'
+                        f'{"PASS" if i % 20 else "AC0"}\t'
+                        f'AC={",".join(map(str, acs))};AN={GNOMAD_AN};'
+                        f'AF={",".join(f"{ac / GNOMAD_AN:.3e}" for ac in acs)};'
+                        f'AF_popmax={",".join(f"{min(2 * ac / GNOMAD_AN, 1):.3e}" for ac in acs)};'
+                        f'popmax={",".join(rng.choice(["afr", "amr", "nfe"]) for _ in alts)}\n')
+        # one field per line: the VCF is copied verbatim
+        _export_bgz(plain_path, path_pattern.replace('*', contig), no_header=True, delimiter='\x01', quote=None,
+                    missing='\x01')
+
+    shutil.rmtree(tmp_dir)
+
+
+def write_pseudobulk_matrix(path: str,
+                            n_genes: int,
+                            seed: int = 0) -> bool:
+    """
+    Write a dense cell x gene h5ad matrix with `CELL_TYPES` cell type labels, for
+    `create_scell_pseudobulk_tb`. Gene IDs are versioned, and one gene in fifty has a second
+    (PAR) copy with the same ID once versions are stripped.
+
+    :param path: Output .h5ad file
+    :param n_genes: Number of genes
+    :param seed: Random seed
+    :return: False if h5py is not installed (nothing is written)
+    """
+    try:
+        import h5py
+    except ImportError:
+        return False
+
+    rng = np.random.default_rng(seed)
+    gene_ids = [f'{gene_id(g)}.1' for g in range(n_genes)] + \
+               [f'{gene_id(g)}.1_PAR_Y' for g in range(0, n_genes, 50)]
+    counts = rng.poisson(0.5, size=(N_CELLS, len(gene_ids))).astype(np.float32)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with h5py.File(path, 'w') as h5:
+        h5.create_dataset('X', data=counts)
+        var = h5.create_group('var')
+        var.attrs['_index'] = '_index'
+        var.create_dataset('_index', data=np.array(gene_ids, dtype='S'))
+        obs = h5.create_group('obs')
+        obs.attrs['_index'] = '_index'
+        obs.create_dataset('_index', data=np.array([f'cell{i}' for i in range(N_CELLS)], dtype='S'))
+        obs.create_dataset('CellType', data=np.array([CELL_TYPES[i % len(CELL_TYPES)] for i in range(N_CELLS)],
+                                                     dtype='S'))
+    return True
+
+
+def write_raw_sources(raw_dir: str,
+                      n_ref_variants: int,
+                      n_genes: int,
+                      seed: int = 0):
+    """
+    Write mini raw source files for the table builders in `make_tables`, with the paths of
+    `settings.RAW_DATA_FILES` relative to `raw_dir`.
+
+    :param raw_dir: Raw data directory
+    :param n_ref_variants: Number of reference variants (Clinvar and interactome are subsets)
+    :param n_genes: Number of genes
+    :param seed: Random seed
+    """
+    rng = random.Random(seed)
+    paths = {k: os.path.join(raw_dir, v) for k, v in RAW_DATA_FILES.items()}
+
+    # sorted reference variants (even indices of the universe)
+    variants = sorted((variant(2 * i, n_genes) for i in range(n_ref_variants)),
+                      key=lambda v: (CONTIGS.index(v[0]), v[1]))
+
+    with _open(paths['interactome_path']) as f:
+        for contig, pos, _, _, _ in variants[::10]:
+            f.write(f'{contig}\t{pos - 1}\t{pos + 10}\n')
+
+    with _open(paths['clinvar_path']) as f:
+        f.write('##fileformat=VCFv4.2\n'
+                '##INFO=<ID=CLNSIG,Number=.,Type=String,Description="Clinical significance">\n'
+                '##INFO=<ID=CLNDN,Number=.,Type=String,Description="Disease name">\n'
+                '##INFO=<ID=GENEINFO,Number=1,Type=String,Description="Gene">\n'
+                '##INFO=<ID=MC,Number=.,Type=String,Description="Molecular consequence">\n'
+                '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        labels = ['Pathogenic', 'Likely_pathogenic', 'Benign', 'Likely_benign', 'Uncertain_significance']
+        for contig, pos, ref, alt, g in variants[::5]:
+            f.write(f'{contig}\t{pos}\t.\t{ref}\t{alt}\t.\t.\t'
+                    f'CLNSIG={rng.choice(labels)};CLNDN=not_provided;GENEINFO={gene_symbol(g)}:{g};'
+                    f'MC=SO:0001583|missense_variant\n')
+
+    with _open(paths['rnaseq_path']) as f:
+        samples = [f'{o}.{tp}.{r}' for o in ORGANS for tp in TIME_POINTS for r in (1, 2)]
+        f.write(' '.join(['"Gene"'] + [f'"{s}"' for s in samples]) + '\n')
+        for g in range(n_genes):
+            # some missing values, and genes with all values of the first organ/time point missing
+            values = ['NA' if rng.random() < 0.05 or (g % 97 == 0 and i < 2) else f'{rng.random() * 100:.3f}'
+                      for i in range(len(samples))]
+            f.write(' '.join([f'"{gene_id(g)}"'] + values) + '\n')
+
+    with _open(paths['gene_ann_path']) as f:
+        f.write('GeneID\tTranscriptID\tGene\tGene_Synonym\n')
+        for g in range(n_genes):
+            # SYN<g // 2> makes pairs of genes share an (ambiguous) alias
+            for synonym in (f'SYN{g}', f'SYN{g // 2}'):
+                f.write(f'{gene_id(g)}\t{transcript_id(g)}\t{gene_symbol(g)}\t{synonym}\n')
+
+    # bgzipped source: written as plain text and exported through Hail (block gzip)
+    gnomad_tsv = os.path.join(raw_dir, 'gnomad', 'gnomad_metrics.tsv')
+    with _open(gnomad_tsv) as f:
+        f.write('transcript\tgene\toe_lof_upper\toe_mis_upper\n')
+        for g in range(n_genes):
+            f.write(f'{transcript_id(g)}\t{gene_symbol(g)}\t{rng.random() * 2:.3f}\t{rng.random() * 2:.3f}\n')
+    hl.import_table(gnomad_tsv).export(paths['gnomad_metrics_path'])
+
+    with _open(paths['gevir_path']) as f:
+        f.write('gene_id\tgene_name\tgevir_pct\tvirlof_pct\n')
+        for g in range(n_genes):
+            f.write(f'{gene_id(g)}\t{gene_symbol(g)}\t{rng.random() * 100:.2f}\t{rng.random() * 100:.2f}\n')
+
+    with _open(paths['scell_heart_path']) as f:
+        f.write('gene\tcluster_id\tCluster_name\n')
+        for g in range(0, n_genes, 3):
+            for c in rng.sample(DEG_CLUSTERS, 2):
+                f.write(f'{gene_symbol(g)}\t{c}\tcluster_{c}\n')
+
+    with _open(paths['scell_hca_path']) as f:
+        f.write('name\tname2\texpScores\n')
+        for g in range(n_genes):
+            scores = ','.join(f'{rng.random():.4f}' for _ in range(N_HCA_CATEGORIES))
+            f.write(f'{gene_symbol(g)}\t{gene_id(g)}.1\t{scores},\n')
+
+    _write_dbnsfp(paths['dbnsfp_path'], variants, n_genes, rng)
+    _write_gnomad_af(paths['gnomad_af_path'], variants, rng)
+
+    write_pseudobulk_matrix(os.path.join(raw_dir, PSEUDOBULK_FILE), n_genes, seed)
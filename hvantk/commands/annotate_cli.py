@@ -0,0 +1,412 @@
+"""
+Annotate variant tables with features from multiple sources.
+
+`hvantk annotate` runs the annotation in-process, or submits it (--server) to a long-running
+`hvantk serve` daemon. The daemon keeps one initialized Hail backend and warm reference-table
+handles, so that repeated small jobs do not pay for the JVM/Spark startup. Requests read and
+write files with the daemon's privileges, so they must carry the token the daemon writes to a
+token file readable by its owner only, and the daemon binds to loopback addresses unless
+remote access is explicitly allowed.
+
+`hvantk lookup` annotates small variant lists with variant-level features from a local SQLite
+index (see `hvantk.utils.variant_index`), without Hail.
+
+"""
+
+import csv
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from hvantk.settings import CONTEXT_SETTINGS
+
+# Hail is imported when a command runs, not at module load (see hvantk.hvantk.LazyGroup).
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+DEFAULT_TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.hvantk', 'serve.token')
+
+# Parameters of `annotate_variants` accepted in annotate requests
+ANNOTATE_PARAMS = ('variant_ht', 'gene_col', 'output_ht', 'use_bundle', 'use_gene_features', 'broadcast',
+                   'no_interval_pushdown', 'write_to_file', 'report', 'explain', 'cache', 'run_dir',
+                   'checkpoint_stages', 'dedupe')
+
+logger = logging.getLogger(__name__)
+
+
+def _set_source_dir(source_dir: str):
+    from hvantk.utils import dataset
+
+    if source_dir is not None:
+        dataset.source_dir = source_dir
+
+
+def write_token_file(path: str) -> str:
+    """
+    Generate a random daemon token and write it to `path`, readable and writable by the
+    owner only (0600).
+
+    :param path: Token file path
+    :return: Token
+    """
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+
+def read_token_file(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def is_loopback_host(host: str) -> bool:
+    """
+    Check whether a host name or address resolves to a loopback address.
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (socket.error, ValueError):
+        return False
+
+
+def warm_reference_tables():
+    """
+    Open the reference tables used by the annotators, so that their handles (and schemas)
+    are in the process-level table cache before the first request. Missing tables are skipped.
+    """
+    from hvantk.utils import dataset
+
+    getters = (dataset.get_gene_alias_ht, dataset.get_clinvar_ht, dataset.get_ccr_ht, dataset.get_gnomad_af_ht,
+               dataset.get_ppi_ht, dataset.get_dbnsfp_scores_ht, dataset.get_variant_bundle_ht,
+               dataset.get_gevir_ht, dataset.get_gene_expression_ht, dataset.get_gnomad_metrics_ht,
+               dataset.get_hca_ht, dataset.get_gene_features_ht)
+    for getter in getters:
+        try:
+            getter()
+        except Exception as e:
+            logger.info(f'Skipping reference table ({getter.__name__}): {e}')
+
+
+def run_annotate_request(request: dict) -> dict:
+    """
+    Run an annotate request on the current Hail backend.
+
+    :param request: Keyword arguments of `annotate_variants` (see `ANNOTATE_PARAMS`). With a list
+        of several `variant_ht` paths, the tables are annotated in one pass (see `annotate_variant_tables`).
+    :return: Response dict with `status`, `output_ht` (path, or list of paths) and `wall_time_s`
+    """
+    from hvantk.commands.annotate_features import annotate_variants, annotate_variant_tables
+
+    unknown = set(request) - set(ANNOTATE_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown annotate parameters: {", ".join(sorted(unknown))}')
+
+    start = time.perf_counter()
+    request = dict(request)
+    variant_ht = request.pop('variant_ht')
+    if isinstance(variant_ht, list) and len(variant_ht) > 1:
+        request.pop('dedupe', None)
+        output_ht = annotate_variant_tables(variant_ht, **request)
+    else:
+        output_ht = annotate_variants(variant_ht[0] if isinstance(variant_ht, list) else variant_ht, **request)
+    return {'status': 'ok',
+            'output_ht': output_ht,
+            'wall_time_s': time.perf_counter() - start}
+
+
+class _AnnotateHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of the annotation daemon:
+        GET  /health    -> daemon status
+        POST /annotate  -> run an annotate request (JSON body, see `run_annotate_request`)
+    Requests without the daemon token (`Authorization: Bearer <token>`) are rejected.
+    """
+
+    def _authorized(self) -> bool:
+        expected = f'Bearer {self.server.token}'
+        if hmac.compare_digest(self.headers.get('Authorization', ''), expected):
+            return True
+        self._reply(401, {'status': 'error', 'error': 'Missing or invalid token'})
+        return False
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != '/health':
+            self._reply(404, {'status': 'error', 'error': f'Not found: {self.path}'})
+            return
+        with self.server.jobs_lock:
+            jobs_done = self.server.jobs_done
+        self._reply(200, {'status': 'ok',
+                          'jobs_done': jobs_done,
+                          'uptime_s': time.perf_counter() - self.server.start_time})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path != '/annotate':
+            self._reply(404, {'status': 'error', 'error': f'Not found: {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            self._reply(400, {'status': 'error', 'error': f'Invalid request: {e}'})
+            return
+
+        with self.server.job_slots:
+            try:
+                response = run_annotate_request(request)
+            except (Exception, SystemExit) as e:
+                logger.exception('Annotate request failed')
+                self._reply(500, {'status': 'error', 'error': str(e)})
+                return
+        with self.server.jobs_lock:
+            self.server.jobs_done += 1
+        self._reply(200, response)
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+def serve(host: str = DEFAULT_HOST,
+          port: int = DEFAULT_PORT,
+          jobs: int = 1,
+          source_dir: str = None,
+          token_file: str = DEFAULT_TOKEN_FILE,
+          allow_remote: bool = False):
+    """
+    Initialize Hail once and serve annotate requests over HTTP until interrupted. A new token
+    is written to `token_file` (mode 0600) and required on every request; the file is removed
+    on shutdown.
+
+    :param host: Host to bind (loopback only, unless `allow_remote` is set)
+    :param port: Port to bind
+    :param jobs: Maximum number of annotate requests run concurrently on the shared backend
+    :param source_dir: Directory with the annotation tables (`data/ht`)
+    :param token_file: Path of the token file
+    :param allow_remote: Allow binding to a non-loopback address
+    """
+    if not allow_remote and not is_loopback_host(host):
+        raise ValueError(f'Refusing to bind to non-loopback host {host} (use --allow_remote to serve '
+                         f'other machines)')
+
+    import hail as hl
+
+    hl.init(default_reference='GRCh38')
+    try:
+        _set_source_dir(source_dir)
+        warm_reference_tables()
+
+        server = ThreadingHTTPServer((host, port), _AnnotateHandler)
+        server.token = write_token_file(token_file)
+        server.job_slots = threading.Semaphore(max(jobs, 1))
+        # handler threads update the job counter concurrently
+        server.jobs_lock = threading.Lock()
+        server.jobs_done = 0
+        server.start_time = time.perf_counter()
+
+        logger.info(f'Serving annotate requests on http://{host}:{port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(token_file)
+    finally:
+        hl.stop()
+
+
+def submit_annotate_request(server_url: str,
+                            request: dict,
+                            token: str,
+                            timeout: float = None) -> dict:
+    """
+    Submit an annotate request to a `hvantk serve` daemon and wait for the response.
+
+    :param server_url: Daemon URL (e.g. http://127.0.0.1:8642)
+    :param request: Keyword arguments of `annotate_variants`
+    :param token: Daemon token (see `serve`)
+    :param timeout: Timeout in seconds (None: wait until done)
+    :return: Response dict
+    """
+    req = urllib.request.Request(f'{server_url.rstrip("/")}/annotate',
+                                 data=json.dumps(request).encode(),
+                                 headers={'Content-Type': 'application/json',
+                                          'Authorization': f'Bearer {token}'},
+                                 method='POST')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return json.load(r)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def _local_path(path: str) -> str:
+    # paths are resolved by the daemon, so make local relative paths absolute
+    if path is None or '://' in path:
+        return path
+    return os.path.abspath(path)
+
+
+@click.command('serve', short_help='Serve annotate requests from a persistent Hail session.')
+@click.option('--host', default=DEFAULT_HOST, type=str,
+              help='Host to bind.')
+@click.option('--port', default=DEFAULT_PORT, type=int,
+              help='Port to bind.')
+@click.option('--jobs', default=1, type=int,
+              help='Number of annotate requests run concurrently on the shared Hail backend.')
+@click.option('--source_dir', default=None, type=str,
+              help='Directory with the annotation tables (data/ht).')
+@click.option('--token_file', default=DEFAULT_TOKEN_FILE, type=str,
+              help='File the request token is written to (readable by the current user only).')
+@click.option('--allow_remote', is_flag=True,
+              help='Allow binding --host to a non-loopback address. Anyone with the token can then read and '
+                   'write files as the daemon user.')
+def serve_cli(host, port, jobs, source_dir, token_file, allow_remote):
+    if not allow_remote and not is_loopback_host(host):
+        raise click.BadParameter(f'{host} is not a loopback address (pass --allow_remote to bind to it)',
+                                 param_hint="'--host'")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    serve(host=host, port=port, jobs=jobs, source_dir=source_dir, token_file=token_file,
+          allow_remote=allow_remote)
+
+
+@click.command('annotate', short_help='Annotate a variant table with features from multiple sources.')
+@click.option('-i', '--variant_ht', type=str, required=True, multiple=True,
+              help='Path to HailTable with variants and gene symbol keyed by `locus` and `alleles`. Repeat to '
+                   'annotate the distinct variants of several tables in one pass (one output per table).')
+@click.option('--gene_col', type=str, required=True,
+              help='Name of gene symbol column in input HailTable.')
+@click.option('-o', '--output_ht', type=str, required=True,
+              help='Path to output directory for the HailTable with features annotations.')
+@click.option('--use_bundle', is_flag=True,
+              help='Annotate variant-level features from the pre-joined variant bundle.')
+@click.option('--use_gene_features', is_flag=True,
+              help='Annotate gene-level features from the consolidated gene feature table.')
+@click.option('--broadcast', default='auto', type=click.Choice(['auto', 'on', 'off']),
+              help='Broadcast small gene-level reference tables as in-memory lookups instead of joining.')
+@click.option('--no_interval_pushdown', is_flag=True,
+              help='Always read the full variant-level reference tables, even for small inputs.')
+@click.option('-wf', '--write_to_file', is_flag=True,
+              help='Write output to BGZ-compressed file.')
+@click.option('--report', default=None, type=str,
+              help='Run the annotation stage by stage and write a run report to <REPORT>.json/.html.')
+@click.option('--explain', is_flag=True,
+              help='Include the Hail table IR of every stage in the run report.')
+@click.option('--cache', default=None, type=str,
+              help='Feature cache directory: annotate only variants not in the cache, and add them to it.')
+@click.option('--dedupe', default='off', type=click.Choice(['auto', 'on', 'off']),
+              help='Annotate distinct variants (and genes) only and join the features back to the input rows '
+                   '(auto: if the input has duplicate keys, checked with an extra pass over the input).')
+@click.option('--run_dir', default=None, type=str,
+              help='Run directory for stage checkpoints; a rerun of a failed run resumes after its last checkpoint.')
+@click.option('--checkpoint_stages', type=str, multiple=True,
+              help='Name of a stage to checkpoint in --run_dir (repeatable, default: all).')
+@click.option('--source_dir', default=None, type=str,
+              help='Directory with the annotation tables (data/ht). Ignored with --server.')
+@click.option('--server', default=None, type=str,
+              help='Submit to a running `hvantk serve` daemon (e.g. http://127.0.0.1:8642) '
+                   'instead of starting Hail.')
+@click.option('--token_file', default=DEFAULT_TOKEN_FILE, type=str,
+              help='Token file written by `hvantk serve` (with --server).')
+@click.pass_context
+def annotate_cli(ctx, variant_ht, gene_col, output_ht, use_bundle, use_gene_features, broadcast,
+                 no_interval_pushdown, write_to_file, report, explain, cache, dedupe, run_dir, checkpoint_stages,
+                 source_dir, server, token_file):
+
+    request = dict(variant_ht=list(variant_ht),
+                   gene_col=gene_col,
+                   output_ht=output_ht,
+                   use_bundle=use_bundle,
+                   use_gene_features=use_gene_features,
+                   broadcast=broadcast,
+                   no_interval_pushdown=no_interval_pushdown,
+                   write_to_file=write_to_file,
+                   report=report,
+                   explain=explain,
+                   cache=cache,
+                   dedupe=dedupe,
+                   run_dir=run_dir,
+                   checkpoint_stages=list(checkpoint_stages) or None)
+
+    if server is not None:
+        for k in ('output_ht', 'report', 'cache', 'run_dir'):
+            request[k] = _local_path(request[k])
+        request['variant_ht'] = [_local_path(p) for p in request['variant_ht']]
+        response = submit_annotate_request(server, request, read_token_file(token_file))
+    else:
+        import hail as hl
+
+        hl.init(default_reference='GRCh38')
+        try:
+            _set_source_dir(source_dir)
+            response = run_annotate_request(request)
+        finally:
+            hl.stop()
+
+    if response['status'] != 'ok':
+        click.echo(f'Annotation failed: {response["error"]}', err=True)
+        ctx.exit(1)
+    output_ht = response['output_ht']
+    click.echo(f'{", ".join(output_ht) if isinstance(output_ht, list) else output_ht} '
+               f'({response["wall_time_s"]:.2f}s)')
+
+
+@click.command('lookup', short_help='Annotate a small variant list from a local variant index (no Spark).')
+@click.option('--index', 'index_path', type=str, required=True,
+              help='Path to the SQLite variant index (see `hvantk mktables --variant_index`).')
+@click.option('-i', '--input_tsv', type=str, required=True,
+              help='TSV file (with header) with a variant ID column (chr:position:ref:alt).')
+@click.option('-o', '--output_tsv', type=str, required=True,
+              help='Output TSV file with the input columns and the variant-level annotations.')
+@click.option('--variant_col', default='vid', type=str,
+              help='Name of the variant ID column.')
+@click.option('--transcript_col', default=None, type=str,
+              help='Name of the Ensembl transcript ID column, to annotate dbNSFP scores.')
+def lookup_cli(index_path, input_tsv, output_tsv, variant_col, transcript_col):
+    from hvantk.utils.variant_index import VariantIndex, parse_variant_id
+
+    with open(input_tsv, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+
+    variants = [parse_variant_id(r[variant_col]) for r in rows]
+    transcript_ids = [r[transcript_col] for r in rows] if transcript_col is not None else None
+
+    start = time.perf_counter()
+    with VariantIndex(index_path) as index:
+        annotations = index.annotate(variants, transcript_ids=transcript_ids)
+    elapsed = time.perf_counter() - start
+
+    with open(output_tsv, 'w', newline='') as f:
+        fields = list(rows[0]) + list(annotations[0]) if rows else [variant_col]
+        writer = csv.DictWriter(f, fieldnames=fields, delimiter='\t')
+        writer.writeheader()
+        for row, ann in zip(rows, annotations):
+            writer.writerow({**row, **{k: 'NA' if v is None else v for k, v in ann.items()}})
+
+    click.echo(f'{output_tsv} ({len(rows)} variants, {elapsed * 1000:.1f}ms)')
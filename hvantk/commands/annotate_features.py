@@ -4,7 +4,9 @@
 
 import argparse
 import sys
+import time
 
+import click
 import hail as hl
 
 from hvantk.utils.annotate import (annotate_ccr,
@@ -18,12 +20,38 @@ from hvantk.utils.annotate import (annotate_ccr,
                                    annotate_degs,
                                    annotate_variant_id,
                                    annotate_clinvar_clnsig,
-                                   annotate_hca)
+                                   annotate_hca,
+                                   annotate_variant_bundle,
+                                   annotate_gene_features,
+                                   get_locus_intervals,
+                                   get_copartition_intervals)
+from hvantk.utils import dataset
+from hvantk.utils.io import (FEATURE_CACHE_GLOBAL,
+                             feature_cache_lock,
+                             get_feature_cache_current,
+                             get_reference_versions,
+                             get_run_fingerprint,
+                             read_feature_cache,
+                             remove_run_checkpoints,
+                             run_stages_resumable,
+                             write_feature_cache)
+from hvantk.utils.profiling import (measure,
+                                    run_stages,
+                                    write_report)
 
 
 project_dir = None
 out_path = f'{project_dir}/data/features'
 
+# Gene symbol field of the feature cache
+FEATURE_CACHE_GENE_FIELD = 'gene_symbol'
+
+# Gene key field of the distinct annotations (see `gene_join_key`)
+GENE_KEY_FIELD = 'gene_key'
+
+# Gene-level stages: on deduplicated inputs, they run once per distinct gene
+GENE_LEVEL_STAGES = ('gene_features', 'gevir', 'rnaseq', 'gnomad_constraint', 'hca', 'degs')
+
 """
 Annotate variant table with features from multiple sources.
 
@@ -40,76 +68,631 @@ def check_variant_tb(t: hl.Table,
         sys.exit(f'Expected table with at least `locus`, `alleles` and {gene_col} fields.')
 
 
-def main(args):
-    # Init Hail
-    hl.init(default_reference='GRCh38')
-
+def _ref(name: str) -> str:
+    return f'{dataset.source_dir}/data/ht/{name}'
+
+
+def get_annotation_stages(gene_col: str,
+                          use_bundle: bool = False,
+                          use_gene_features: bool = False,
+                          intervals: list = None,
+                          broadcast: bool = None) -> list:
+    """
+    Build the annotation pipeline as a list of stages.
+
+    :param gene_col: Name of gene symbol column in the input table
+    :param use_bundle: Annotate variant-level features from the pre-joined variant bundle
+    :param use_gene_features: Annotate gene-level features from the consolidated gene feature table
+    :param intervals: Locus intervals covered by the input (for interval pushdown), or None
+    :param broadcast: Broadcast small gene-level reference tables (None: decide by table size)
+    :return: List of (name, function Table -> Table, list of reference table paths)
+    """
+    stages = [
+        # filter to bi-allelic variants
+        ('filter_biallelic', lambda t: t.filter(hl.len(t.alleles) == 2), []),
+
+        # annotate variant ID from locus and alleles
+        ('variant_id', annotate_variant_id, []),
+
+        # annotate gene/transcript ensembl IDs
+        ('ensembl_gene',
+         lambda t: annotate_ensembl_gene(t, gene_symbol_col=gene_col, broadcast=broadcast),
+         [_ref('gene.alias.ensembl.ht')]),
+    ]
+
+    if use_bundle:
+        # annotate clinvar, gnomad af and deleterious scores from the pre-joined variant
+        # bundle (single join), and ccr and interactome sites by locus
+        stages.append(('variant_bundle',
+                       lambda t: annotate_variant_bundle(t,
+                                                         transcript_id_col='TranscriptID',
+                                                         intervals=intervals),
+                       [_ref('variant.bundle.GRCh38.ht'), _ref('ccr.GRCh38.ht'), _ref('interactome.GRCh38.ht')]))
+    else:
+        stages.extend([
+            # annotate clinvar significance
+            ('clinvar', lambda t: annotate_clinvar_clnsig(t, intervals=intervals),
+             [_ref('clinvar.GRCh38.ht')]),
+
+            # annotate ccr
+            ('ccr', lambda t: annotate_ccr(t, intervals=intervals),
+             [_ref('ccr.GRCh38.ht')]),
+
+            # annotate gnomad af
+            ('gnomad_af', lambda t: annotate_gnomad_af(t, intervals=intervals),
+             [_ref('gnomad_3.0_sites_AF.ht')]),
+
+            # annotate interactome sites
+            ('ppi', annotate_ppi,
+             [_ref('interactome.GRCh38.ht')]),
+
+            # annotate deleterious scores
+            ('dbnsfp', lambda t: annotate_dbnsfp_scores(t,
+                                                        transcript_id_col='TranscriptID',
+                                                        intervals=intervals),
+             [_ref('dbNSFP4.1a_transcript.ht'), _ref('dbNSFP4.1a_variant.ht')]),
+        ])
+
+    if use_gene_features:
+        # annotate gevir, rnaseq expression, gnomad constraint metrics and HCA
+        # from the consolidated gene feature table (single lookup)
+        stages.append(('gene_features',
+                       lambda t: annotate_gene_features(t,
+                                                        gene_id_col='GeneID',
+                                                        transcript_id_col='TranscriptID',
+                                                        clusters=None,
+                                                        broadcast=broadcast),
+                       [_ref('gene.features.ht')]))
+    else:
+        stages.extend([
+            # annotate gvir
+            ('gevir', lambda t: annotate_gevir(t, gene_id_col='GeneID', broadcast=broadcast),
+             [_ref('gevir.metrics.ht')]),
+
+            # annotate rnaseq expression
+            ('rnaseq', lambda t: annotate_rnaseq_expression(t, gene_id_col='GeneID', broadcast=broadcast),
+             [_ref('rnaseq.human.ht')]),
+
+            # annotate gnomad constraint metrics
+            ('gnomad_constraint',
+             lambda t: annotate_gnomad_constraint_metrics(t, transcript_id_col='TranscriptID', broadcast=broadcast),
+             [_ref('gnomad.metrics.ht')]),
+
+            # annotate HCA
+            # ('degs', lambda t: annotate_degs(t, gene_symbol_col=gene_col), [_ref('scell.heart.degs.ht')]),
+            ('hca', lambda t: annotate_hca(t, gene_id_col='GeneID', broadcast=broadcast),
+             [_ref('hca.heart.ht')]),
+        ])
+
+    return stages
+
+
+def _run_annotation(ht: hl.Table,
+                    gene_col: str,
+                    use_bundle: bool = False,
+                    use_gene_features: bool = False,
+                    broadcast: str = 'auto',
+                    no_interval_pushdown: bool = False,
+                    report: str = None,
+                    explain: bool = False,
+                    checkpoint_dir: str = None,
+                    checkpoint_stages: list = None,
+                    stage_filter=None) -> tuple:
+    """
+    Run the annotation stages on a variant table, lazily, or stage by stage if a run report
+    is requested. With a checkpoint directory, the selected stages are checkpointed and the
+    run resumes after the last valid checkpoint (see `run_stages_resumable`).
+
+    :param stage_filter: Function selecting the stages to run by name (default: all stages)
+    :return: Annotated Hail Table and list of stage reports (None without report)
+    """
+    # broadcast small gene-level reference tables (None: decide by table size)
+    broadcast = {'auto': None, 'on': True, 'off': False}[broadcast]
+
+    # locus intervals covered by the input, used to read only the overlapping
+    # partitions of the variant-level reference tables (None for large inputs)
+    intervals = None if no_interval_pushdown else get_locus_intervals(ht)
+
+    stages = get_annotation_stages(gene_col,
+                                   use_bundle=use_bundle,
+                                   use_gene_features=use_gene_features,
+                                   intervals=intervals,
+                                   broadcast=broadcast)
+    if stage_filter is not None:
+        stages = [stage for stage in stages if stage_filter(stage[0])]
+
+    if report is None:
+        if checkpoint_dir is not None:
+            return run_stages_resumable(ht, stages, checkpoint_dir, checkpoint_stages), None
+        for _, fn, _ in stages:
+            ht = fn(ht)
+        return ht, None
+
+    if checkpoint_dir is not None:
+        print('Stage checkpoints are not resumable in report mode: running all stages')
+
+    # run and measure stage by stage
+    return run_stages(ht,
+                      stages,
+                      explain=explain)
+
+
+def check_checkpoint_stages(checkpoint_stages: list,
+                            gene_col: str,
+                            use_bundle: bool = False,
+                            use_gene_features: bool = False):
+    """
+    Check that the stages to checkpoint exist in the annotation pipeline, before any work is
+    done (on the distinct path, names are later split between the variant and gene pipelines,
+    where unknown names would be dropped silently).
+
+    :param checkpoint_stages: Names of the stages to checkpoint, or None (all stages)
+    :raises click.BadParameter: If a name is not an annotation stage
+    """
+    if checkpoint_stages is None:
+        return
+    names = [name for name, _, _ in get_annotation_stages(gene_col,
+                                                          use_bundle=use_bundle,
+                                                          use_gene_features=use_gene_features)]
+    unknown = set(checkpoint_stages) - set(names)
+    if unknown:
+        raise click.BadParameter(f'unknown stages: {", ".join(sorted(unknown))}. '
+                                 f'Available stages: {", ".join(names)}',
+                                 param_hint="'--checkpoint_stages'")
+
+
+def get_checkpoint_dir(run_dir: str,
+                       variant_hts: list,
+                       gene_col: str,
+                       use_bundle: bool = False,
+                       use_gene_features: bool = False,
+                       cache: str = None) -> str:
+    """
+    Return the checkpoint directory of an annotation run: `<run_dir>/<fingerprint>`, where the
+    fingerprint covers the input tables, the stage list, the reference table versions and
+    (with a feature cache) the current cache generation.
+
+    :return: Checkpoint directory
+    """
+    stages = get_annotation_stages(gene_col,
+                                   use_bundle=use_bundle,
+                                   use_gene_features=use_gene_features)
+    fingerprint = get_run_fingerprint(inputs=variant_hts,
+                                      stage_names=[name for name, _, _ in stages],
+                                      reference_paths=[p for _, _, paths in stages for p in paths],
+                                      params={'gene_col': gene_col,
+                                              'cache': cache,
+                                              'cache_generation': (get_feature_cache_current(cache)
+                                                                   if cache is not None else None)})
+    return f'{run_dir}/{fingerprint}'
+
+
+def annotate_variants(variant_ht: str,
+                      gene_col: str,
+                      output_ht: str = out_path,
+                      use_bundle: bool = False,
+                      use_gene_features: bool = False,
+                      broadcast: str = 'auto',
+                      no_interval_pushdown: bool = False,
+                      write_to_file: bool = False,
+                      report: str = None,
+                      explain: bool = False,
+                      cache: str = None,
+                      run_dir: str = None,
+                      checkpoint_stages: list = None,
+                      dedupe: str = 'off') -> str:
+    """
+    Annotate a variant table with features from multiple sources, on an initialized Hail
+    backend (see `main`, and `hvantk serve` for a long-running backend).
+
+    :param variant_ht: Path to HailTable with variants and gene symbol keyed by `locus` and `alleles`
+    :param gene_col: Name of gene symbol column in input HailTable
+    :param output_ht: Output directory of the annotated HailTable
+    :param use_bundle: Annotate variant-level features from the pre-joined variant bundle
+    :param use_gene_features: Annotate gene-level features from the consolidated gene feature table
+    :param broadcast: Broadcast small gene-level reference tables: 'auto', 'on' or 'off'
+    :param no_interval_pushdown: Always read the full variant-level reference tables
+    :param write_to_file: Also export the output as a BGZ-compressed TSV file
+    :param report: Output prefix of a per-stage run report, or None
+    :param explain: Include the Hail table IR of every stage in the run report
+    :param cache: Feature cache directory. Variants already annotated from the same reference table
+        versions are taken from the cache, new variants are annotated and added to it.
+    :param run_dir: Run directory for stage checkpoints. A rerun of a failed run resumes after its last
+        valid checkpoint; checkpoints are deleted once the output is written.
+    :param checkpoint_stages: Names of the stages to checkpoint in `run_dir` (default: all)
+    :param dedupe: Annotate the distinct variants (and genes) only, and join the features back to the input
+        rows: 'on', 'off', or 'auto' (if the input has duplicate keys, e.g. per-sample rows; the check is an
+        extra aggregation over the input, so use 'on' for inputs known to have duplicates). The output is the
+        same in all modes.
+    :return: Path to the annotated HailTable
+    """
+    check_checkpoint_stages(checkpoint_stages, gene_col,
+                            use_bundle=use_bundle,
+                            use_gene_features=use_gene_features)
+
+    distinct = cache is not None or dedupe == 'on'
+    if not distinct and dedupe == 'auto':
+        distinct = has_duplicate_keys(hl.read_table(variant_ht))
+        if distinct:
+            print('Input has duplicate keys: annotating distinct variants only')
+
+    if distinct:
+        # annotate the distinct variants (through the cache, if any), then join them back to the input
+        return annotate_variant_tables([variant_ht],
+                                       gene_col,
+                                       output_ht=output_ht,
+                                       use_bundle=use_bundle,
+                                       use_gene_features=use_gene_features,
+                                       broadcast=broadcast,
+                                       no_interval_pushdown=no_interval_pushdown,
+                                       write_to_file=write_to_file,
+                                       report=report,
+                                       explain=explain,
+                                       cache=cache,
+                                       run_dir=run_dir,
+                                       checkpoint_stages=checkpoint_stages,
+                                       output_names=['ts.denovo'])[0]
+
+    start = time.perf_counter()
+    params = dict(locals())
+
+    # read the input with the partitioning of the variant-level reference tables, if they
+    # share one, so that all variant-level joins are partition-aligned
+    copartition_intervals = get_copartition_intervals(use_bundle=use_bundle)
     ht = hl.read_table(
-        args.variant_ht
+        variant_ht,
+        _intervals=copartition_intervals
     )
     print(ht.row)
 
-    gene_col = args.gene_col
-
     # check minimal requirements for input variant table.
     check_variant_tb(ht,
                      gene_col)
 
-    # filter to bi-allelic variants
-    ht = ht.filter(hl.len(ht.alleles) == 2)
+    checkpoint_dir = None
+    if run_dir is not None:
+        checkpoint_dir = get_checkpoint_dir(run_dir, [variant_ht], gene_col,
+                                            use_bundle=use_bundle,
+                                            use_gene_features=use_gene_features)
+
+    ht, stage_reports = _run_annotation(ht,
+                                        gene_col,
+                                        use_bundle=use_bundle,
+                                        use_gene_features=use_gene_features,
+                                        broadcast=broadcast,
+                                        no_interval_pushdown=no_interval_pushdown,
+                                        report=report,
+                                        explain=explain,
+                                        checkpoint_dir=checkpoint_dir,
+                                        checkpoint_stages=checkpoint_stages)
 
-    # annotate clinvar significance
-    ht = annotate_clinvar_clnsig(ht)
+    # write as HT
+    output_ht_path = f'{output_ht}/ts.denovo.features.ht'
+    with measure() as metrics:
+        ht = (ht
+              .checkpoint(output=output_ht_path,
+                          overwrite=True)
+              )
+
+    if write_to_file:
+        (ht
+         .flatten()
+         .export(f'{output_ht_path}.tsv.bgz')
+         )
 
-    # annotate variant ID from locus and alleles
-    ht = annotate_variant_id(ht)
+    if stage_reports is not None:
+        stage_reports.append({'stage': 'write', 'reference_tables': [], **metrics})
+        write_report({'params': params,
+                      'wall_time_s': time.perf_counter() - start,
+                      'stages': stage_reports},
+                     report)
+
+    if checkpoint_dir is not None:
+        remove_run_checkpoints(checkpoint_dir)
+
+    return output_ht_path
+
+
+def gene_join_key(gene_expr: hl.expr.StringExpression) -> hl.expr.StringExpression:
+    """
+    Join key of a gene symbol. Missing keys never match in joins, so missing symbols are
+    encoded as an empty key and defined symbols are prefixed, so that rows without a gene
+    are still joined to their annotations.
+
+    :param gene_expr: Gene symbol expression
+    :return: String expression (never missing)
+    """
+    return hl.or_else('=' + gene_expr, '')
+
+
+def _output_name(path: str) -> str:
+    name = path.rstrip('/').split('/')[-1]
+    return name[:-len('.ht')] if name.endswith('.ht') else name
+
+
+def _is_gene_level_stage(name: str) -> bool:
+    return name in GENE_LEVEL_STAGES
+
+
+def _subset_stages(names: list,
+                   stage_filter) -> list:
+    return None if names is None else [name for name in names if stage_filter(name)]
+
+
+def _annotate_distinct(variants_ht: hl.Table,
+                       gene_col: str,
+                       report: str = None,
+                       checkpoint_dir: str = None,
+                       checkpoint_stages: list = None,
+                       no_interval_pushdown: bool = False,
+                       **kwargs) -> tuple:
+    """
+    Annotate distinct (locus, alleles, gene) rows and checkpoint them. Variant-level stages run
+    once per distinct row; gene-level stages (see `GENE_LEVEL_STAGES`) run once per distinct
+    gene, and their features are joined back by gene symbol. Rows with a missing gene symbol
+    are annotated as well (see `gene_join_key`).
+
+    :return: Annotations keyed by `locus`, `alleles` and `GENE_KEY_FIELD`, and list of stage reports
+    """
+
+    def _is_gene_table_stage(name):
+        # gene IDs are needed by the gene-level stages
+        return name == 'ensembl_gene' or _is_gene_level_stage(name)
+
+    def _is_variant_table_stage(name):
+        return not _is_gene_level_stage(name)
+
+    genes_ht = (variants_ht
+                .group_by(**{GENE_KEY_FIELD: gene_join_key(variants_ht[gene_col])})
+                .aggregate(**{gene_col: hl.agg.take(variants_ht[gene_col], 1)[0]})
+                )
+
+    variants_ht, stage_reports = _run_annotation(variants_ht,
+                                                 gene_col,
+                                                 report=report,
+                                                 no_interval_pushdown=no_interval_pushdown,
+                                                 checkpoint_dir=(f'{checkpoint_dir}/variants'
+                                                                 if checkpoint_dir is not None else None),
+                                                 checkpoint_stages=_subset_stages(checkpoint_stages,
+                                                                                  _is_variant_table_stage),
+                                                 stage_filter=_is_variant_table_stage,
+                                                 **kwargs)
+
+    genes_ht, gene_stage_reports = _run_annotation(genes_ht,
+                                                   gene_col,
+                                                   report=report,
+                                                   no_interval_pushdown=True,
+                                                   checkpoint_dir=(f'{checkpoint_dir}/genes'
+                                                                   if checkpoint_dir is not None else None),
+                                                   checkpoint_stages=_subset_stages(checkpoint_stages,
+                                                                                    _is_gene_table_stage),
+                                                   stage_filter=_is_gene_table_stage,
+                                                   **kwargs)
+    genes_ht = genes_ht.drop(*[f for f in genes_ht.row_value if f in variants_ht.row])
+
+    with measure() as metrics:
+        variants_ht = (variants_ht
+                       .annotate(**genes_ht[gene_join_key(variants_ht[gene_col])])
+                       .annotate_globals(**genes_ht.index_globals())
+                       )
+        variants_ht = (variants_ht
+                       .key_by('locus', 'alleles', **{GENE_KEY_FIELD: gene_join_key(variants_ht[gene_col])})
+                       .drop(gene_col)
+                       .checkpoint(hl.utils.new_temp_file(extension='ht'))
+                       )
+    if stage_reports is not None:
+        stage_reports.extend(gene_stage_reports)
+        stage_reports.append({'stage': 'annotate_distinct', 'reference_tables': [], **metrics})
+
+    return variants_ht, stage_reports
+
+
+def has_duplicate_keys(ht: hl.Table) -> bool:
+    """
+    Check whether a table has several rows with the same key (e.g. sample-level variant tables),
+    in a single pass: rows are counted per key (a streaming aggregation, as the table is
+    already keyed) and checked in the same job.
+
+    :param ht: Hail Table
+    :return: True if some keys are not unique
+    """
+    counts = ht.group_by(*ht.key).aggregate(n=hl.agg.count())
+    return counts.aggregate(hl.agg.any(counts.n > 1))
+
+
+def get_feature_cache_stamp(use_bundle: bool = False,
+                            use_gene_features: bool = False) -> dict:
+    """
+    Return the stamp of the feature cache entries of a run: the versions of the reference
+    tables read by the annotation stages, and the options changing the annotation output.
+
+    :param use_bundle: Annotate variant-level features from the pre-joined variant bundle
+    :param use_gene_features: Annotate gene-level features from the consolidated gene feature table
+    :return: Stamp dict
+    """
+    stages = get_annotation_stages(FEATURE_CACHE_GENE_FIELD,
+                                   use_bundle=use_bundle,
+                                   use_gene_features=use_gene_features)
+    paths = sorted({p for _, _, reference_paths in stages for p in reference_paths})
+
+    return {'use_bundle': use_bundle,
+            'use_gene_features': use_gene_features,
+            'references': get_reference_versions(paths)}
+
+
+def _annotate_distinct_cached(variants_ht: hl.Table,
+                              gene_col: str,
+                              cache: str,
+                              use_bundle: bool = False,
+                              use_gene_features: bool = False,
+                              report: str = None,
+                              **kwargs) -> tuple:
+    """
+    Annotate distinct (locus, alleles, gene) rows through the feature cache: rows already in
+    the cache (built from the same reference table versions) are reused, only new rows are
+    annotated, and they are merged into the cache.
+
+    :return: Annotations keyed by `locus`, `alleles` and `GENE_KEY_FIELD`, and list of stage reports
+    """
+    stamp = get_feature_cache_stamp(use_bundle=use_bundle,
+                                    use_gene_features=use_gene_features)
+    cache_ht = read_feature_cache(cache, stamp)
+
+    keys_ht = variants_ht.select(**{FEATURE_CACHE_GENE_FIELD: variants_ht[gene_col]})
+    keys_ht = keys_ht.key_by('locus', 'alleles',
+                             **{GENE_KEY_FIELD: gene_join_key(keys_ht[FEATURE_CACHE_GENE_FIELD])})
+    missing_ht = keys_ht.anti_join(cache_ht) if cache_ht is not None else keys_ht
+    missing_ht = missing_ht.checkpoint(hl.utils.new_temp_file(extension='ht'))
+    n_missing = missing_ht.count()
+    print(f'Feature cache: {n_missing} variants to annotate')
+
+    stage_reports = [] if report is not None else None
+    if n_missing > 0 or cache_ht is None:
+        new_ht, stage_reports = _annotate_distinct(missing_ht.key_by('locus', 'alleles').drop(GENE_KEY_FIELD),
+                                                   FEATURE_CACHE_GENE_FIELD,
+                                                   use_bundle=use_bundle,
+                                                   use_gene_features=use_gene_features,
+                                                   report=report,
+                                                   **kwargs)
+        merged_ht = cache_ht.union(new_ht) if cache_ht is not None else new_ht
+        with measure() as metrics:
+            cache_ht = write_feature_cache(cache, merged_ht, stamp)
+        if stage_reports is not None:
+            stage_reports.append({'stage': 'merge_cache', 'reference_tables': [], **metrics})
+
+    return cache_ht, stage_reports
+
+
+def annotate_variant_tables(variant_hts: list,
+                            gene_col: str,
+                            output_ht: str = out_path,
+                            use_bundle: bool = False,
+                            use_gene_features: bool = False,
+                            broadcast: str = 'auto',
+                            no_interval_pushdown: bool = False,
+                            write_to_file: bool = False,
+                            report: str = None,
+                            explain: bool = False,
+                            cache: str = None,
+                            run_dir: str = None,
+                            checkpoint_stages: list = None,
+                            output_names: list = None) -> list:
+    """
+    Annotate many variant tables (e.g. cohorts) in one pass. The distinct (variant, gene) pairs
+    of all inputs are annotated once, so that reference tables are read once and their I/O
+    scales with the number of distinct variants, not with the number of inputs. The annotations
+    are then joined back to every input and written to `<output_ht>/<input name>.features.ht`.
+
+    Parameters are the same as in `annotate_variants`.
+
+    :param variant_hts: Paths to HailTables with variants and gene symbol keyed by `locus` and `alleles`
+    :param output_names: Output table names (default: input table names)
+    :return: Paths to the annotated HailTables, in input order
+    """
+    start = time.perf_counter()
+    params = dict(locals())
+
+    check_checkpoint_stages(checkpoint_stages, gene_col,
+                            use_bundle=use_bundle,
+                            use_gene_features=use_gene_features)
+
+    names = output_names or [_output_name(p) for p in variant_hts]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Input tables must have distinct names: {", ".join(names)}')
+
+    copartition_intervals = get_copartition_intervals(use_bundle=use_bundle)
+    tables = []
+    for path in variant_hts:
+        ht = hl.read_table(path, _intervals=copartition_intervals)
+        check_variant_tb(ht, gene_col)
+        tables.append(ht)
+
+    # distinct (locus, alleles, gene) of all inputs
+    selected = [ht.select(gene_col) for ht in tables]
+    variants_ht = selected[0].union(*selected[1:])
+    variants_ht = (variants_ht
+                   .key_by('locus', 'alleles', **{GENE_KEY_FIELD: gene_join_key(variants_ht[gene_col])})
+                   .distinct()
+                   .key_by('locus', 'alleles')
+                   .drop(GENE_KEY_FIELD)
+                   )
+
+    # annotate once, then split back into per-input outputs
+    checkpoint_dir = None
+    if run_dir is not None:
+        checkpoint_dir = get_checkpoint_dir(run_dir, variant_hts, gene_col,
+                                            use_bundle=use_bundle,
+                                            use_gene_features=use_gene_features,
+                                            cache=cache)
+
+    annotation_kwargs = dict(use_bundle=use_bundle,
+                             use_gene_features=use_gene_features,
+                             broadcast=broadcast,
+                             no_interval_pushdown=no_interval_pushdown,
+                             report=report,
+                             explain=explain,
+                             checkpoint_dir=checkpoint_dir,
+                             checkpoint_stages=checkpoint_stages)
+    if cache is None:
+        # materialize the distinct rows once: the interval pushdown, the gene grouping and every
+        # stage read them, instead of re-reading and re-shuffling all inputs (as for the cache path)
+        variants_ht = variants_ht.checkpoint(hl.utils.new_temp_file(extension='ht'))
+        variants_ht, stage_reports = _annotate_distinct(variants_ht, gene_col, **annotation_kwargs)
+    else:
+        with feature_cache_lock:
+            variants_ht, stage_reports = _annotate_distinct_cached(variants_ht, gene_col, cache,
+                                                                   **annotation_kwargs)
 
-    # annotate gene/transcript ensembl IDs
-    ht = annotate_ensembl_gene(ht, gene_symbol_col=gene_col)
+    # globals set by the annotation stages (not the cache stamp)
+    ann_globals = {f: variants_ht.index_globals()[f] for f in variants_ht.globals if f != FEATURE_CACHE_GLOBAL}
 
-    # annotate ccr
-    ht = annotate_ccr(ht)
+    output_paths = []
+    for name, ht in zip(names, tables):
+        # every (bi-allelic) input row has a match, including rows without a gene symbol
+        ht = ht.filter(hl.len(ht.alleles) == 2)
+        ht = (ht
+              .annotate(**variants_ht[ht.locus, ht.alleles, gene_join_key(ht[gene_col])])
+              .annotate_globals(**ann_globals)
+              )
 
-    # annotate gvir
-    ht = annotate_gevir(ht,
-                        gene_id_col='GeneID')
+        output_ht_path = f'{output_ht}/{name}.features.ht'
+        with measure() as metrics:
+            ht = ht.checkpoint(output=output_ht_path, overwrite=True)
 
-    # annotate rnaseq expression
-    ht = annotate_rnaseq_expression(ht,
-                                    gene_id_col='GeneID')
+        if write_to_file:
+            (ht
+             .flatten()
+             .export(f'{output_ht_path}.tsv.bgz')
+             )
 
-    # annotate gnomad af
-    ht = annotate_gnomad_af(ht)
+        if stage_reports is not None:
+            stage_reports.append({'stage': f'write:{name}', 'reference_tables': [], **metrics})
+        output_paths.append(output_ht_path)
 
-    # annotate gnomad constraint metrics
-    ht = annotate_gnomad_constraint_metrics(ht,
-                                            transcript_id_col='TranscriptID')
+    if stage_reports is not None:
+        write_report({'params': params,
+                      'wall_time_s': time.perf_counter() - start,
+                      'stages': stage_reports},
+                     report)
 
-    # annotate interactome sites
-    ht = annotate_ppi(ht)
+    if checkpoint_dir is not None:
+        remove_run_checkpoints(checkpoint_dir)
 
-    # annotate HCA
-    # ht = annotate_degs(ht,
-    #                   gene_symbol_col=gene_col)
-    ht = annotate_hca(ht,
-                      gene_id_col='GeneID')
+    return output_paths
 
-    # annotate deleterious scores
-    ht = annotate_dbnsfp_scores(ht,
-                                transcript_id_col='TranscriptID')
 
-    # write as HT
-    output_ht_path = f'{args.output_ht}/ts.denovo.features.ht'
-    ht = (ht
-          .checkpoint(output=output_ht_path,
-                      overwrite=True)
-          )
+def main(args):
+    # Init Hail
+    hl.init(default_reference='GRCh38')
 
-    if args.write_to_file:
-        (ht
-         .flatten()
-         .export(f'{output_ht_path}.tsv.bgz')
-         )
+    kwargs = vars(args)
+    variant_hts = kwargs.pop('variant_ht')
+    if len(variant_hts) == 1:
+        annotate_variants(variant_hts[0], **kwargs)
+    else:
+        # several inputs are always annotated on their distinct variants
+        kwargs.pop('dedupe')
+        annotate_variant_tables(variant_hts, **kwargs)
 
     # Stop Hail
     hl.stop()
@@ -120,8 +703,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-i', '--variant_ht',
-                        help='Path to HailTable with variants and gene symbol keyed by `locus` and `alleles`...',
-                        type=str, default=None)
+                        help='Path to HailTable with variants and gene symbol keyed by `locus` and `alleles`... '
+                             'With several tables, their distinct variants are annotated in one pass and the output '
+                             'is written per input table.',
+                        type=str, nargs='+', default=None)
 
     parser.add_argument('--gene_col',
                         help='Name of gene symbol column in input HailTable',
@@ -131,6 +716,49 @@ if __name__ == '__main__':
                         help='Path to output HailTable with features annotations',
                         type=str, default=out_path)
 
+    parser.add_argument('--use_bundle', help='Annotate variant-level features from the pre-joined variant bundle',
+                        action='store_true')
+
+    parser.add_argument('--use_gene_features',
+                        help='Annotate gene-level features from the consolidated gene feature table',
+                        action='store_true')
+
+    parser.add_argument('--broadcast',
+                        help='Broadcast small gene-level reference tables as in-memory lookups instead of joining '
+                             '(auto: only tables below the size threshold)',
+                        choices=['auto', 'on', 'off'], default='auto')
+
+    parser.add_argument('--no_interval_pushdown',
+                        help='Always read the full variant-level reference tables, even for small inputs',
+                        action='store_true')
+
+    parser.add_argument('--report',
+                        help='Run the annotation stage by stage and write a run report (wall time, Spark jobs, '
+                             'rows and bytes read per stage) to <REPORT>.json and <REPORT>.html',
+                        type=str, default=None)
+
+    parser.add_argument('--cache',
+                        help='Feature cache directory: reuse the annotations of previously seen variants (built from '
+                             'the same reference table versions), annotate only new variants and add them to the cache',
+                        type=str, default=None)
+
+    parser.add_argument('--run_dir',
+                        help='Run directory for stage checkpoints. Rerunning a failed run resumes after its last valid '
+                             'checkpoint; checkpoints are deleted once the output is written',
+                        type=str, default=None)
+
+    parser.add_argument('--checkpoint_stages', help='Names of the stages to checkpoint in --run_dir (default: all)',
+                        type=str, nargs='+', default=None)
+
+    parser.add_argument('--dedupe',
+                        help='Annotate distinct variants (and genes) only and join the features back to the input rows '
+                             '(auto: if the input has duplicate keys, e.g. per-sample rows, checked with an extra pass '
+                             'over the input)',
+                        choices=['auto', 'on', 'off'], default='off')
+
+    parser.add_argument('--explain', help='Include the Hail table IR of every stage in the run report',
+                        action='store_true')
+
     parser.add_argument('-wf', '--write_to_file', help='Write output to BGZ-compressed file',
                         action='store_true')
 
@@ -3,17 +3,16 @@ Generate annotation tables from multiple (raw) sources
 
 """
 
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 
-from hvantk.settings import CONTEXT_SETTINGS, RAW_DATA_PATH, set_raw_data_path
-from hvantk.utils.make_tables import (create_interactome_tb,
-                                      create_rnaseq_tb,
-                                      create_clinvar_tb,
-                                      create_gevir_tb,
-                                      create_scell_deg_tb,
-                                      create_hca_tb,
-                                      create_gene_ensembl_ann_tb,
-                                      create_gnomad_constraint_gene_metrics_tb)
+from hvantk.settings import CONTEXT_SETTINGS, N_GENOME_PARTITIONS, RAW_DATA_PATH, RAW_DATA_PATHS, set_raw_data_path
+
+# Hail and the table builders are imported when a build runs, not at module load, so that
+# the CLI (e.g. --help) starts without loading the JVM bridge and PySpark.
 
 output_dir_default = f'{RAW_DATA_PATH}/annotation_tables'
 
@@ -24,6 +23,164 @@ def cli():
     pass
 
 
+def build_table(builder,
+                output_path: str,
+                raw_inputs: list = (),
+                input_tables: dict = None,
+                params: dict = None,
+                partitioning: tuple = None,
+                force: bool = False,
+                checksums: bool = False,
+                logger: logging.Logger = None) -> bool:
+    """
+    Build an annotation table and write it to `output_path`, together with a manifest of its
+    inputs, builder version and parameters. The table is skipped if it is up to date with
+    respect to the manifest of the previous build, unless `force` is set.
+
+    :param builder: Table builder function (e.g. `create_clinvar_tb`)
+    :param output_path: Output Hail Table path
+    :param raw_inputs: Raw input files (or glob patterns) read by the builder
+    :param input_tables: Hail Table arguments of the builder (argument name -> table path)
+    :param params: Keyword arguments of the builder
+    :param partitioning: (n_partitions, reference_genome) to write a locus-keyed table
+        co-partitioned (see `write_copartitioned`), or None
+    :param force: Rebuild the table even if it is up to date
+    :param checksums: Hash the inputs whose size or modification time changed, so that touched but
+        unchanged inputs do not trigger a rebuild (see `build_manifest`)
+    :param logger: Logger for progress messages
+    :return: True if the table was (re)built
+    """
+    import hail as hl
+
+    from hvantk.utils.io import (write_copartitioned,
+                                 build_manifest,
+                                 read_manifest,
+                                 write_manifest,
+                                 is_up_to_date)
+    from hvantk.utils.make_tables import BUILDER_VERSIONS
+
+    input_tables = input_tables or {}
+    params = params or {}
+    logger = logger or logging.getLogger(__name__)
+
+    # inputs are stamped by size and modification time; nothing is hashed for a forced build
+    previous = None if force else read_manifest(output_path)
+    manifest = build_manifest(inputs=list(raw_inputs) + list(input_tables.values()),
+                              builder=builder.__name__,
+                              version=BUILDER_VERSIONS[builder.__name__],
+                              params={**params, 'partitioning': partitioning},
+                              previous=previous,
+                              checksums=checksums)
+
+    if not force and is_up_to_date(output_path, manifest):
+        if manifest['inputs'] != previous['inputs']:
+            # touched but unchanged inputs: record their new stamps
+            write_manifest(output_path, manifest)
+        logger.info(f'Skipping up-to-date table: {output_path}')
+        return False
+
+    logger.info(f'Building table with {builder.__name__}: {output_path}')
+    ht = builder(**{k: hl.read_table(v) for k, v in input_tables.items()}, **params)
+    if partitioning is not None:
+        n_partitions, reference_genome = partitioning
+        write_copartitioned(ht, output_path,
+                            n_partitions=n_partitions,
+                            reference_genome=reference_genome)
+    else:
+        ht.checkpoint(output_path, overwrite=True)
+
+    write_manifest(output_path, manifest)
+    logger.info(f'Done: {output_path}')
+
+    return True
+
+
+def _get_table_logger(name: str,
+                      log_dir: str = None) -> logging.Logger:
+    """
+    Return the logger of a table build, writing to `<log_dir>/<name>.log` (and to stderr).
+
+    :param name: Table name
+    :param log_dir: Local directory for per-table log files. If None, log to stderr only.
+    :return: Logger
+    """
+    logger = logging.getLogger(f'hvantk.mktables.{name}')
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        formatter = logging.Formatter(f'%(asctime)s [{name}] %(levelname)s: %(message)s')
+        handlers = [logging.StreamHandler()]
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            handlers.append(logging.FileHandler(os.path.join(log_dir, f'{name}.log')))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+# Status of a table not built because one of its input tables failed in the same run
+UPSTREAM_FAILED = 'skipped (upstream failed)'
+
+
+def run_build_tasks(tasks: list,
+                    jobs: int = 1,
+                    log_dir: str = None) -> dict:
+    """
+    Run table builds concurrently on the shared Hail backend (Hail must be initialized). Each
+    task is a (name, build_table keyword arguments) tuple; tasks must be independent of each other.
+
+    :param tasks: List of (name, kwargs) tuples
+    :param jobs: Maximum number of tables built concurrently
+    :param log_dir: Local directory for per-table log files
+    :return: Dict with the status of each table ('built', 'skipped' or 'failed')
+    """
+
+    def _run(name, kwargs):
+        logger = _get_table_logger(name, log_dir)
+        try:
+            return 'built' if build_table(**kwargs, logger=logger) else 'skipped'
+        except Exception:
+            logger.exception(f'Failed to build table: {name}')
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        futures = {name: pool.submit(_run, name, kwargs) for name, kwargs in tasks}
+        return {name: f.result() for name, f in futures.items()}
+
+
+def build_variant_index(output_dir: str,
+                        index_path: str,
+                        default_ref_genome: str = 'GRCh38',
+                        log_dir: str = None) -> str:
+    """
+    Export the variant bundle, CCR and interactome tables from `output_dir` into a local
+    SQLite index for Spark-free lookups (see `hvantk.utils.variant_index`).
+
+    :param output_dir: Directory with the annotation tables
+    :param index_path: Local path to the SQLite file
+    :param default_ref_genome: Reference genome of the tables
+    :param log_dir: Local directory for the build log
+    :return: Build status ('built' or 'failed')
+    """
+    import hail as hl
+
+    from hvantk.utils.io import export_variant_index
+
+    logger = _get_table_logger('variant_index', log_dir)
+    try:
+        logger.info(f'Exporting variant index: {index_path}')
+        meta = export_variant_index(bundle_tb=hl.read_table(f'{output_dir}/variant.bundle.{default_ref_genome}.ht'),
+                                    ccr_tb=hl.read_table(f'{output_dir}/ccr.{default_ref_genome}.ht'),
+                                    ppi_tb=hl.read_table(f'{output_dir}/interactome.{default_ref_genome}.ht'),
+                                    index_path=index_path)
+        logger.info(f'Done: {index_path} ({meta["n_variants"]} variants)')
+        return 'built'
+    except Exception:
+        logger.exception(f'Failed to export variant index: {index_path}')
+        return 'failed'
+
+
 def make_annotation_tables_from_raw_sources(raw_data_path: str,
                                             ccr: bool = False,  # TODO: implement CCR table
                                             interactome: bool = False,
@@ -34,66 +191,199 @@ def make_annotation_tables_from_raw_sources(raw_data_path: str,
                                             hca_rnaseq: bool = False,
                                             gene_ensembl: bool = False,
                                             gnomad_metrics: bool = False,
+                                            dbnsfp: bool = False,
+                                            gnomad_af: bool = False,
+                                            gnomad_af_fields: tuple = (),
+                                            gnomad_af_intervals: str = None,
+                                            variant_bundle: bool = False,
+                                            gene_features: bool = False,
                                             output_dir: str = output_dir_default,
-                                            default_ref_genome: str = 'GRCh38'):
+                                            default_ref_genome: str = 'GRCh38',
+                                            n_partitions: int = N_GENOME_PARTITIONS,
+                                            force: bool = False,
+                                            checksums: bool = False,
+                                            jobs: int = 1,
+                                            log_dir: str = None,
+                                            scell_matrix: str = None,
+                                            cell_type_attr: str = 'CellType',
+                                            gene_id_attr: str = None,
+                                            rnaseq_engine: str = 'hail',
+                                            variant_index: str = None) -> dict:
+    from hvantk.utils.make_tables import (create_interactome_tb,
+                                          create_rnaseq_tb,
+                                          create_clinvar_tb,
+                                          create_gevir_tb,
+                                          create_scell_deg_tb,
+                                          create_hca_tb,
+                                          create_gene_ensembl_ann_tb,
+                                          create_gene_alias_tb,
+                                          create_gnomad_constraint_gene_metrics_tb,
+                                          create_variant_bundle_tb,
+                                          create_gene_features_tb,
+                                          create_scell_pseudobulk_tb,
+                                          create_dbnsfp_tb,
+                                          create_dbnsfp_variant_tb,
+                                          create_gnomad_af_tb)
+    import hail as hl
+
     # set the raw data path
     set_raw_data_path(raw_data_path)
 
+    # start Hail once, before the build threads (which would otherwise race on its implicit
+    # initialization with the default reference genome)
+    hl.init(default_reference=default_ref_genome)
+
+    partitioning = (n_partitions, default_ref_genome)
+
+    # independent tables built from raw sources
+    tasks = []
+
     if interactome:
-        bed_ppi = create_interactome_tb()
-        bed_ppi.checkpoint(
-            f'{output_dir}/interactome.{default_ref_genome}.ht',
-            overwrite=True
-        )
+        tasks.append(('interactome',
+                      dict(builder=create_interactome_tb,
+                           output_path=f'{output_dir}/interactome.{default_ref_genome}.ht',
+                           raw_inputs=[RAW_DATA_PATHS['interactome_path']])))
 
     if temporal_rnaseq:
-        rnaseq_tb = create_rnaseq_tb()
-        rnaseq_tb.checkpoint(
-            f'{output_dir}/rnaseq.human.ht',
-            overwrite=True
-        )
+        tasks.append(('temporal_rnaseq',
+                      dict(builder=create_rnaseq_tb,
+                           output_path=f'{output_dir}/rnaseq.human.ht',
+                           raw_inputs=[RAW_DATA_PATHS['rnaseq_path']],
+                           params={'engine': rnaseq_engine})))
 
     if clinvar:
-        clinvar_tb = create_clinvar_tb()
-        clinvar_tb.checkpoint(
-            f'{output_dir}/clinvar.{default_ref_genome}.ht',
-            overwrite=True
-        )
+        tasks.append(('clinvar',
+                      dict(builder=create_clinvar_tb,
+                           output_path=f'{output_dir}/clinvar.{default_ref_genome}.ht',
+                           raw_inputs=[RAW_DATA_PATHS['clinvar_path']],
+                           partitioning=partitioning)))
 
     if gevir:
-        gevir_tb = create_gevir_tb()
-        gevir_tb.checkpoint(
-            f'{output_dir}/gevir.metrics.ht',
-            overwrite=True
-        )
+        tasks.append(('gevir',
+                      dict(builder=create_gevir_tb,
+                           output_path=f'{output_dir}/gevir.metrics.ht',
+                           raw_inputs=[RAW_DATA_PATHS['gevir_path']])))
 
     if scell_heart_deg:
-        deg_tb = create_scell_deg_tb()
-        deg_tb.checkpoint(
-            f'{output_dir}/scell.heart.degs.ht',
-            overwrite=True
-        )
+        tasks.append(('scell_heart_deg',
+                      dict(builder=create_scell_deg_tb,
+                           output_path=f'{output_dir}/scell.heart.degs.ht',
+                           raw_inputs=[RAW_DATA_PATHS['scell_heart_path']])))
 
     if hca_rnaseq:
-        hca_tb = create_hca_tb()
-        hca_tb.checkpoint(
-            f'{output_dir}/hca.heart.ht',
-            overwrite=True
-        )
+        tasks.append(('hca_rnaseq',
+                      dict(builder=create_hca_tb,
+                           output_path=f'{output_dir}/hca.heart.ht',
+                           raw_inputs=[RAW_DATA_PATHS['scell_hca_path']])))
 
     if gene_ensembl:
-        gene_tb = create_gene_ensembl_ann_tb()
-        gene_tb.checkpoint(
-            f'{output_dir}/gene.ann.ensembl.ht',
-            overwrite=True
-        )
+        tasks.append(('gene_ensembl',
+                      dict(builder=create_gene_ensembl_ann_tb,
+                           output_path=f'{output_dir}/gene.ann.ensembl.ht',
+                           raw_inputs=[RAW_DATA_PATHS['gene_ann_path']])))
 
     if gnomad_metrics:
-        gnomad_tb = create_gnomad_constraint_gene_metrics_tb()
-        gnomad_tb.checkpoint(
-            f'{output_dir}/gnomad.metrics.ht',
-            overwrite=True
-        )
+        tasks.append(('gnomad_metrics',
+                      dict(builder=create_gnomad_constraint_gene_metrics_tb,
+                           output_path=f'{output_dir}/gnomad.metrics.ht',
+                           raw_inputs=[RAW_DATA_PATHS['gnomad_metrics_path']])))
+
+    if gnomad_af:
+        tasks.append(('gnomad_af',
+                      dict(builder=create_gnomad_af_tb,
+                           output_path=f'{output_dir}/gnomad_3.0_sites_AF.ht',
+                           raw_inputs=[RAW_DATA_PATHS['gnomad_af_path']] + ([gnomad_af_intervals]
+                                                                           if gnomad_af_intervals else []),
+                           params={'extra_fields': list(gnomad_af_fields),
+                                   'intervals_path': gnomad_af_intervals},
+                           partitioning=partitioning)))
+
+    if dbnsfp:
+        tasks.append(('dbnsfp',
+                      dict(builder=create_dbnsfp_tb,
+                           output_path=f'{output_dir}/dbNSFP4.1a_transcript.ht',
+                           raw_inputs=[RAW_DATA_PATHS['dbnsfp_path']],
+                           partitioning=partitioning)))
+
+    if scell_matrix is not None:
+        tasks.append(('scell_pseudobulk',
+                      dict(builder=create_scell_pseudobulk_tb,
+                           output_path=f'{output_dir}/scell.pseudobulk.ht',
+                           raw_inputs=[scell_matrix],
+                           params={'matrix_path': scell_matrix,
+                                   'cell_type_attr': cell_type_attr,
+                                   'gene_id_attr': gene_id_attr})))
+
+    # derived tables, built from the tables available in the output directory. They go in a
+    # second round to pick up any table (re)created above.
+    derived_tasks = []
+
+    if gene_ensembl:
+        derived_tasks.append(('gene_alias',
+                              dict(builder=create_gene_alias_tb,
+                                   output_path=f'{output_dir}/gene.alias.ensembl.ht',
+                                   input_tables={'gene_tb': f'{output_dir}/gene.ann.ensembl.ht'})))
+
+    if dbnsfp:
+        derived_tasks.append(('dbnsfp_variant',
+                              dict(builder=create_dbnsfp_variant_tb,
+                                   output_path=f'{output_dir}/dbNSFP4.1a_variant.ht',
+                                   input_tables={'dbnsfp_tb': f'{output_dir}/dbNSFP4.1a_transcript.ht'},
+                                   partitioning=partitioning)))
+
+    if gene_features:
+        derived_tasks.append(('gene_features',
+                              dict(builder=create_gene_features_tb,
+                                   output_path=f'{output_dir}/gene.features.ht',
+                                   input_tables={'gene_ensembl_tb': f'{output_dir}/gene.ann.ensembl.ht',
+                                                 'gevir_tb': f'{output_dir}/gevir.metrics.ht',
+                                                 'rnaseq_tb': f'{output_dir}/rnaseq.human.ht',
+                                                 'gnomad_metrics_tb': f'{output_dir}/gnomad.metrics.ht',
+                                                 'hca_tb': f'{output_dir}/hca.heart.ht',
+                                                 'deg_tb': f'{output_dir}/scell.heart.degs.ht'})))
+
+    # tables derived from derived tables (the bundle reads the variant-keyed dbNSFP table)
+    bundle_tasks = []
+
+    if variant_bundle:
+        bundle_tasks.append(('variant_bundle',
+                             dict(builder=create_variant_bundle_tb,
+                                  output_path=f'{output_dir}/variant.bundle.{default_ref_genome}.ht',
+                                  input_tables={'clinvar_tb': f'{output_dir}/clinvar.{default_ref_genome}.ht',
+                                                'gnomad_af_tb': f'{output_dir}/gnomad_3.0_sites_AF.ht',
+                                                'dbnsfp_tb': f'{output_dir}/dbNSFP4.1a_variant.ht'},
+                                  partitioning=partitioning)))
+
+    status = {}
+    # outputs of the tables that failed (or were skipped because an input failed) in this run
+    failed_outputs = set()
+    for round_tasks in (tasks, derived_tasks, bundle_tasks):
+        runnable = []
+        for name, kwargs in round_tasks:
+            if failed_outputs.intersection(kwargs.get('input_tables', {}).values()):
+                status[name] = UPSTREAM_FAILED
+                failed_outputs.add(kwargs['output_path'])
+            else:
+                runnable.append((name, dict(kwargs, force=force, checksums=checksums)))
+
+        round_status = run_build_tasks(runnable, jobs=jobs, log_dir=log_dir)
+        failed_outputs.update(kwargs['output_path'] for name, kwargs in runnable
+                              if round_status[name] == 'failed')
+        status.update(round_status)
+
+    if variant_index is not None:
+        index_inputs = [f'{output_dir}/variant.bundle.{default_ref_genome}.ht',
+                        f'{output_dir}/ccr.{default_ref_genome}.ht',
+                        f'{output_dir}/interactome.{default_ref_genome}.ht']
+        if failed_outputs.intersection(index_inputs):
+            status['variant_index'] = UPSTREAM_FAILED
+        else:
+            status['variant_index'] = build_variant_index(output_dir,
+                                                          variant_index,
+                                                          default_ref_genome=default_ref_genome,
+                                                          log_dir=log_dir)
+
+    return status
 
 
 @click.command('mktables', short_help='Create annotation tables from raw sources.')
@@ -107,6 +397,8 @@ def make_annotation_tables_from_raw_sources(raw_data_path: str,
               is_flag=True, help='Create/update CCR table from source.')
 @click.option('--temporal_rnaseq',
               is_flag=True, help='Create/update RNAseq table from source.')
+@click.option('--rnaseq_engine', default='hail', type=click.Choice(['hail', 'numpy']),
+              help='Engine computing the RNA-seq means: Spark (hail) or vectorized on the driver (numpy).')
 @click.option('--clinvar',
               is_flag=True, help='Create/update Clinvar table from source.')
 @click.option('--gevir',
@@ -116,33 +408,94 @@ def make_annotation_tables_from_raw_sources(raw_data_path: str,
 @click.option('--hca_rnaseq',
               is_flag=True, help='Create/update table with gene/cell expression levels from HCA dataset (UCSC)')
 @click.option('--gene_ensembl',
-              is_flag=True, help='Create/update gene annotation table from Ensembl.')
+              is_flag=True, help='Create/update gene annotation and gene alias tables from Ensembl.')
 @click.option('--gnomad_metrics',
               is_flag=True, help='Create/update transcript-specific constraint metrics from gnomad database')
+@click.option('--gnomad_af',
+              is_flag=True, help='Create/update the gnomad allele frequency table from the gnomad sites VCFs.')
+@click.option('--gnomad_af_fields', type=click.Choice(['AC', 'AN', 'popmax']), multiple=True,
+              help='Optional gnomad INFO fields to keep besides AF (repeatable).')
+@click.option('--gnomad_af_intervals', default=None, type=str,
+              help='BED file with regions (e.g. coding regions) to restrict the gnomad allele frequency table to.')
+@click.option('--dbnsfp',
+              is_flag=True, help='Create/update the transcript-resolved and variant-keyed dbNSFP score tables '
+                                 'from the dbNSFP chunks.')
+@click.option('--variant_bundle',
+              is_flag=True, help='Create/update the pre-joined variant-level annotation bundle '
+                                 '(Clinvar, gnomad AF and dbNSFP) from tables in output_dir.')
+@click.option('--gene_features',
+              is_flag=True, help='Create/update the consolidated gene-level feature table from tables in output_dir.')
+@click.option('--variant_index', default=None, type=str,
+              help='Export the variant bundle, CCR and interactome tables from output_dir into a local SQLite '
+                   'index (this path) for Spark-free lookups with `hvantk lookup`.')
+@click.option('--scell_matrix', default=None, type=str,
+              help='Create/update a pseudo-bulk gene expression table per cell type from a single-cell '
+                   '.loom/.h5ad file (requires h5py).')
+@click.option('--cell_type_attr', default='CellType', type=str,
+              help='Cell attribute with cell type labels in the --scell_matrix file.')
+@click.option('--gene_id_attr', default=None, type=str,
+              help='Gene attribute with gene IDs in the --scell_matrix file (default: Accession/var index).')
 @click.option('--default_ref_genome', default='GRCh38', type=str,
               help='Default reference genome to start Hail. Only GRCh38 is supported for now.')
+@click.option('--n_partitions', default=N_GENOME_PARTITIONS, type=int,
+              help='Approximate number of genome-wide partitions shared by all locus-keyed tables.')
+@click.option('--force',
+              is_flag=True, help='Rebuild the requested tables even if their inputs have not changed.')
+@click.option('--checksums',
+              is_flag=True, help='Hash the raw inputs whose size or modification time changed, so that touched but '
+                                 'unchanged inputs do not trigger a rebuild.')
+@click.option('--jobs', default=1, type=int,
+              help='Number of tables built concurrently on the shared Hail backend.')
+@click.option('--log_dir', default='mktables_logs', type=str,
+              help='Local directory for per-table build logs.')
 @click.pass_context
 def make_annotation_tables_cli(ctx, raw_data_path,  output_dir, ccr, interactome, temporal_rnaseq, clinvar, gevir,
-                               scell_heart_deg, hca_rnaseq, gene_ensembl, gnomad_metrics, default_ref_genome):
+                               scell_heart_deg, hca_rnaseq, gene_ensembl, gnomad_metrics, gnomad_af,
+                               gnomad_af_fields, gnomad_af_intervals, dbnsfp, variant_bundle,
+                               gene_features, variant_index, scell_matrix, cell_type_attr, gene_id_attr,
+                               rnaseq_engine, default_ref_genome, n_partitions, force, checksums, jobs, log_dir):
 
     # exit if no flat parameter is set
     if not any([ccr, interactome, temporal_rnaseq, clinvar,
-                gevir, scell_heart_deg, hca_rnaseq, gene_ensembl, gnomad_metrics]):
+                gevir, scell_heart_deg, hca_rnaseq, gene_ensembl, gnomad_metrics, gnomad_af, dbnsfp, variant_bundle,
+                gene_features, scell_matrix, variant_index]):
         click.echo('No flag set. Please set at least one flag to create/update a table.')
         ctx.abort()
 
-    make_annotation_tables_from_raw_sources(raw_data_path,
-                                            ccr,
-                                            interactome,
-                                            temporal_rnaseq,
-                                            clinvar,
-                                            gevir,
-                                            scell_heart_deg,
-                                            hca_rnaseq,
-                                            gene_ensembl,
-                                            gnomad_metrics,
-                                            output_dir,
-                                            default_ref_genome)
+    status = make_annotation_tables_from_raw_sources(raw_data_path,
+                                                     ccr,
+                                                     interactome,
+                                                     temporal_rnaseq,
+                                                     clinvar,
+                                                     gevir,
+                                                     scell_heart_deg,
+                                                     hca_rnaseq,
+                                                     gene_ensembl,
+                                                     gnomad_metrics,
+                                                     dbnsfp,
+                                                     gnomad_af,
+                                                     gnomad_af_fields,
+                                                     gnomad_af_intervals,
+                                                     variant_bundle,
+                                                     gene_features,
+                                                     output_dir,
+                                                     default_ref_genome,
+                                                     n_partitions,
+                                                     force,
+                                                     checksums,
+                                                     jobs,
+                                                     log_dir,
+                                                     scell_matrix,
+                                                     cell_type_attr,
+                                                     gene_id_attr,
+                                                     rnaseq_engine,
+                                                     variant_index)
+
+    # combined exit status
+    for name, table_status in status.items():
+        click.echo(f'{name}: {table_status}')
+    if 'failed' in status.values() or UPSTREAM_FAILED in status.values():
+        ctx.exit(1)
 
 
 if __name__ == '__main__':
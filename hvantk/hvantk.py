@@ -1,13 +1,63 @@
+import importlib
+
 import click
 
 from hvantk.settings import CONTEXT_SETTINGS
-from hvantk.commands.make_annotation_tables_cli import make_annotation_tables_cli
 
 
 # Main CLI entry point for the package (hvantk)
 
 
+# Subcommands: name -> (import path `module:attribute`, short help). They are imported only
+# when invoked, so that `hvantk --help` does not load Hail (JVM bridge, PySpark).
+LAZY_SUBCOMMANDS = {
+    'mktables': ('hvantk.commands.make_annotation_tables_cli:make_annotation_tables_cli',
+                 'Create annotation tables from raw sources.'),
+    'annotate': ('hvantk.commands.annotate_cli:annotate_cli',
+                 'Annotate a variant table with features from multiple sources.'),
+    'serve': ('hvantk.commands.annotate_cli:serve_cli',
+              'Serve annotate requests from a persistent Hail session.'),
+    'lookup': ('hvantk.commands.annotate_cli:lookup_cli',
+               'Annotate a small variant list from a local variant index (no Spark).'),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    Click group importing its subcommands on first use.
+    """
+
+    def __init__(self, *args, lazy_subcommands: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
+        module_name, attr = self.lazy_subcommands[cmd_name][0].split(':')
+        return getattr(importlib.import_module(module_name), attr)
+
+    def format_commands(self, ctx, formatter):
+        # list the lazy subcommands with their registered short help, without importing them
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.lazy_subcommands:
+                rows.append((name, self.lazy_subcommands[name][1]))
+            else:
+                cmd = super().get_command(ctx, name)
+                if cmd is not None and not cmd.hidden:
+                    rows.append((name, cmd.get_short_help_str(formatter.width)))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
 @click.group('hvantk',
+             cls=LazyGroup,
+             lazy_subcommands=LAZY_SUBCOMMANDS,
              help='A python package for gene and variant annotation.',
              context_settings=CONTEXT_SETTINGS)
 def cli():
@@ -15,8 +65,6 @@ def cli():
     pass
 
 
-cli.add_command(make_annotation_tables_cli)
-
 def main():
     cli()
 
@@ -9,6 +9,9 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 RAW_DATA_PATH = None
 ANNOTATION_DATA_PATH = None
 
+# Approximate number of partitions of the shared genome-wide partitioning of locus-keyed tables
+N_GENOME_PARTITIONS = 1000
+
 
 def set_raw_data_path(raw_data_path: str):
     """
@@ -26,6 +29,8 @@ def set_raw_data_path(raw_data_path: str):
     global RAW_DATA_PATH
     if os.path.isdir(raw_data_path):
         RAW_DATA_PATH = raw_data_path
+        # update (in place) the raw data paths, which are shared with the table builders
+        RAW_DATA_PATHS.update({k: f'{RAW_DATA_PATH}/{v}' for k, v in RAW_DATA_FILES.items()})
         return RAW_DATA_PATH
     else:
         raise ValueError("Invalid raw_data_path: {}".format(raw_data_path))
@@ -52,18 +57,25 @@ def set_annotation_data_path(annotation_data_path: str):
         raise ValueError("Invalid annotation_data_path: {}".format(annotation_data_path))
 
 
-# A dictionary of raw data paths
-RAW_DATA_PATHS = {
-   'interactome_path':      f'{RAW_DATA_PATH}/interactome/Interactome_INSIDER_hg38_stripped.bed',
-   'clinvar_path':          f'{RAW_DATA_PATH}/clinvar/clinvar_20220403.vcf.gz',
-   'rnaseq_path':           f'{RAW_DATA_PATH}/rnaseq-expression/E-MTAB-6814.Human.CPM.txt',
-   'gene_ann_path':         f'{RAW_DATA_PATH}/ensembl/gene.ensembl.canonical.042022.tsv',
-   'gnomad_metrics_path':   f'{RAW_DATA_PATH}/gnomad/gnomad.v2.1.1.lof_metrics.by_transcript.txt.bgz',
-   'gevir_path':            f'{RAW_DATA_PATH}/gevir/gevir_metrics_pmid31873297.tsv.txt',
-   'scell_heart_path':      f'{RAW_DATA_PATH}/rnaseq-expression/deg_scell_heart_pmid31835037.tsv',
-   'scell_hca_path':        f'{RAW_DATA_PATH}/rnaseq-expression/hca_cells_ucsc_042022.tsv'
+# A dictionary of raw data files (relative to RAW_DATA_PATH)
+RAW_DATA_FILES = {
+   'interactome_path':      'interactome/Interactome_INSIDER_hg38_stripped.bed',
+   'clinvar_path':          'clinvar/clinvar_20220403.vcf.gz',
+   'rnaseq_path':           'rnaseq-expression/E-MTAB-6814.Human.CPM.txt',
+   'gene_ann_path':         'ensembl/gene.ensembl.canonical.042022.tsv',
+   'gnomad_metrics_path':   'gnomad/gnomad.v2.1.1.lof_metrics.by_transcript.txt.bgz',
+   'gevir_path':            'gevir/gevir_metrics_pmid31873297.tsv.txt',
+   'scell_heart_path':      'rnaseq-expression/deg_scell_heart_pmid31835037.tsv',
+   'scell_hca_path':        'rnaseq-expression/hca_cells_ucsc_042022.tsv',
+   'dbnsfp_path':           'dbnsfp/dbNSFP4.1a_variant.chr*.gz',
+   'gnomad_af_path':        'gnomad/gnomad.genomes.r3.0.sites.chr*.vcf.bgz',
+   # registry of column types of the raw tabular sources (learned on first import)
+   'schemas_path':          'raw_data_schemas.json'
 }
 
+# A dictionary of raw data paths
+RAW_DATA_PATHS = {k: f'{RAW_DATA_PATH}/{v}' for k, v in RAW_DATA_FILES.items()}
+
 
 # A dictionary of annotation data paths
 ANNOTATION_DATA_PATHS = {}
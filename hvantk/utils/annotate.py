@@ -7,60 +7,217 @@ from hvantk.utils.dataset import (get_ccr_ht,
                                   get_gevir_ht,
                                   get_gene_expression_ht,
                                   get_ppi_ht,
-                                  get_gene_ann_ht,
+                                  get_gene_alias_ht,
                                   get_dbnsfp_scores_ht,
+                                  get_dbnsfp_transcript_ht,
+                                  has_dbnsfp_transcript_ht,
                                   get_gnomad_metrics_ht,
                                   get_gnomad_af_ht,
                                   get_deg_ht,
                                   get_clinvar_ht,
-                                  get_hca_ht)
-
-
-def annotate_clinvar_clnsig(t: hl.Table) -> hl.Table:
-    clinvar_ht = get_clinvar_ht()
-    # Benign labels from Clinvar
-    benign_label_clinvar = ['Benign/Likely_benign',
-                            'Likely_benign',
-                            'Benign']
-    # Pathogenic labels from Clinvar
-    pathogenic_label_clinvar = ['Pathogenic/Likely_pathogenic',
-                                'Likely_pathogenic',
-                                'Pathogenic']
-    
-    # Pre-calculate conditions for better readability and performance
-    is_pathogenic = t.clinvar_clnsig.any(lambda x: hl.set(pathogenic_label_clinvar).contains(x))
-    is_benign = t.clinvar_clnsig.any(lambda x: hl.set(benign_label_clinvar).contains(x))
-    
-    t = t.annotate(clinvar_clnsig=clinvar_ht[t.key].info.CLNSIG)
-    t = t.annotate(clinvar_clnsig=hl.case()
-                   .when(is_pathogenic, 'P')
-                   .when(is_benign, 'B')
-                   .or_missing()
-                   )
+                                  get_hca_ht,
+                                  get_variant_bundle_ht,
+                                  get_gene_features_ht,
+                                  get_table_size_bytes)
+from hvantk.utils.io import get_shared_partition_intervals
+
+
+# Maximum on-disk (compressed) size of the row data of a (gene-level) reference table to be
+# broadcast as an in-memory lookup instead of being joined. The broadcast dict is embedded in
+# the query plan, so the cap is on bytes (nested values expand several-fold in memory).
+BROADCAST_MAX_BYTES = 2 * 1024 * 1024
+
+
+def _lookup(ref_ht: hl.Table,
+            key_expr: hl.expr.Expression,
+            broadcast: bool = None,
+            size_bytes: int = None) -> hl.expr.StructExpression:
+    """
+    Look up the row values of a single-keyed reference table for a key expression.
+
+    Small tables are collected once and broadcast as a dict, which avoids the keyed join (and
+    the shuffle of the annotated table). Larger tables are joined. The dict is built when the
+    annotation runs (not when the expression is built), so that its cost is measured with the
+    stage using it. For duplicate keys both paths return the first row of the key, as Hail's
+    keyed join does.
+
+    :param ref_ht: Reference Hail Table with a single key field
+    :param key_expr: Key expression from the table to annotate
+    :param broadcast: Broadcast the reference table. If None, broadcast only when its on-disk
+        size is known and at most `BROADCAST_MAX_BYTES` (no Spark job is run to decide).
+    :param size_bytes: On-disk size of the reference table (see `get_table_size_bytes`), or None
+    :return: Struct expression with the reference row values
+    """
+    if broadcast is None:
+        broadcast = size_bytes is not None and size_bytes <= BROADCAST_MAX_BYTES
+
+    if not broadcast:
+        return ref_ht[key_expr]
+
+    # the keyed join keeps the first row of duplicate keys; the dict would keep the last one
+    ref_ht = ref_ht.distinct()
+    mapping_expr = hl.dict(ref_ht.aggregate(hl.agg.collect((ref_ht.key[0], ref_ht.row_value)),
+                                            _localize=False))
+
+    return mapping_expr.get(key_expr)
+
+
+# Maximum number of rows of an input table for which the covered locus intervals are
+# pushed down to the (genome-wide) variant-level reference tables.
+INTERVAL_PUSHDOWN_MAX_ROWS = 100_000
+
+# Input loci closer than this distance (bp) are merged into a single interval.
+INTERVAL_MERGE_DISTANCE = 100_000
+
+
+def get_locus_intervals(t: hl.Table,
+                        max_rows: int = INTERVAL_PUSHDOWN_MAX_ROWS,
+                        merge_distance: int = INTERVAL_MERGE_DISTANCE) -> list:
+    """
+    Compute the locus intervals covered by the variants of a table, merging loci closer than
+    `merge_distance`. The intervals are used to prune the partitions read from the
+    variant-level reference tables (see `hl.filter_intervals`).
+
+    :param t: Hail Table with a `locus` field
+    :param max_rows: Return None (no pushdown) for tables with more rows than this
+    :param merge_distance: Maximum distance (bp) between loci merged into one interval
+    :return: List of locus intervals, or None
+    """
+    if t.count() > max_rows:
+        return None
+
+    rg = t.locus.dtype.reference_genome
+    contig_index = {c: i for i, c in enumerate(rg.contigs)}
+    loci = sorted(t.aggregate(hl.agg.collect_as_set(t.locus)),
+                  key=lambda x: (contig_index[x.contig], x.position))
+
+    spans = []
+    for locus in loci:
+        if spans and spans[-1][0] == locus.contig and locus.position - spans[-1][2] <= merge_distance:
+            spans[-1][2] = locus.position
+        else:
+            spans.append([locus.contig, locus.position, locus.position])
+
+    return [hl.Interval(hl.Locus(contig, start, reference_genome=rg),
+                        hl.Locus(contig, end, reference_genome=rg),
+                        includes_end=True)
+            for contig, start, end in spans]
+
+
+def _filter_to_intervals(ref_ht: hl.Table,
+                         intervals: list = None) -> hl.Table:
+    """
+    Filter a locus-keyed reference table to the partitions overlapping the given intervals.
+
+    :param ref_ht: Reference Hail Table keyed by `locus` (and `alleles`)
+    :param intervals: List of locus intervals. If None, the table is returned as is.
+    :return: Hail Table
+    """
+    if intervals is None:
+        return ref_ht
+    return hl.filter_intervals(ref_ht, intervals)
+
+
+def get_copartition_intervals(use_bundle: bool = False) -> list:
+    """
+    Return the shared partition intervals of the allele-level reference tables, if they were
+    all written co-partitioned by mktables. An input table read with these intervals
+    (`hl.read_table(..., _intervals=...)`) is joined partition-aligned, with no repartitioning
+    between stacked annotations.
+
+    Only the tables mktables writes co-partitioned are checked: CCR has no builder yet, and the
+    interactome is looked up by locus.
+
+    :param use_bundle: Check the variant bundle instead of the individual reference tables
+    :return: List of locus intervals, or None
+    """
+    if use_bundle:
+        tables = [get_variant_bundle_ht()]
+    else:
+        tables = [get_clinvar_ht(),
+                  get_gnomad_af_ht(),
+                  get_dbnsfp_scores_ht()]
+
+    return get_shared_partition_intervals(tables)
+
+
+# Benign labels from Clinvar
+BENIGN_LABEL_CLINVAR = ['Benign/Likely_benign',
+                        'Likely_benign',
+                        'Benign']
+
+# Pathogenic labels from Clinvar
+PATHOGENIC_LABEL_CLINVAR = ['Pathogenic/Likely_pathogenic',
+                            'Likely_pathogenic',
+                            'Pathogenic']
+
+
+def _clinvar_clnsig_label(clnsig: hl.expr.ArrayExpression) -> hl.expr.StringExpression:
+    """
+    Collapse Clinvar CLNSIG values into a pathogenic ('P') / benign ('B') label.
+
+    :param clnsig: Array expression with Clinvar CLNSIG values
+    :return: String expression ('P', 'B' or missing)
+    """
+    is_pathogenic = clnsig.any(lambda x: hl.set(PATHOGENIC_LABEL_CLINVAR).contains(x))
+    is_benign = clnsig.any(lambda x: hl.set(BENIGN_LABEL_CLINVAR).contains(x))
+
+    return (hl.case()
+            .when(is_pathogenic, 'P')
+            .when(is_benign, 'B')
+            .or_missing()
+            )
+
+
+def annotate_clinvar_clnsig(t: hl.Table,
+                            intervals: list = None) -> hl.Table:
+    clinvar_ht = _filter_to_intervals(get_clinvar_ht(), intervals)
+    t = t.annotate(clinvar_clnsig=_clinvar_clnsig_label(clinvar_ht[t.key].info.CLNSIG))
 
     return t
 
 
-def annotate_ccr(t: hl.Table) -> hl.Table:
-    ccr_ht = get_ccr_ht()
+def annotate_ccr(t: hl.Table,
+                 intervals: list = None) -> hl.Table:
+    ccr_ht = _filter_to_intervals(get_ccr_ht(), intervals)
     t = t.annotate(ccr_pct=ccr_ht[t.locus].ccr_pct)
     return t
 
 
 def annotate_gevir(t: hl.Table,
-                   gene_id_col: str, ) -> hl.Table:
+                   gene_id_col: str,
+                   broadcast: bool = None) -> hl.Table:
     gevir_ht = (get_gevir_ht()
                 .select('gevir_pct', 'virlof_pct')
                 )
-    t = t.annotate(**gevir_ht[t[gene_id_col]])
+    t = t.annotate(**_lookup(gevir_ht, t[gene_id_col], broadcast,
+                             size_bytes=get_table_size_bytes('gevir.metrics.ht')))
     return t
 
 
 def annotate_rnaseq_expression(t: hl.Table,
                                gene_id_col: str,
-                               organ: str = 'Heart') -> hl.Table:
+                               organ='Heart',
+                               broadcast: bool = None) -> hl.Table:
+    """
+    Annotate gene expression levels per time points from the temporal RNA-seq table.
+
+    For a list of organs, one array field per organ is annotated, aligned with the time points
+    stored in the `rnaseq_time_points` global field.
+
+    :param t: Hail Table
+    :param gene_id_col: Column name with Ensembl gene IDs
+    :param organ: Organ of interest (e.g. Heart, Brain, Liver, ...), or a list of organs
+    :param broadcast: Broadcast the expression table as an in-memory lookup (None: decide by table size)
+    :return: Hail Table
+    """
     gene_expression_ht = get_gene_expression_ht(organ=organ)
-    t = t.annotate(**gene_expression_ht[t[gene_id_col]])
+    t = t.annotate(**_lookup(gene_expression_ht, t[gene_id_col], broadcast,
+                             size_bytes=get_table_size_bytes('rnaseq.human.ht')))
+
+    if not isinstance(organ, str):
+        time_points = gene_expression_ht.index_globals().time_points
+        t = t.annotate_globals(rnaseq_time_points=hl.dict({o: time_points[o] for o in organ}))
     return t
 
 
@@ -71,71 +228,119 @@ def annotate_ppi(t: hl.Table) -> hl.Table:
 
 
 def annotate_ensembl_gene(t: hl.Table,
-                          gene_symbol_col: str) -> hl.Table:
+                          gene_symbol_col: str,
+                          broadcast: bool = None) -> hl.Table:
     """
     Annotate gene and transcript ensembl canonical IDs given a gene symbol name.
-    Includes searching for synonymous gene name.
+    Includes searching for synonymous gene name, using the prebuilt alias index table.
 
     :param t: Hail Table
     :param gene_symbol_col: Column name with gene symbols
+    :param broadcast: Broadcast the alias table as an in-memory lookup (None: decide by table size)
     :return: Hail Table
     """
 
-    # Import and prepare gene table for annotation
-    gene_ht = get_gene_ann_ht()
-    gene_ht = (gene_ht
-               .transmute(gene_aliases=gene_ht.Gene_Synonym.add(gene_ht.Gene))
-               .explode('gene_aliases', name='Gene')
-               .key_by('Gene')
+    # Import gene alias index (alias -> GeneID, TranscriptID)
+    gene_ht = (get_gene_alias_ht()
                .select('GeneID', 'TranscriptID')
                )
 
     # Annotate table
-    t = t.annotate(**gene_ht[t[gene_symbol_col]])
+    t = t.annotate(**_lookup(gene_ht, t[gene_symbol_col], broadcast,
+                             size_bytes=get_table_size_bytes('gene.alias.ensembl.ht')))
     return t
 
 
+def get_dbnsfp_score_fields(ht: hl.Table) -> list:
+    """
+    Return the deleterious score fields from a dbNSFP table.
+
+    :param ht: dbNSFP Hail Table
+    :return: List of field names
+    """
+    return [f for f in ht.row if f.endswith('_score') or f == 'CADD_phred']
+
+
+def _dbnsfp_score(score_expr: hl.expr.Expression,
+                  transcript_expr: hl.expr.StringExpression) -> hl.expr.Float64Expression:
+    """
+    Return the score of a transcript from a variant-keyed dbNSFP score field: a transcript -> score
+    dict for per-transcript scores, or a single value for variant-level scores (see
+    `create_dbnsfp_variant_tb`).
+    """
+    if isinstance(score_expr.dtype, hl.tdict):
+        return score_expr.get(transcript_expr)
+    return score_expr
+
+
 def annotate_dbnsfp_scores(t: hl.Table,
-                           transcript_id_col: str) -> hl.Table:
+                           transcript_id_col: str,
+                           intervals: list = None) -> hl.Table:
     """
     Annotate transcript-specific deleterious scores from dbNSFP database.
 
+    If the transcript-resolved dbNSFP table is available (see `create_dbnsfp_tb`), only the
+    per-transcript scores of the affected transcript are looked up, and the variant-level scores
+    (e.g. CADD) are taken from the variant-keyed table. Otherwise, the per-transcript score dicts
+    of the variant-keyed table are joined and the affected transcript is picked afterwards.
+
     :param t: Hail Table keyed by `locus` and `alleles`
     :param transcript_id_col: Ensembl transcript ID column
+    :param intervals: Locus intervals covered by `t` (see `get_locus_intervals`) to prune dbNSFP partitions
     :return: Hail Table
     """
 
+    if has_dbnsfp_transcript_ht():
+        ht_scores = _filter_to_intervals(get_dbnsfp_transcript_ht(), intervals)
+        scores_fields = get_dbnsfp_score_fields(ht_scores)
+        transcript_scores = hl.eval(ht_scores.transcript_score_fields)
+        variant_scores = [f for f in scores_fields if f not in transcript_scores]
+
+        scores_expr = ht_scores.select(*transcript_scores)[t.locus, t.alleles, t[transcript_id_col]]
+        ann_expr = {f: hl.float64(scores_expr[f]) for f in transcript_scores}
+        if variant_scores:
+            ht_variant = _filter_to_intervals(get_dbnsfp_scores_ht(), intervals)
+            variant_expr = ht_variant.select(*variant_scores)[t.key]
+            ann_expr.update({f: variant_expr[f] for f in variant_scores})
+
+        # scores are stored as float32; annotate them as float64, as from the variant-keyed table
+        return t.annotate(**{f: ann_expr[f] for f in scores_fields})
+
     # Import and parse dbNSFP dataset with annotation scores
-    ht_scores = get_dbnsfp_scores_ht()
-    scores_fields = [f for f in ht_scores.row if f.endswith('_score') or f == 'CADD_phred']
+    ht_scores = _filter_to_intervals(get_dbnsfp_scores_ht(), intervals)
+    scores_fields = get_dbnsfp_score_fields(ht_scores)
     ht_scores = (ht_scores
                  .select(*scores_fields)
                  )
 
     # Annotate scores taking into account the affected transcript.
     t = t.annotate(**ht_scores[t.key])
-    t = t.annotate(**{f: t[f].get(t[transcript_id_col]) for f in scores_fields})
+    t = t.annotate(**{f: _dbnsfp_score(t[f], t[transcript_id_col]) for f in scores_fields})
 
     return t
 
 
 def annotate_gnomad_constraint_metrics(t: hl.Table,
-                                       transcript_id_col: str) -> hl.Table:
+                                       transcript_id_col: str,
+                                       broadcast: bool = None) -> hl.Table:
     """
     Annotate transcript-specific loss-of-function and missense constraint metrics from gnomad.
 
     :param t: Hail Table
     :param transcript_id_col: Ensembl transcript ID column
+    :param broadcast: Broadcast the metrics table as an in-memory lookup (None: decide by table size)
     :return: Hail Table
     """
     gnomad_metrics = get_gnomad_metrics_ht()
-    t = t.annotate(**gnomad_metrics[t[transcript_id_col]])
+    t = t.annotate(**_lookup(gnomad_metrics, t[transcript_id_col], broadcast,
+                             size_bytes=get_table_size_bytes('gnomad.metrics.ht')))
     return t
 
 
 def annotate_degs(t: hl.Table,
                   gene_symbol_col: str,
-                  clusters: list = ['C0', 'C5', 'C7', 'C10', 'C14']) -> hl.Table:
+                  clusters: list = ['C0', 'C5', 'C7', 'C10', 'C14'],
+                  broadcast: bool = None) -> hl.Table:
     """
     Annotate (1-True, 0-False) whether the gene is differentially expressed in
     cardiac-specific cell clusters.
@@ -143,12 +348,14 @@ def annotate_degs(t: hl.Table,
     :param t: Hail Table
     :param gene_symbol_col: Column name with gene symbols
     :param clusters: Cell cluster ids to query (e.g. C0, C1...)
+    :param broadcast: Broadcast the DEGs table as an in-memory lookup (None: decide by table size)
 
     :return: Hail Table
     """
     degs = get_deg_ht()
 
-    t = t.annotate(sc_cluster_id=degs[t[gene_symbol_col]].cluster_id)
+    t = t.annotate(sc_cluster_id=_lookup(degs, t[gene_symbol_col], broadcast,
+                                         size_bytes=get_table_size_bytes('scell.heart.degs.ht')).cluster_id)
 
     t = (t
          .transmute(**{f'sc_cluster_{c}': hl.if_else(hl.is_defined(t.sc_cluster_id) & t.sc_cluster_id.contains(c),
@@ -166,38 +373,105 @@ def annotate_hca(t: hl.Table,
                                            'fibroblast',
                                            'neuronal',
                                            'smooth_muscle_cell',
-                                           'ventricular_cardiomyocyte')) -> hl.Table:
+                                           'ventricular_cardiomyocyte'),
+                 broadcast: bool = None,
+                 hca_ht: hl.Table = None) -> hl.Table:
     """
     Annotate gene expression levels (mean umi/cell) per cell categories from HCA dataset (UCSC)
 
     :param t: Hail Table
     :param gene_id_col: Column name with gene symbols
     :param cell_categories: Cell categories to annotate (e.g. ...) TODO: make cell categories a constant
+    :param broadcast: Broadcast the HCA table as an in-memory lookup (None: decide by table size)
+    :param hca_ht: Gene-keyed expression table with one field per cell category, e.g. a
+        pseudo-bulk table from `get_scell_pseudobulk_ht`. Defaults to the HCA table.
 
     :return: Hail Table
     """
-    hca_tb = (get_hca_ht()
+    # the size of a table passed by the caller is unknown: it is broadcast only if requested
+    size_bytes = None
+    if hca_ht is None:
+        hca_ht = get_hca_ht()
+        size_bytes = get_table_size_bytes('hca.heart.ht')
+
+    hca_tb = (hca_ht
               .select(*cell_categories)
               )
 
     t = (t
-         .annotate(hca=hl.struct(**hca_tb[t[gene_id_col]]))
+         .annotate(hca=hl.struct(**_lookup(hca_tb, t[gene_id_col], broadcast, size_bytes=size_bytes)))
          )
 
     return t
 
 
-def annotate_gnomad_af(t: hl.Table) -> hl.Table:
+def annotate_gene_features(t: hl.Table,
+                           gene_id_col: str,
+                           transcript_id_col: str = None,
+                           organ: str = 'Heart',
+                           clusters: list = ['C0', 'C5', 'C7', 'C10', 'C14'],
+                           cell_categories: tuple = ('atrial_cardiomyocyte',
+                                                     'endothelial',
+                                                     'fibroblast',
+                                                     'neuronal',
+                                                     'smooth_muscle_cell',
+                                                     'ventricular_cardiomyocyte'),
+                           broadcast: bool = None) -> hl.Table:
+    """
+    Annotate all gene-level features (GeVIR, RNA-seq expression, gnomad constraint metrics,
+    HCA expression and cardiac DEGs) from the consolidated gene feature table with a single lookup.
+    Output fields match those of the individual annotators.
+
+    :param t: Hail Table
+    :param gene_id_col: Column name with Ensembl gene IDs
+    :param transcript_id_col: Ensembl transcript ID column. If None, constraint metrics are not annotated.
+    :param organ: Organ of interest for RNA-seq expression (e.g. Heart, Brain, Liver, ...)
+    :param clusters: Cell cluster ids to query (e.g. C0, C1...). If None, DEGs are not annotated.
+    :param cell_categories: HCA cell categories to annotate
+    :param broadcast: Broadcast the gene feature table as an in-memory lookup (None: decide by table size)
+    :return: Hail Table
+    """
+    gene_features_ht = get_gene_features_ht()
+    tps = hl.eval(gene_features_ht.rnaseq_time_points.get(organ, hl.empty_array(hl.tstr)))
+
+    t = t.annotate(_gf=_lookup(gene_features_ht, t[gene_id_col], broadcast,
+                               size_bytes=get_table_size_bytes('gene.features.ht')))
+
+    ann_expr = {
+        'gevir_pct': t._gf.gevir.gevir_pct,
+        'virlof_pct': t._gf.gevir.virlof_pct,
+        **{f'{organ}.{tp}': t._gf.mean_expr_time_point.get(hl.struct(organ=organ, time_point=tp))
+           for tp in tps},
+        'hca': t._gf.hca.select(*cell_categories)
+    }
+    if transcript_id_col is not None:
+        metrics = t._gf.transcripts.get(t[transcript_id_col])
+        ann_expr.update(loeuf=metrics.loeuf,
+                        moeuf=metrics.moeuf)
+    if clusters is not None:
+        ann_expr.update({f'sc_cluster_{c}': hl.if_else(hl.is_defined(t._gf.sc_cluster_id) &
+                                                       t._gf.sc_cluster_id.contains(c),
+                                                       1, 0)
+                         for c in clusters})
+
+    t = t.annotate(**ann_expr).drop('_gf')
+
+    return t
+
+
+def annotate_gnomad_af(t: hl.Table,
+                       intervals: list = None) -> hl.Table:
     """
     Annotate allele frequencies from gnomad v3.0 (whole-genome).
     Annotate missing (absent) AF values as zero.
 
     :param t: Hail Table keyed by `locus` and `alleles`
+    :param intervals: Locus intervals covered by `t` (see `get_locus_intervals`) to prune gnomad partitions
     :return: Hail Table
     """
 
     # import gnomad table with allele frequency annotation
-    gnomad_af = get_gnomad_af_ht()
+    gnomad_af = _filter_to_intervals(get_gnomad_af_ht(), intervals)
 
     # define allele frequency annotation expression
     ann_expr = gnomad_af[t.key].AF
@@ -208,6 +482,44 @@ def annotate_gnomad_af(t: hl.Table) -> hl.Table:
     return t
 
 
+def annotate_variant_bundle(t: hl.Table,
+                            transcript_id_col: str = None,
+                            intervals: list = None) -> hl.Table:
+    """
+    Annotate variant-level features (Clinvar, gnomad AF and dbNSFP scores) from the pre-joined
+    annotation bundle with a single join, and the locus-level features (CCR and interactome
+    sites) by locus, as `annotate_ccr` and `annotate_ppi` do. Output fields match those of the
+    individual annotators, also for variants outside the bundle.
+
+    :param t: Hail Table keyed by `locus` and `alleles`
+    :param transcript_id_col: Ensembl transcript ID column. If None, dbNSFP scores are not annotated.
+    :param intervals: Locus intervals covered by `t` (see `get_locus_intervals`) to prune bundle partitions
+    :return: Hail Table
+    """
+
+    bundle_ht = _filter_to_intervals(get_variant_bundle_ht(), intervals)
+    scores_fields = get_dbnsfp_score_fields(bundle_ht)
+
+    t = t.annotate(_bundle=bundle_ht[t.key])
+
+    ann_expr = {
+        'clinvar_clnsig': _clinvar_clnsig_label(t._bundle.clinvar_clnsig),
+        'gnomad_af_genomes': hl.if_else(hl.is_defined(t._bundle.gnomad_af_genomes),
+                                        t._bundle.gnomad_af_genomes,
+                                        hl.float(0))
+    }
+    if transcript_id_col is not None:
+        ann_expr.update({f: _dbnsfp_score(t._bundle[f], t[transcript_id_col]) for f in scores_fields})
+
+    t = t.annotate(**ann_expr).drop('_bundle')
+
+    # locus-level sources cover loci without any bundled variant
+    t = annotate_ccr(t, intervals=intervals)
+    t = annotate_ppi(t)
+
+    return t
+
+
 def annotate_variant_id(t: hl.Table,
                         field_name: str = 'vid') -> hl.Table:
     """
@@ -1,10 +1,103 @@
 # eam
 # 06.04.22
 
+import functools
+import threading
+from collections import OrderedDict
+
 import hail as hl
 
+from hvantk.utils.io import read_copartitioned
+
 source_dir = None
 
+# Maximum number of entries kept in the process-level table cache
+TABLE_CACHE_SIZE = 32
+
+# Process-level (LRU) cache of table handles and derived objects: key -> (version, value)
+_table_cache = OrderedDict()
+_table_cache_lock = threading.Lock()
+
+
+def _path_version(path: str) -> tuple:
+    """
+    Return a version stamp (size, modification time) for a file or a Hail Table.
+    For Hail Tables the metadata file is used, which is rewritten whenever the table is.
+
+    :param path: Path to a file or Hail Table
+    :return: Tuple with size and modification time
+    """
+    if hl.hadoop_is_dir(path):
+        path = f'{path}/metadata.json.gz'
+    stat = hl.hadoop_stat(path)
+    return stat['size'], stat['modification_time']
+
+
+def _cached(key: tuple, path: str, fn):
+    """
+    Return the cached value for `key`, computing it with `fn` on a miss. Entries are
+    invalidated when the file/table at `path` changes on disk, and evicted in LRU order
+    beyond `TABLE_CACHE_SIZE` entries.
+
+    :param key: Cache key (e.g. getter name, path and parameters)
+    :param path: Path of the file/table the value is derived from
+    :param fn: Function computing the value
+    :return: Cached value
+    """
+    version = _path_version(path)
+    with _table_cache_lock:
+        entry = _table_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _table_cache.move_to_end(key)
+            return entry[1]
+
+    value = fn()
+
+    with _table_cache_lock:
+        _table_cache[key] = (version, value)
+        _table_cache.move_to_end(key)
+        while len(_table_cache) > TABLE_CACHE_SIZE:
+            _table_cache.popitem(last=False)
+
+    return value
+
+
+def _read_table(path: str) -> hl.Table:
+    """
+    Read a Hail Table through the process-level cache. Co-partitioned tables are read with
+    the shared partition intervals (see `read_copartitioned`).
+
+    :param path: Path to Hail Table
+    :return: Hail Table
+    """
+    return _cached(('read_table', path), path, functools.partial(read_copartitioned, path))
+
+
+def get_table_size_bytes(name: str) -> int:
+    """
+    Return the on-disk (compressed) size of the row data of an annotation table, cached until
+    the table is rewritten.
+
+    :param name: Table name in `<source_dir>/data/ht` (e.g. 'gevir.metrics.ht')
+    :return: Size in bytes, or None if the table is missing
+    """
+    path = f'{source_dir}/data/ht/{name}'
+    if not hl.hadoop_exists(f'{path}/metadata.json.gz'):
+        return None
+
+    def _size():
+        return sum(f['size'] for f in hl.hadoop_ls(f'{path}/rows/parts') if not f['is_dir'])
+
+    return _cached(('get_table_size_bytes', path), path, _size)
+
+
+def clear_table_cache():
+    """
+    Clear the process-level cache used by the `get_*` getters.
+    """
+    with _table_cache_lock:
+        _table_cache.clear()
+
 
 def get_chd_denovo_ht() -> hl.Table:
     """
@@ -13,7 +106,7 @@ def get_chd_denovo_ht() -> hl.Table:
 
     :return: Hail Table
     """
-    return hl.read_table(f'{source_dir}/data/ht/DNM_Jin2017_Sifrim2016_GRCh38_lift.ht')
+    return _read_table(f'{source_dir}/data/ht/DNM_Jin2017_Sifrim2016_GRCh38_lift.ht')
 
 
 def get_clinvar_ht() -> hl.Table:
@@ -22,24 +115,69 @@ def get_clinvar_ht() -> hl.Table:
 
     :return: Hail Table
     """
-    return hl.read_table(f'{source_dir}/data/ht/clinvar.GRCh38.ht')
+    return _read_table(f'{source_dir}/data/ht/clinvar.GRCh38.ht')
 
 
-def get_gene_expression_ht(organ: str = 'Heart',
+def get_gene_expression_ht(organ='Heart',
                            tp_col: str = 'mean_expr_time_point') -> hl.Table:
     """
     Extract organ-specific gene expression levels per time points.
 
-    :param organ: Organ of interest (e.g. Heart, Brain, Liver, ...)
+    For a single organ, expression values are returned as one field per time point
+    (`<organ>.<time_point>`). For a list of organs, one array field per organ is returned,
+    aligned with the time points in the `time_points` global field.
+
+    :param organ: Organ of interest (e.g. Heart, Brain, Liver, ...), or a list of organs
     :param tp_col: Field with averaged expression value per time points
 
     :return: Hail Table
     """
 
+    path = f"{source_dir}/data/ht/rnaseq.human.ht"
+    organ_key = organ if isinstance(organ, str) else tuple(organ)
+
+    return _cached(('get_gene_expression_ht', path, organ_key, tp_col), path,
+                   functools.partial(_gene_expression_ht, path, organ, tp_col))
+
+
+def _gene_expression_ht(path: str,
+                        organ,
+                        tp_col: str) -> hl.Table:
+
     # Import Hail Table with annotated expression values
-    t = hl.read_table(
-        f"{source_dir}/data/ht/rnaseq.human.ht"
-    )
+    t = _read_table(path)
+
+    if 'time_points' not in t.globals:
+        # table built without the organ-indexed layout
+        if not isinstance(organ, str):
+            raise ValueError("Multiple organs require an RNA-seq table with a `time_points` global "
+                             "(rebuild it with mktables --temporal_rnaseq)")
+        return _gene_expression_ht_from_dict(t, organ, tp_col)
+
+    # available time points per organ, from the table globals (no Spark action)
+    time_points = hl.eval(t.time_points)
+    organs = [organ] if isinstance(organ, str) else list(organ)
+    for o in organs:
+        if o not in time_points:
+            raise ValueError(f"Organ not found in RNA-seq table: {o}")
+
+    if isinstance(organ, str):
+        ann_expr = {f'{organ}.{tp}': t.expr_time_point[organ][i]
+                    for i, tp in enumerate(time_points[organ])}
+    else:
+        ann_expr = {o: t.expr_time_point[o] for o in organs}
+
+    t = (t
+         .select(**ann_expr)
+         .select_globals('time_points')
+         .key_by('Gene'))
+
+    return t
+
+
+def _gene_expression_ht_from_dict(t: hl.Table,
+                                  organ: str,
+                                  tp_col: str) -> hl.Table:
 
     # getting available time point for the specified Organ
     tps = (t[tp_col]
@@ -65,6 +203,12 @@ def get_gene_expression_ht(organ: str = 'Heart',
 def get_chd_gene_set() -> hl.expr.SetExpression:
 
     path = f"{source_dir}/resources/geneset/CHD_genes_all.tsv"
+
+    return _cached(('get_chd_gene_set', path), path,
+                   functools.partial(_chd_gene_set, path))
+
+
+def _chd_gene_set(path: str) -> hl.expr.SetExpression:
     t = hl.import_table(path, no_header=True)
     chd_gene_set = t.aggregate(hl.agg.collect_as_set(t.f0))
 
@@ -72,59 +216,108 @@ def get_chd_gene_set() -> hl.expr.SetExpression:
 
 
 def get_gene_ann_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/gene.ann.ensembl.ht"
     )
 
 
+def get_gene_alias_ht() -> hl.Table:
+    return _read_table(
+        f"{source_dir}/data/ht/gene.alias.ensembl.ht"
+    )
+
+
 def get_ccr_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/ccr.GRCh38.ht"
     )
 
 
 def get_gevir_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/gevir.metrics.ht"
     )
 
 
 def get_ppi_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/interactome.GRCh38.ht"
     )
 
 
 def get_dbnsfp_scores_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/dbNSFP4.1a_variant.ht"
     )
 
 
+def get_dbnsfp_transcript_ht() -> hl.Table:
+    """
+    Return the transcript-resolved dbNSFP table (see `create_dbnsfp_tb`), keyed by
+    `locus`, `alleles` and `transcript`.
+    """
+    return _read_table(
+        f"{source_dir}/data/ht/dbNSFP4.1a_transcript.ht"
+    )
+
+
+def has_dbnsfp_transcript_ht() -> bool:
+    return hl.hadoop_exists(f"{source_dir}/data/ht/dbNSFP4.1a_transcript.ht/_SUCCESS")
+
+
 def get_gnomad_metrics_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/gnomad.metrics.ht"
     )
 
 
 def get_gnomad_af_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/gnomad_3.0_sites_AF.ht"
     )
 
 
 def get_deg_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/scell.heart.degs.ht"
     )
 
 
 def get_hca_ht() -> hl.Table:
-    return hl.read_table(
+    return _read_table(
         f"{source_dir}/data/ht/hca.heart.ht"
     )
 
 
+def get_scell_pseudobulk_ht() -> hl.Table:
+    return _read_table(
+        f"{source_dir}/data/ht/scell.pseudobulk.ht"
+    )
+
+
+def get_variant_bundle_ht() -> hl.Table:
+    """
+    Return the pre-joined variant-level annotation bundle (Clinvar, gnomad AF and dbNSFP),
+    keyed by `locus` and `alleles`.
+
+    :return: Hail Table
+    """
+    return _read_table(
+        f"{source_dir}/data/ht/variant.bundle.GRCh38.ht"
+    )
+
+
+def get_gene_features_ht() -> hl.Table:
+    """
+    Return the consolidated gene-level feature table keyed by `GeneID`.
+
+    :return: Hail Table
+    """
+    return _read_table(
+        f"{source_dir}/data/ht/gene.features.ht"
+    )
+
+
 # Define a class to handle data exceptions and errors
 class DataException(Exception):
     """
@@ -135,4 +328,4 @@ class DataException(Exception):
         super().__init__(message)
 
     def __str__(self):
-        return "DataException: An error occurred while processing the data."
+        return f"DataException: {self.args[0]}"
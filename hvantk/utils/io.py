@@ -0,0 +1,577 @@
+"""
+Helpers to read and write Hail Tables.
+
+Locus-keyed annotation tables are tagged with one shared, genome-wide set of partition
+intervals and read with them, so that joins between them (and an input table read with the
+same intervals) are partition-aligned and need no repartitioning.
+
+Each table written by mktables gets a manifest next to it, recording its inputs, builder
+version and parameters, so that unchanged tables can be skipped on later runs.
+
+Annotated variants are memoized in a feature cache, stamped with the versions of the reference
+tables they were annotated from, so that later runs only annotate new variants.
+
+Annotation runs can checkpoint selected stages into a run directory, under a fingerprint of
+their inputs, stages and reference table versions, so that a failed run resumes from the last
+valid checkpoint.
+
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import hail as hl
+
+from hvantk.settings import N_GENOME_PARTITIONS
+
+
+# Global field recording the shared partitioning of a locus-keyed table
+PARTITIONING_GLOBAL = 'hvantk_partitioning'
+
+
+def get_genome_partition_intervals(n_partitions: int = N_GENOME_PARTITIONS,
+                                   reference_genome: str = 'GRCh38') -> list:
+    """
+    Split the reference genome into contiguous locus intervals of (roughly) equal length.
+    Every contig gets at least one interval, so that the intervals cover all possible loci.
+
+    :param n_partitions: Approximate number of intervals
+    :param reference_genome: Reference genome name
+    :return: List of locus intervals
+    """
+    rg = hl.get_reference(reference_genome)
+    step = max(sum(rg.lengths.values()) // n_partitions, 1)
+
+    intervals = []
+    for contig in rg.contigs:
+        length = rg.lengths[contig]
+        for start in range(1, length + 1, step):
+            end = start + step
+            if end > length:
+                intervals.append(hl.Interval(hl.Locus(contig, start, reference_genome=rg),
+                                             hl.Locus(contig, length, reference_genome=rg),
+                                             includes_end=True))
+            else:
+                intervals.append(hl.Interval(hl.Locus(contig, start, reference_genome=rg),
+                                             hl.Locus(contig, end, reference_genome=rg)))
+    return intervals
+
+
+def write_copartitioned(ht: hl.Table,
+                        output_path: str,
+                        n_partitions: int = N_GENOME_PARTITIONS,
+                        reference_genome: str = 'GRCh38') -> hl.Table:
+    """
+    Write a locus-keyed Hail Table tagged with the shared genome-wide partitioning
+    (see `get_genome_partition_intervals`), recorded in the `hvantk_partitioning` global field.
+    The table is written once, and read back partitioned by the shared intervals
+    (see `read_copartitioned`).
+
+    :param ht: Hail Table keyed by `locus` (and `alleles`)
+    :param output_path: Output path
+    :param n_partitions: Approximate number of partitions
+    :param reference_genome: Reference genome name
+    :return: Hail Table read back from `output_path`
+    """
+    ht = ht.annotate_globals(**{PARTITIONING_GLOBAL: hl.struct(n_partitions=n_partitions,
+                                                               reference_genome=reference_genome)})
+    ht.write(output_path, overwrite=True)
+
+    return read_copartitioned(output_path)
+
+
+def read_copartitioned(path: str) -> hl.Table:
+    """
+    Read a Hail Table, partitioned by the shared genome-wide intervals if it was written with
+    `write_copartitioned` (the partitions are cut at read time, using the table index).
+
+    :param path: Path to Hail Table
+    :return: Hail Table
+    """
+    ht = hl.read_table(path)
+    if PARTITIONING_GLOBAL not in ht.globals:
+        return ht
+
+    spec = hl.eval(ht.globals[PARTITIONING_GLOBAL])
+    return hl.read_table(path, _intervals=get_genome_partition_intervals(spec.n_partitions, spec.reference_genome))
+
+
+def get_shared_partition_intervals(tables: list) -> list:
+    """
+    Return the shared genome-wide partition intervals if all tables were written with the
+    same partitioning (see `write_copartitioned`), otherwise None.
+
+    :param tables: List of Hail Tables
+    :return: List of locus intervals, or None
+    """
+    specs = set()
+    for ht in tables:
+        if PARTITIONING_GLOBAL not in ht.globals:
+            return None
+        spec = hl.eval(ht.globals[PARTITIONING_GLOBAL])
+        specs.add((spec.n_partitions, spec.reference_genome))
+
+    if len(specs) != 1:
+        return None
+
+    n_partitions, reference_genome = specs.pop()
+    return get_genome_partition_intervals(n_partitions, reference_genome)
+
+
+def _input_files(path: str) -> list:
+    """
+    Expand an input path (file, glob pattern or Hail Table) into the list of files to stamp.
+    Hail Tables are represented by their manifest if they have one (it changes whenever the
+    table inputs do), otherwise by their metadata file.
+
+    :param path: Path to a file, a glob pattern or a Hail Table
+    :return: List of file stats (see `hl.hadoop_ls`)
+    """
+    if hl.hadoop_is_dir(path) and hl.hadoop_exists(f'{path}/metadata.json.gz'):
+        if hl.hadoop_exists(get_manifest_path(path)):
+            return [hl.hadoop_stat(get_manifest_path(path))]
+        return [hl.hadoop_stat(f'{path}/metadata.json.gz')]
+    return sorted((f for f in hl.hadoop_ls(path) if not f['is_dir']),
+                  key=lambda f: f['path'])
+
+
+def _file_checksum(path: str,
+                   chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+
+    :param path: File path
+    :param chunk_size: Read chunk size (bytes)
+    :return: Hex digest
+    """
+    h = hashlib.sha256()
+    with hl.hadoop_open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_manifest(inputs: list,
+                   builder: str,
+                   version: int,
+                   params: dict = None,
+                   previous: dict = None,
+                   checksums: bool = False) -> dict:
+    """
+    Build the manifest of a table: size and modification time of every input file, builder
+    name/version and build parameters.
+
+    Inputs are stamped by size and modification time, which needs no read. With `checksums`,
+    files whose size or modification time changed since the previous manifest are also hashed
+    (SHA-256), so that touched but unchanged files do not trigger a rebuild on later runs.
+    Nothing is hashed without a previous manifest (the table is built anyway), and checksums
+    of unchanged files are reused from it.
+
+    :param inputs: List of input paths (files, glob patterns or Hail Tables)
+    :param builder: Builder function name
+    :param version: Builder function version
+    :param params: Build parameters
+    :param previous: Previous manifest of the table, if any (None to skip all hashing)
+    :param checksums: Hash the inputs that changed since the previous manifest
+    :return: Manifest dict
+    """
+    known = {}
+    if previous is not None:
+        known = {(f['path'], f['size'], f['mtime']): f.get('sha256') for f in previous.get('inputs', [])}
+
+    files = []
+    for path in inputs:
+        for stat in _input_files(path):
+            key = (stat['path'], stat['size'], stat['modification_time'])
+            if key in known:
+                sha256 = known[key]
+            elif checksums and previous is not None:
+                sha256 = _file_checksum(stat['path'])
+            else:
+                sha256 = None
+            files.append({'path': stat['path'],
+                          'size': stat['size'],
+                          'mtime': stat['modification_time'],
+                          'sha256': sha256})
+
+    return {'builder': builder,
+            'version': version,
+            'params': params or {},
+            'inputs': files}
+
+
+def get_manifest_path(output_path: str) -> str:
+    return f'{output_path}.manifest.json'
+
+
+def read_manifest(output_path: str) -> dict:
+    """
+    Read the manifest written next to a table, if any.
+
+    :param output_path: Path to Hail Table
+    :return: Manifest dict, or None
+    """
+    manifest_path = get_manifest_path(output_path)
+    if not hl.hadoop_exists(manifest_path):
+        return None
+    with hl.hadoop_open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(output_path: str,
+                   manifest: dict):
+    """
+    Write the manifest next to a table.
+
+    :param output_path: Path to Hail Table
+    :param manifest: Manifest dict (see `build_manifest`)
+    """
+    with hl.hadoop_open(get_manifest_path(output_path), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+
+def _same_input(previous: dict,
+                current: dict) -> bool:
+    # compare by checksum when both have one, otherwise by size and modification time
+    if previous['path'] != current['path']:
+        return False
+    if previous.get('sha256') is not None and current.get('sha256') is not None:
+        return previous['sha256'] == current['sha256']
+    return (previous['size'], previous['mtime']) == (current['size'], current['mtime'])
+
+
+def is_up_to_date(output_path: str,
+                  manifest: dict) -> bool:
+    """
+    Check whether a table exists and was built from the same inputs, builder version and
+    parameters. Inputs are compared by checksum when both manifests have one (so touched but
+    unchanged files do not trigger a rebuild), otherwise by size and modification time.
+
+    :param output_path: Path to Hail Table
+    :param manifest: Manifest of the current inputs (see `build_manifest`)
+    :return: True if the table does not need to be rebuilt
+    """
+    if not hl.hadoop_exists(f'{output_path}/_SUCCESS'):
+        return False
+
+    previous = read_manifest(output_path)
+    if previous is None:
+        return False
+
+    def _signature(m):
+        return m['builder'], m['version'], json.dumps(m['params'], sort_keys=True, default=str)
+
+    manifest = json.loads(json.dumps(manifest, default=str))
+    return (_signature(previous) == _signature(manifest) and
+            len(previous['inputs']) == len(manifest['inputs']) and
+            all(_same_input(p, c) for p, c in zip(previous['inputs'], manifest['inputs'])))
+
+
+def _export_rows(ht: hl.Table,
+                 batch_size: int = 100_000):
+    """
+    Export a (key-less) Hail Table to a temporary TSV file and stream its rows back in batches
+    of lists of strings, in table order.
+    """
+    tmp_path = hl.utils.new_temp_file(extension='tsv')
+    ht.export(tmp_path, header=False)
+
+    batch = []
+    with hl.hadoop_open(tmp_path, 'r') as f:
+        for line in f:
+            batch.append(line.rstrip('\n').split('\t'))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _na(value: str):
+    return None if value == 'NA' else value
+
+
+def export_variant_index(bundle_tb: hl.Table,
+                         ccr_tb: hl.Table,
+                         ppi_tb: hl.Table,
+                         index_path: str) -> dict:
+    """
+    Export the variant-level annotation tables into a local SQLite index for Spark-free lookups
+    (see `hvantk.utils.variant_index.VariantIndex`).
+
+    Variant annotations are stored as one JSON value per (contig, position, ref, alt), with the
+    Clinvar significance already collapsed to the 'P'/'B' label. CCR percentiles and interactome
+    intervals are stored by locus/interval, so that variants outside the bundle still get them.
+
+    :param bundle_tb: Variant bundle Hail Table (see `create_variant_bundle_tb`)
+    :param ccr_tb: CCR Hail Table keyed by `locus`
+    :param ppi_tb: Interactome Hail Table keyed by `interval`
+    :param index_path: Local path to the SQLite file
+    :return: Index metadata
+    """
+    from hvantk.utils.annotate import _clinvar_clnsig_label, get_dbnsfp_score_fields
+    from hvantk.utils.variant_index import create_index, finalize_index
+
+    score_fields = get_dbnsfp_score_fields(bundle_tb)
+    bundle_tb = (bundle_tb
+                 .filter(hl.len(bundle_tb.alleles) == 2)
+                 .key_by()
+                 )
+    bundle_tb = bundle_tb.select(bundle_tb.locus.contig,
+                                 bundle_tb.locus.position,
+                                 ref=bundle_tb.alleles[0],
+                                 alt=bundle_tb.alleles[1],
+                                 value=hl.json(hl.struct(
+                                     clinvar_clnsig=_clinvar_clnsig_label(bundle_tb.clinvar_clnsig),
+                                     gnomad_af_genomes=bundle_tb.gnomad_af_genomes,
+                                     **{f: bundle_tb[f] for f in score_fields})))
+
+    ccr_tb = ccr_tb.key_by()
+    ccr_tb = ccr_tb.select(ccr_tb.locus.contig,
+                           ccr_tb.locus.position,
+                           ccr_pct=hl.float64(ccr_tb.ccr_pct))
+
+    interval = ppi_tb.key[0]
+    ppi_tb = (ppi_tb
+              .key_by()
+              .select(contig=interval.start.contig,
+                      start=interval.start.position,
+                      end=interval.end.position,
+                      includes_start=hl.int(interval.includes_start),
+                      includes_end=hl.int(interval.includes_end))
+              )
+
+    conn = create_index(index_path)
+
+    n_variants = 0
+    for batch in _export_rows(bundle_tb):
+        conn.executemany('INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?)',
+                         [(c, int(p), r, a, v) for c, p, r, a, v in batch])
+        n_variants += len(batch)
+
+    for batch in _export_rows(ccr_tb):
+        conn.executemany('INSERT OR REPLACE INTO ccr VALUES (?, ?, ?)',
+                         [(c, int(p), None if _na(v) is None else float(v)) for c, p, v in batch])
+
+    ppi_max_length = 0
+    for batch in _export_rows(ppi_tb):
+        rows = [(c, int(s), int(e), int(i_s), int(i_e)) for c, s, e, i_s, i_e in batch]
+        ppi_max_length = max([ppi_max_length] + [e - s for _, s, e, _, _ in rows])
+        conn.executemany('INSERT INTO ppi VALUES (?, ?, ?, ?, ?)', rows)
+
+    meta = {'score_fields': score_fields,
+            'ppi_max_length': ppi_max_length,
+            'n_variants': n_variants}
+    finalize_index(conn, meta)
+
+    return meta
+
+
+# Version of the feature cache layout/content (bump when the annotation output changes)
+FEATURE_CACHE_VERSION = 2
+
+# Global field recording the stamp of a feature cache table
+FEATURE_CACHE_GLOBAL = 'hvantk_feature_cache'
+
+# Serializes read-annotate-merge cycles on feature caches within the process
+feature_cache_lock = threading.Lock()
+
+# Number of feature cache generations kept (the current one included), so that runs started
+# on an older generation (e.g. in another process) can still read it
+FEATURE_CACHE_KEEP_GENERATIONS = 3
+
+
+def get_reference_versions(paths: list) -> dict:
+    """
+    Return a version stamp of every reference table: size and modification time of its manifest
+    (rewritten on every mktables build) or, if it has none, of its metadata file.
+
+    :param paths: Paths to Hail Tables
+    :return: Dict path -> version string (None for missing tables)
+    """
+    versions = {}
+    for path in paths:
+        if not hl.hadoop_exists(f'{path}/metadata.json.gz'):
+            versions[path] = None
+            continue
+        stat = _input_files(path)[0]
+        versions[path] = f"{stat['size']}:{stat['modification_time']}"
+    return versions
+
+
+def _rmtree(path: str):
+    try:
+        hl.current_backend().fs.rmtree(path)
+    except Exception:
+        pass
+
+
+def get_feature_cache_current(cache_dir: str) -> str:
+    """
+    Return the name of the current feature cache table, if any.
+
+    :param cache_dir: Feature cache directory
+    :return: Table name (relative to `cache_dir`), or None
+    """
+    current_path = f'{cache_dir}/CURRENT'
+    if not hl.hadoop_exists(current_path):
+        return None
+    with hl.hadoop_open(current_path, 'r') as f:
+        return f.read().strip()
+
+
+def read_feature_cache(cache_dir: str,
+                       stamp: dict) -> hl.Table:
+    """
+    Read the current feature cache table, if it exists and was built with the same stamp
+    (reference table versions and annotation options). Stale caches are ignored.
+
+    :param cache_dir: Feature cache directory
+    :param stamp: Stamp of the current run
+    :return: Hail Table, or None
+    """
+    current = get_feature_cache_current(cache_dir)
+    if current is None:
+        return None
+
+    ht = hl.read_table(f'{cache_dir}/{current}')
+    cached_stamp = hl.eval(ht.globals[FEATURE_CACHE_GLOBAL])
+    if cached_stamp != json.dumps({**stamp, 'version': FEATURE_CACHE_VERSION}, sort_keys=True):
+        return None
+    return ht
+
+
+def _write_pointer(path: str,
+                   value: str):
+    """
+    Replace a small text file atomically: on a local file system, write a temporary file and
+    rename it; object stores replace whole objects atomically.
+    """
+    local_path = path[len('file:'):] if path.startswith('file:') else path
+    if os.path.isdir(os.path.dirname(local_path)):
+        tmp_path = f'{local_path}.{uuid.uuid4().hex}'
+        with open(tmp_path, 'w') as f:
+            f.write(value)
+        os.replace(tmp_path, local_path)
+    else:
+        with hl.hadoop_open(path, 'w') as f:
+            f.write(value)
+
+
+def _feature_cache_generations(cache_dir: str) -> list:
+    """
+    Return the feature cache tables of a cache directory, oldest generation first.
+    """
+    names = [f['path'].rstrip('/').split('/')[-1] for f in hl.hadoop_ls(cache_dir) if f['is_dir']]
+    names = [name for name in names if name.startswith('features.') and name.endswith('.ht')]
+    return sorted(names, key=lambda name: int(name.split('.')[1]))
+
+
+def write_feature_cache(cache_dir: str,
+                        ht: hl.Table,
+                        stamp: dict) -> hl.Table:
+    """
+    Write a new generation of the feature cache and make it current. Every generation is written
+    once, under a unique name, and the `CURRENT` pointer is switched atomically, so concurrent
+    writers (e.g. in other processes) never clobber each other, and the last writer wins.
+    The last `FEATURE_CACHE_KEEP_GENERATIONS` generations are kept, so that runs still reading a
+    previous generation are not broken; older generations are deleted.
+
+    :param cache_dir: Feature cache directory
+    :param ht: Feature cache Hail Table
+    :param stamp: Stamp of the current run
+    :return: Hail Table read back from the cache
+    """
+    current = get_feature_cache_current(cache_dir)
+    generation = int(current.split('.')[1]) + 1 if current is not None else 0
+    name = f'features.{generation}.{uuid.uuid4().hex[:8]}.ht'
+
+    ht = (ht
+          .annotate_globals(**{FEATURE_CACHE_GLOBAL: json.dumps({**stamp, 'version': FEATURE_CACHE_VERSION},
+                                                                sort_keys=True)})
+          .checkpoint(f'{cache_dir}/{name}', overwrite=False)
+          )
+    _write_pointer(f'{cache_dir}/CURRENT', name)
+
+    # garbage-collect old generations (never the current one)
+    current = get_feature_cache_current(cache_dir)
+    old = [g for g in _feature_cache_generations(cache_dir) if g != current]
+    for old_name in old[:max(len(old) - (FEATURE_CACHE_KEEP_GENERATIONS - 1), 0)]:
+        _rmtree(f'{cache_dir}/{old_name}')
+
+    return ht
+
+
+def get_run_fingerprint(inputs: list,
+                        stage_names: list,
+                        reference_paths: list,
+                        params: dict = None) -> str:
+    """
+    Fingerprint an annotation run from its input tables (paths and versions), stage list,
+    reference table versions and parameters.
+
+    :param inputs: Paths to input Hail Tables
+    :param stage_names: Names of the annotation stages, in order
+    :param reference_paths: Paths to the reference tables read by the stages
+    :param params: Other parameters changing the run output
+    :return: Hex fingerprint
+    """
+    fingerprint = {'inputs': get_reference_versions(inputs),
+                   'stages': stage_names,
+                   'references': get_reference_versions(sorted(set(reference_paths))),
+                   'params': params or {}}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def run_stages_resumable(ht: hl.Table,
+                         stages: list,
+                         checkpoint_dir: str,
+                         checkpoint_names: list = None) -> hl.Table:
+    """
+    Run a pipeline of table transformations, checkpointing the output of the selected stages
+    into `checkpoint_dir`. If a previous run with the same checkpoint directory left valid
+    checkpoints, the pipeline resumes after the last one.
+
+    :param ht: Input Hail Table
+    :param stages: List of (name, function Table -> Table, list of reference table paths)
+    :param checkpoint_dir: Checkpoint directory of the run (see `get_run_fingerprint`)
+    :param checkpoint_names: Names of the stages to checkpoint (default: all)
+    :return: Output Hail Table
+    """
+    names = [name for name, _, _ in stages]
+    if checkpoint_names is None:
+        checkpoint_names = names
+    unknown = set(checkpoint_names) - set(names)
+    if unknown:
+        raise ValueError(f'Unknown stages to checkpoint: {", ".join(sorted(unknown))}. '
+                         f'Available stages: {", ".join(names)}')
+
+    paths = {i: f'{checkpoint_dir}/{i:02d}.{name}.ht' for i, name in enumerate(names) if name in checkpoint_names}
+
+    # resume from the last valid checkpoint
+    first = 0
+    for i in sorted(paths, reverse=True):
+        if hl.hadoop_exists(f'{paths[i]}/_SUCCESS'):
+            print(f'Resuming after stage {names[i]} from {paths[i]}')
+            ht = hl.read_table(paths[i])
+            first = i + 1
+            break
+
+    for i in range(first, len(stages)):
+        ht = stages[i][1](ht)
+        if i in paths:
+            ht = ht.checkpoint(paths[i], overwrite=True)
+
+    return ht
+
+
+def remove_run_checkpoints(checkpoint_dir: str):
+    """
+    Delete the checkpoints of a run (after its output was written).
+
+    :param checkpoint_dir: Checkpoint directory of the run
+    """
+    _rmtree(checkpoint_dir)
@@ -4,13 +4,95 @@ The tables are used to annotate variants and genes with different features.
 
 """
 
+import json
+import re
+import threading
+
 import hail as hl
+import numpy as np
 
 from hvantk.settings import RAW_DATA_PATHS
+from hvantk.utils.dataset import DataException
 
 
 raw_resource_paths = RAW_DATA_PATHS
 
+# Version of each table builder, recorded in the table manifests (see `hvantk.utils.io`).
+# Bump it whenever the output of a builder changes, so that mktables rebuilds the table.
+BUILDER_VERSIONS = {
+    'create_gnomad_constraint_gene_metrics_tb': 1,
+    'create_interactome_tb': 1,
+    'create_gene_ensembl_ann_tb': 1,
+    'create_gene_alias_tb': 1,
+    'create_clinvar_tb': 1,
+    'create_gevir_tb': 1,
+    'create_scell_deg_tb': 1,
+    'create_hca_tb': 2,
+    'create_rnaseq_tb': 1,
+    'create_variant_bundle_tb': 2,
+    'create_gene_features_tb': 1,
+    'create_scell_pseudobulk_tb': 2,
+    'create_dbnsfp_tb': 2,
+    'create_dbnsfp_variant_tb': 2,
+    'create_gnomad_af_tb': 1,
+}
+
+
+_schema_registry_lock = threading.Lock()
+
+
+def _read_schema_registry() -> dict:
+    path = raw_resource_paths.get('schemas_path')
+    if not hl.hadoop_exists(path):
+        return {}
+    with hl.hadoop_open(path, 'r') as f:
+        return json.load(f)
+
+
+def _read_header(path: str,
+                 delimiter: str = '\t') -> list:
+    with hl.hadoop_open(path, 'r') as f:
+        return f.readline().rstrip('\r\n').split(delimiter)
+
+
+def import_table_with_schema(source: str,
+                             **kwargs) -> hl.Table:
+    """
+    Import a raw tabular source with explicit column types from the schema registry
+    (`schemas_path` in RAW_DATA_PATHS), avoiding the extra scan of `impute=True`.
+
+    The first import of a source imputes the types and records them in the registry.
+    Later imports fail fast if the column set of the source changed (e.g. a new release);
+    remove the source from the registry to learn the new schema.
+
+    :param source: Raw source key in RAW_DATA_PATHS (e.g. 'gevir_path')
+    :param kwargs: Additional arguments for `hl.import_table`
+    :return: Hail Table
+    """
+    path = raw_resource_paths.get(source)
+    header = _read_header(path, kwargs.get('delimiter', '\t'))
+
+    with _schema_registry_lock:
+        schema = _read_schema_registry().get(source)
+
+    if schema is not None:
+        if list(schema) != header:
+            raise DataException(f"Columns of {path} do not match the registered schema of {source}. "
+                                f"Expected: {list(schema)}; found: {header}")
+        return hl.import_table(paths=path,
+                               types={f: hl.dtype(t) for f, t in schema.items()},
+                               **kwargs)
+
+    ht = hl.import_table(paths=path, impute=True, **kwargs)
+
+    with _schema_registry_lock:
+        registry = _read_schema_registry()
+        registry[source] = {f: str(ht[f].dtype) for f in header}
+        with hl.hadoop_open(raw_resource_paths.get('schemas_path'), 'w') as f:
+            json.dump(registry, f, indent=2)
+
+    return ht
+
 
 def create_gnomad_constraint_gene_metrics_tb() -> hl.Table:
     """
@@ -18,11 +100,9 @@ def create_gnomad_constraint_gene_metrics_tb() -> hl.Table:
 
     :return: Hail Table
     """
-    gnomad_path = raw_resource_paths.get('gnomad_metrics_path')
-    gnomad_tb = hl.import_table(paths=gnomad_path,
-                                impute=True,
-                                min_partitions=100,
-                                key='transcript')
+    gnomad_tb = import_table_with_schema('gnomad_metrics_path',
+                                         min_partitions=100,
+                                         key='transcript')
     gnomad_tb = (gnomad_tb
                  .select(loeuf=gnomad_tb.oe_lof_upper,
                          moeuf=gnomad_tb.oe_mis_upper)
@@ -53,10 +133,8 @@ def create_gene_ensembl_ann_tb() -> hl.Table:
 
     :return: Hail Table
     """
-    gene_ann_path = raw_resource_paths.get('gene_ann_path')
-    gene_tb = (hl.import_table(paths=gene_ann_path,
-                               impute=True,
-                               min_partitions=100)
+    gene_tb = (import_table_with_schema('gene_ann_path',
+                                        min_partitions=100)
                )
     gene_tb = (gene_tb
                .group_by(gene_tb.GeneID,
@@ -69,6 +147,43 @@ def create_gene_ensembl_ann_tb() -> hl.Table:
     return gene_tb
 
 
+def create_gene_alias_tb(gene_tb: hl.Table) -> hl.Table:
+    """
+    Create a Hail Table mapping gene aliases (gene symbols and synonyms) to Ensembl gene and
+    transcript IDs, keyed by `Gene`.
+
+    Ambiguous aliases are resolved deterministically: official gene symbols take precedence
+    over synonyms, then the smallest GeneID/TranscriptID. The `is_ambiguous` field flags
+    aliases matching more than one gene.
+
+    :param gene_tb: Ensembl gene annotation Hail Table (see `create_gene_ensembl_ann_tb`)
+    :return: Hail Table
+    """
+    alias_tb = gene_tb.annotate(
+        aliases=(hl.array([hl.struct(Gene=gene_tb.Gene, is_synonym=False)])
+                 .extend(hl.array(gene_tb.Gene_Synonym)
+                         .map(lambda x: hl.struct(Gene=x, is_synonym=True))))
+    )
+    alias_tb = alias_tb.explode('aliases')
+    alias_tb = alias_tb.filter(hl.is_defined(alias_tb.aliases.Gene))
+
+    alias_tb = (alias_tb
+                .group_by(Gene=alias_tb.aliases.Gene)
+                .aggregate(candidates=hl.agg.collect_as_set(hl.struct(is_synonym=alias_tb.aliases.is_synonym,
+                                                                      GeneID=alias_tb.GeneID,
+                                                                      TranscriptID=alias_tb.TranscriptID)))
+                )
+
+    # struct ordering: official symbols first, then GeneID and TranscriptID
+    best = hl.sorted(hl.array(alias_tb.candidates))[0]
+    alias_tb = alias_tb.select(GeneID=best.GeneID,
+                               TranscriptID=best.TranscriptID,
+                               is_synonym=best.is_synonym,
+                               is_ambiguous=hl.len(alias_tb.candidates.map(lambda x: x.GeneID)) > 1)
+
+    return alias_tb
+
+
 def create_clinvar_tb() -> hl.Table:
     """
     Create a Hail Table with clinvar variants.
@@ -83,25 +198,83 @@ def create_clinvar_tb() -> hl.Table:
                                 contig_recoding=recode,
                                 skip_invalid_loci=True)
                   .rows()
-                  .repartition(100)
                   .key_by('locus', 'alleles')
                   )
 
     return clinvar_tb
 
 
+# Optional gnomad INFO fields kept by `create_gnomad_af_tb` (besides AF)
+GNOMAD_AF_EXTRA_FIELDS = {
+    'AC': ['AC'],
+    'AN': ['AN'],
+    'popmax': ['popmax', 'AF_popmax'],
+}
+
+
+def create_gnomad_af_tb(extra_fields: list = (),
+                        intervals_path: str = None,
+                        pass_only: bool = False) -> hl.Table:
+    """
+    Create a Hail Table with gnomad (v3, genomes) allele frequencies from the per-chromosome
+    sites VCFs, keyed by `locus` and `alleles`.
+
+    The (bgzip-compressed) VCFs are imported in parallel without samples, and only the selected
+    INFO fields are kept, so that the VCF reader skips parsing the others. Multi-allelic sites
+    are split and per-allele fields are resolved to the alternate allele.
+
+    :param extra_fields: Optional fields to keep besides AF (see `GNOMAD_AF_EXTRA_FIELDS`)
+    :param intervals_path: BED file with regions (e.g. coding regions) to restrict the table to, or None
+    :param pass_only: Keep only sites passing all filters
+    :return: Hail Table
+    """
+    gnomad_path = raw_resource_paths.get('gnomad_af_path')
+
+    unknown = set(extra_fields) - set(GNOMAD_AF_EXTRA_FIELDS)
+    if unknown:
+        raise DataException(f"Unknown gnomad fields: {', '.join(sorted(unknown))}. "
+                            f"Available: {', '.join(GNOMAD_AF_EXTRA_FIELDS)}")
+    info_fields = ['AF'] + [f for k in extra_fields for f in GNOMAD_AF_EXTRA_FIELDS[k]]
+
+    ht = (hl.import_vcf(path=gnomad_path,
+                        force_bgz=True,
+                        drop_samples=True,
+                        reference_genome='GRCh38',
+                        skip_invalid_loci=True,
+                        array_elements_required=False)
+          .rows()
+          )
+
+    if intervals_path is not None:
+        intervals = hl.import_bed(intervals_path,
+                                  reference_genome='GRCh38',
+                                  skip_invalid_intervals=True)
+        ht = hl.filter_intervals(ht, intervals.aggregate(hl.agg.collect(intervals.interval)))
+
+    if pass_only:
+        ht = ht.filter(hl.len(ht.filters) == 0)
+
+    ht = ht.select(info=ht.info.select(*info_fields))
+    ht = hl.split_multi(ht)
+
+    def _allele_value(expr):
+        # per-allele (Number=A) fields are arrays over the alternate alleles
+        if isinstance(expr, hl.expr.ArrayExpression):
+            return expr[ht.a_index - 1]
+        return expr
+
+    return ht.select(**{f: _allele_value(ht.info[f]) for f in info_fields})
+
+
 def create_gevir_tb() -> hl.Table:
     """
     Create a Hail Table with gene-level constraint metrics from GeVir.
 
     :return: Hail Table
     """
-    gevir_path = raw_resource_paths.get('gevir_path')
-
-    gevir_tb = (hl.import_table(paths=gevir_path,
-                                impute=True,
-                                min_partitions=100,
-                                key='gene_id')
+    gevir_tb = (import_table_with_schema('gevir_path',
+                                         min_partitions=100,
+                                         key='gene_id')
                 )
 
     return gevir_tb
@@ -113,11 +286,8 @@ def create_scell_deg_tb() -> hl.Table:
 
     :return: Hail Table
     """
-    scell_path = raw_resource_paths.get('scell_heart_path')
-
-    sdeg_tb = (hl.import_table(paths=scell_path,
-                               impute=True,
-                               min_partitions=50)
+    sdeg_tb = (import_table_with_schema('scell_heart_path',
+                                        min_partitions=50)
                )
     sdeg_tb = (sdeg_tb
                .group_by('gene')
@@ -128,66 +298,122 @@ def create_scell_deg_tb() -> hl.Table:
     return sdeg_tb
 
 
-def create_hca_tb() -> hl.Table:
+# Cell categories of the HCA `expScores` field, in order
+HCA_CELL_CATEGORIES = ("adipocyte",
+                       "atrial_cardiomyocyte",
+                       "endothelial",
+                       "fibroblast",
+                       "lymphoid",
+                       "mesothelial",
+                       "myeloid",
+                       "neuronal",
+                       "not_assigned",
+                       "pericyte",
+                       "smooth_muscle_cell",
+                       "ventricular_cardiomyocyte",
+                       "doublet")
+
+
+def create_hca_tb(verbose: bool = False) -> hl.Table:
     """
     Create a Hail Table with gene expression levels from Human Heart Cell Atlas.
+    Mean UMI per cell category is parsed from `expScores` into one float32 field per category
+    (see `HCA_CELL_CATEGORIES`) in a single pass. Genes with fewer scores than categories fail
+    the pass with an error naming the gene.
 
+    :param verbose: Show and describe the resulting table (triggers an extra Spark job)
     :return: Hail Table
     """
 
-    hca_path = raw_resource_paths.get('scell_hca_path')
-
-    hca_tb = hl.import_table(paths=hca_path,
-                             min_partitions=100,
-                             impute=True)
-
-    cell_categories_rank = ["adipocyte",
-                            "atrial_cardiomyocyte",
-                            "endothelial",
-                            "fibroblast",
-                            "lymphoid",
-                            "mesothelial",
-                            "myeloid",
-                            "neuronal",
-                            "not_assigned",
-                            "pericyte",
-                            "smooth_muscle_cell",
-                            "ventricular_cardiomyocyte",
-                            "doublet"]
-
-    hca_tb = (hca_tb
-              .transmute(gene_name=hca_tb.name,
-                         gene_id=hca_tb.name2.split("[.]")[0],
-                         gene_id_version=hca_tb.name2.split("[.]")[1],
-                         expScores=hca_tb.expScores.split("[,]").map(lambda x: hl.float(x))
-                         )
-              .select('gene_id', 'expScores')
-              )
-
-    hca_tb = hca_tb.transmute(mean_umi=hl.dict(hl.zip(cell_categories_rank, hca_tb.expScores)))
+    hca_tb = import_table_with_schema('scell_hca_path',
+                                      min_partitions=100)
 
-    ks = hca_tb.mean_umi.key_set().collect()[0]
+    exp_scores = hca_tb.expScores.split("[,]")
+    hca_tb = hca_tb.annotate(
+        _scores=(hl.case()
+                 .when(hl.len(exp_scores) >= len(HCA_CELL_CATEGORIES), exp_scores)
+                 .or_error(hl.format(f"HCA gene %s has fewer than {len(HCA_CELL_CATEGORIES)} expScores values",
+                                     hca_tb.name2)))
+    )
     hca_tb = (hca_tb
-              .transmute(**{k: hca_tb.mean_umi.get(k)
-                            for k in ks})
+              .select(gene_id=hca_tb.name2.split("[.]")[0],
+                      **{c: hl.float32(hca_tb._scores[i])
+                         for i, c in enumerate(HCA_CELL_CATEGORIES)})
               .key_by('gene_id')
               )
 
-    hca_tb.show()
-    hca_tb.describe()
+    if verbose:
+        hca_tb.show()
+        hca_tb.describe()
 
     return hca_tb
 
 
-def create_rnaseq_tb() -> hl.Table:
+# Developmental stages of the RNA-seq time points (weeks post-conception).
+# Any other time point is postnatal.
+RNASEQ_DEV_STAGES = {'development': [f'{t}wpc' for t in range(1, 9)],
+                     'maturation': [f'{t}wpc' for t in range(9, 25)]}
+
+
+def _rnaseq_time_points(expr_fields: list) -> dict:
+    """
+    Get the available time points per organ from sample names (organ.time_point.index).
+    """
+    time_points = {}
+    for f in expr_fields:
+        organ, time_point = f.split('.')[:2]
+        time_points.setdefault(organ, set()).add(time_point)
+    return {organ: sorted(tps) for organ, tps in time_points.items()}
+
+
+def _rnaseq_dev_stage(time_point: str) -> str:
+    for stage, tps in RNASEQ_DEV_STAGES.items():
+        if time_point in tps:
+            return stage
+    return 'postnatal'
+
+
+def _annotate_rnaseq_layout(rnaseq_tb: hl.Table,
+                            time_points: dict) -> hl.Table:
+    """
+    Add the organ-indexed layout to the RNA-seq table: expression per time point as an array
+    aligned with the `time_points` global, so that readers need no Spark action to get the schema.
+    """
+    rnaseq_tb = rnaseq_tb.annotate(
+        expr_time_point=hl.dict({
+            organ: hl.array([rnaseq_tb.mean_expr_time_point.get(hl.struct(organ=organ, time_point=tp))
+                             for tp in tps])
+            for organ, tps in time_points.items()
+        })
+    )
+    rnaseq_tb = rnaseq_tb.annotate_globals(
+        time_points=hl.literal(time_points, dtype=hl.tdict(hl.tstr, hl.tarray(hl.tstr)))
+    )
+    return rnaseq_tb
+
+
+def create_rnaseq_tb(engine: str = 'hail',
+                     block_size: int = 10000) -> hl.Table:
     """
     Create a Hail Table with gene expression levels from human RNA-seq data (ArrayExpression accession: E-MTAB-6814)
 
+    Two engines compute the mean expression per organ/time point and organ/developmental stage:
+    'hail' pivots the table into a MatrixTable and aggregates per row; 'numpy' streams the
+    gene x sample matrix on the driver in blocks of `block_size` genes and computes the means
+    as grouped matrix reductions. Both produce the same table.
+
+    :param engine: 'hail' or 'numpy'
+    :param block_size: Number of genes per block (numpy engine)
     :return: Hail Table
     """
 
     rna_table = raw_resource_paths.get('rnaseq_path')
 
+    if engine == 'numpy':
+        return _create_rnaseq_tb_numpy(rna_table, block_size)
+    if engine != 'hail':
+        raise ValueError(f"Unknown RNA-seq engine: {engine}")
+
     tb = hl.import_table(paths=rna_table,
                          min_partitions=100,
                          delimiter='\\s',
@@ -196,6 +422,9 @@ def create_rnaseq_tb() -> hl.Table:
     # getting all expression level (per sample) fields
     expr_fields = [f for f in tb.row if f != 'Gene']
 
+    # available time points per organ
+    time_points = _rnaseq_time_points(expr_fields)
+
     # parse expression value
     tb = tb.annotate(
         **{f: hl.parse_float(tb[f]) for f in expr_fields}
@@ -214,8 +443,8 @@ def create_rnaseq_tb() -> hl.Table:
                                   organismus='Human')
 
     # annotate developmental stages info grouping by time points
-    dev = [f'{t}wpc' for t in range(1, 9)]
-    mat = [f'{t}wpc' for t in range(9, 25)]
+    dev = RNASEQ_DEV_STAGES['development']
+    mat = RNASEQ_DEV_STAGES['maturation']
 
     dev_stage_ann_expr = {'dev_stage':
                               hl.case()
@@ -236,4 +465,454 @@ def create_rnaseq_tb() -> hl.Table:
 
             )
 
-    return mt_t.rows()
+    return _annotate_rnaseq_layout(mt_t.rows(), time_points)
+
+
+def _read_rnaseq_blocks(path: str,
+                        block_size: int):
+    """
+    Stream the RNA-seq CPM file as (header, genes, values) blocks of at most `block_size` rows.
+    Non-numeric values (e.g. NA) are parsed as NaN.
+    """
+    with hl.hadoop_open(path, 'r') as f:
+        header = [x.strip('"') for x in f.readline().split()]
+        if 'Gene' not in header or len(header) < 2:
+            raise DataException(f"RNA-seq file without a Gene column and sample columns: {path}")
+        gene_idx = header.index('Gene')
+        value_idx = [i for i in range(len(header)) if i != gene_idx]
+
+        def _to_float(x):
+            try:
+                return float(x)
+            except ValueError:
+                return np.nan
+
+        def _parse(rows):
+            values = [[row[i].strip('"') for i in value_idx] for row in rows]
+            try:
+                values = np.array(values, dtype=np.float64)
+            except ValueError:
+                # block with non-numeric values (e.g. NA)
+                values = np.array([[_to_float(x) for x in row] for row in values])
+            return [row[gene_idx].strip('"') for row in rows], values
+
+        rows = []
+        for line in f:
+            if line.strip():
+                rows.append(line.split())
+            if len(rows) == block_size:
+                yield header, *_parse(rows)
+                rows = []
+        if rows:
+            yield header, *_parse(rows)
+
+
+def _create_rnaseq_tb_numpy(rna_table: str,
+                            block_size: int) -> hl.Table:
+
+    genes = []
+    tp_means = []
+    stage_means = []
+    for header, block_genes, values in _read_rnaseq_blocks(rna_table, block_size):
+        if not genes:
+            expr_fields = [f for f in header if f != 'Gene']
+            time_points = _rnaseq_time_points(expr_fields)
+            samples = [f.split('.') for f in expr_fields]
+
+            # sample x group indicator matrices
+            tp_groups = sorted({(s[0], s[1]) for s in samples})
+            stage_groups = sorted({(s[0], _rnaseq_dev_stage(s[1])) for s in samples})
+            tp_indicator = np.array([[(s[0], s[1]) == g for g in tp_groups] for s in samples], dtype=np.float64)
+            stage_indicator = np.array([[(s[0], _rnaseq_dev_stage(s[1])) == g for g in stage_groups]
+                                        for s in samples], dtype=np.float64)
+
+        # grouped means ignoring missing values, as hl.agg.mean (NaN if all values are missing)
+        defined = ~np.isnan(values)
+        filled = np.where(defined, values, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tp_means.append((filled @ tp_indicator) / (defined @ tp_indicator))
+            stage_means.append((filled @ stage_indicator) / (defined @ stage_indicator))
+        genes.extend(block_genes)
+
+    if not genes:
+        raise DataException(f"RNA-seq file without genes: {rna_table}")
+
+    tp_means = np.concatenate(tp_means)
+    stage_means = np.concatenate(stage_means)
+
+    columns = {**{f'tp{i}': tp_means[:, i] for i in range(len(tp_groups))},
+               **{f'ds{i}': stage_means[:, i] for i in range(len(stage_groups))}}
+    tb = _table_from_columns('Gene', genes, columns, dtype=hl.tfloat64, nan_as_missing=False)
+
+    tb = tb.select(
+        mean_expr_time_point=hl.dict([(hl.struct(organ=organ, time_point=tp), tb[f'tp{i}'])
+                                      for i, (organ, tp) in enumerate(tp_groups)]),
+        mean_expr_dev_stage=hl.dict([(hl.struct(organ=organ, dev_stage=stage), tb[f'ds{i}'])
+                                     for i, (organ, stage) in enumerate(stage_groups)])
+    )
+
+    return _annotate_rnaseq_layout(tb, time_points)
+
+
+# dbNSFP score columns kept by `create_dbnsfp_tb`, with the dbNSFP ID column their ';'-separated
+# values are aligned with (None for scores with a single value per variant)
+DBNSFP_SCORE_FIELDS = {'SIFT_score': 'Ensembl_proteinid',
+                       'Polyphen2_HDIV_score': 'Uniprot_acc_Polyphen2',
+                       'Polyphen2_HVAR_score': 'Uniprot_acc_Polyphen2',
+                       'MutationTaster_score': 'MutationTaster_AAE',
+                       'FATHMM_score': 'Ensembl_proteinid',
+                       'PROVEAN_score': 'Ensembl_proteinid',
+                       'VEST4_score': 'Ensembl_transcriptid',
+                       'REVEL_score': 'Ensembl_transcriptid',
+                       'MPC_score': 'Ensembl_transcriptid',
+                       'CADD_phred': None}
+
+# dbNSFP ID columns with one entry per Ensembl transcript (`Ensembl_proteinid` is aligned with
+# `Ensembl_transcriptid`)
+DBNSFP_TRANSCRIPT_COLUMNS = ('Ensembl_transcriptid', 'Ensembl_proteinid')
+
+
+def create_dbnsfp_tb(score_fields: dict = DBNSFP_SCORE_FIELDS,
+                     min_partitions: int = None) -> hl.Table:
+    """
+    Create a transcript-resolved Hail Table with dbNSFP deleterious scores, keyed by `locus`,
+    `alleles` and `transcript` (Ensembl transcript ID), with one float32 field per score.
+
+    The (bgzip-compressed, per-chromosome) dbNSFP chunks are imported in parallel and only the
+    configured columns are parsed. Each score is resolved against the ID column its values are
+    aligned with:
+
+    - transcript columns (see `DBNSFP_TRANSCRIPT_COLUMNS`): one value per transcript, missing if
+      the number of values does not match the number of IDs;
+    - other ID columns (e.g. UniProt isoforms for Polyphen2): the maximum value, shared by all
+      transcripts of the variant;
+    - no ID column: the single value, shared by all transcripts of the variant.
+
+    Variants without Ensembl transcript keep one row with a missing `transcript`, so that their
+    variant-level scores (e.g. CADD) are not lost. The names of the per-transcript scores are
+    stored in the `transcript_score_fields` global field.
+
+    :param score_fields: dbNSFP score columns to keep, with the ID column they are aligned with
+    :param min_partitions: Minimum number of partitions of the imported files
+    :return: Hail Table
+    """
+    dbnsfp_path = raw_resource_paths.get('dbnsfp_path')
+
+    transcript_scores = [f for f, col in score_fields.items() if col in DBNSFP_TRANSCRIPT_COLUMNS]
+    id_columns = sorted({col for col in score_fields.values() if col is not None})
+
+    ht = hl.import_table(paths=dbnsfp_path,
+                         missing='.',
+                         force_bgz=True,
+                         min_partitions=min_partitions)
+
+    ht = ht.select(locus=hl.locus('chr' + ht['#chr'],
+                                  hl.int(ht['pos(1-based)']),
+                                  reference_genome='GRCh38'),
+                   alleles=[ht.ref, ht.alt],
+                   transcripts=hl.or_else(ht.Ensembl_transcriptid.split(';'), hl.empty_array(hl.tstr)),
+                   _ids=hl.struct(**{col: hl.or_else(ht[col].split(';'), hl.empty_array(hl.tstr))
+                                     for col in id_columns}),
+                   **{f: ht[f].split(';') for f in score_fields})
+
+    # one row per transcript (a single row for variants without transcript)
+    ht = ht.annotate(_idx=hl.range(hl.max(hl.len(ht.transcripts), 1)))
+    ht = ht.explode('_idx')
+
+    def _score(f):
+        values = ht[f]
+        col = score_fields[f]
+        if col is None:
+            return hl.or_missing(hl.len(values) == 1, hl.parse_float32(values[0]))
+        if col in DBNSFP_TRANSCRIPT_COLUMNS:
+            return hl.or_missing((hl.len(values) == hl.len(ht._ids[col])) &
+                                 (hl.len(values) == hl.len(ht.transcripts)) &
+                                 (ht._idx < hl.len(values)),
+                                 hl.parse_float32(values[ht._idx]))
+        return hl.max(values.map(lambda x: hl.parse_float32(x)))
+
+    ht = ht.select('locus',
+                   'alleles',
+                   transcript=hl.or_missing(ht._idx < hl.len(ht.transcripts), ht.transcripts[ht._idx]),
+                   **{f: _score(f) for f in score_fields})
+
+    return (ht
+            .key_by('locus', 'alleles', 'transcript')
+            .distinct()
+            .annotate_globals(transcript_score_fields=hl.literal(transcript_scores, dtype=hl.tarray(hl.tstr)))
+            )
+
+
+def create_dbnsfp_variant_tb(dbnsfp_tb: hl.Table) -> hl.Table:
+    """
+    Create a variant-keyed dbNSFP Hail Table from the transcript-resolved table (see
+    `create_dbnsfp_tb`), with one transcript -> score dict per per-transcript score and one
+    value per variant-level score. This is the layout read by `create_variant_bundle_tb`.
+
+    :param dbnsfp_tb: Transcript-resolved dbNSFP Hail Table
+    :return: Hail Table keyed by `locus` and `alleles`
+    """
+    scores_fields = [f for f in dbnsfp_tb.row if f.endswith('_score') or f == 'CADD_phred']
+    transcript_scores = hl.eval(dbnsfp_tb.transcript_score_fields)
+
+    def _agg(f):
+        if f in transcript_scores:
+            return hl.dict(hl.agg.filter(hl.is_defined(dbnsfp_tb.transcript) & hl.is_defined(dbnsfp_tb[f]),
+                                         hl.agg.collect((dbnsfp_tb.transcript, hl.float64(dbnsfp_tb[f])))))
+        # same value on every row of the variant
+        return hl.agg.max(hl.float64(dbnsfp_tb[f]))
+
+    return (dbnsfp_tb
+            .group_by('locus', 'alleles')
+            .aggregate(**{f: _agg(f) for f in scores_fields})
+            )
+
+
+def create_variant_bundle_tb(clinvar_tb: hl.Table,
+                             gnomad_af_tb: hl.Table,
+                             dbnsfp_tb: hl.Table) -> hl.Table:
+    """
+    Create a Hail Table bundling the allele-level annotation tables (Clinvar, gnomad AF and
+    dbNSFP) into one projected table keyed by `locus` and `alleles`.
+
+    The key set is the union of the Clinvar, gnomad and dbNSFP variants. Locus-level sources
+    (CCR and interactome) are not bundled: they are looked up by locus at annotation time
+    (see `annotate_variant_bundle`), so that variants outside the bundle still get them.
+
+    :param clinvar_tb: Clinvar Hail Table keyed by `locus` and `alleles`
+    :param gnomad_af_tb: gnomad allele frequency Hail Table keyed by `locus` and `alleles`
+    :param dbnsfp_tb: dbNSFP Hail Table keyed by `locus` and `alleles`
+    :return: Hail Table
+    """
+
+    scores_fields = [f for f in dbnsfp_tb.row if f.endswith('_score') or f == 'CADD_phred']
+
+    clinvar_tb = clinvar_tb.select(clinvar_clnsig=clinvar_tb.info.CLNSIG)
+    gnomad_af_tb = gnomad_af_tb.select(gnomad_af_genomes=gnomad_af_tb.AF)
+    dbnsfp_tb = dbnsfp_tb.select(*scores_fields)
+
+    bundle_tb = (clinvar_tb.select()
+                 .union(gnomad_af_tb.select(),
+                        dbnsfp_tb.select())
+                 .distinct()
+                 )
+
+    bundle_tb = bundle_tb.annotate(**clinvar_tb[bundle_tb.key],
+                                   **gnomad_af_tb[bundle_tb.key],
+                                   **dbnsfp_tb[bundle_tb.key])
+
+    return bundle_tb
+
+
+def create_gene_features_tb(gene_ensembl_tb: hl.Table,
+                            gevir_tb: hl.Table,
+                            rnaseq_tb: hl.Table,
+                            gnomad_metrics_tb: hl.Table,
+                            hca_tb: hl.Table,
+                            deg_tb: hl.Table) -> hl.Table:
+    """
+    Create a consolidated Hail Table with all gene-level features (Ensembl gene names, GeVIR,
+    temporal RNA-seq expression, HCA expression and cardiac DEGs), keyed by `GeneID`.
+    Transcript-level gnomad constraint metrics are nested in the `transcripts` dict
+    (TranscriptID -> struct).
+
+    The available RNA-seq time points per organ are stored in the global field
+    `rnaseq_time_points` (organ -> array of time points).
+
+    :param gene_ensembl_tb: Ensembl gene annotation Hail Table keyed by `GeneID`
+    :param gevir_tb: GeVIR Hail Table keyed by `gene_id`
+    :param rnaseq_tb: Temporal RNA-seq Hail Table keyed by `Gene` (Ensembl gene ID)
+    :param gnomad_metrics_tb: gnomad constraint metrics Hail Table keyed by `transcript`
+    :param hca_tb: HCA expression Hail Table keyed by `gene_id`
+    :param deg_tb: Cardiac DEGs Hail Table keyed by `gene` (gene symbol)
+    :return: Hail Table
+    """
+
+    gene_tb = (gene_ensembl_tb
+               .annotate(**gnomad_metrics_tb[gene_ensembl_tb.TranscriptID])
+               )
+    gene_tb = (gene_tb
+               .group_by('GeneID')
+               .aggregate(gene_symbol=hl.agg.take(gene_tb.Gene, 1)[0],
+                          gene_synonyms=hl.agg.explode(lambda x: hl.agg.collect_as_set(x),
+                                                       gene_tb.Gene_Synonym),
+                          transcripts=hl.dict(hl.agg.collect((gene_tb.TranscriptID,
+                                                              hl.struct(loeuf=gene_tb.loeuf,
+                                                                        moeuf=gene_tb.moeuf)))))
+               )
+
+    gene_tb = gene_tb.annotate(
+        gevir=gevir_tb.select('gevir_pct', 'virlof_pct')[gene_tb.GeneID],
+        mean_expr_time_point=rnaseq_tb[gene_tb.GeneID].mean_expr_time_point,
+        hca=hl.struct(**hca_tb[gene_tb.GeneID]),
+        sc_cluster_id=deg_tb[gene_tb.gene_symbol].cluster_id
+    )
+
+    # available time points per organ
+    gene_tb = gene_tb.annotate_globals(rnaseq_time_points=rnaseq_tb.index_globals().time_points)
+
+    return gene_tb
+
+
+def _table_from_columns(key: str,
+                        keys: list,
+                        columns: dict,
+                        dtype: hl.HailType = hl.tfloat32,
+                        nan_as_missing: bool = True) -> hl.Table:
+    """
+    Create a keyed Hail Table from NumPy columns (computed on the driver), through a temporary
+    TSV file.
+
+    :param key: Key field name
+    :param keys: Key values (one per row)
+    :param columns: Dict field name -> NumPy array (one value per row)
+    :param dtype: Hail type of the value fields
+    :param nan_as_missing: Import NaN values as missing (otherwise as NaN)
+    :return: Hail Table
+    """
+    tmp_path = hl.utils.new_temp_file(extension='tsv')
+    names = list(columns)
+    values = np.column_stack([columns[f] for f in names]) if names else np.empty((len(keys), 0))
+
+    nan = 'NA' if nan_as_missing else 'NaN'
+    with hl.hadoop_open(tmp_path, 'w') as f:
+        f.write('\t'.join([key] + names) + '\n')
+        for k, row in zip(keys, values):
+            f.write('\t'.join([k] + [nan if np.isnan(v) else repr(float(v)) for v in row]) + '\n')
+
+    return hl.import_table(tmp_path,
+                           types={f: dtype for f in names},
+                           key=key)
+
+
+def _h5_strings(values) -> np.ndarray:
+    return np.array([v.decode() if isinstance(v, bytes) else str(v) for v in values])
+
+
+def _h5ad_column(group, name: str) -> np.ndarray:
+    """
+    Read a (possibly categorical) column of an AnnData `obs`/`var` group.
+    """
+    if name is None:
+        name = group.attrs.get('_index', '_index')
+        name = name.decode() if isinstance(name, bytes) else name
+    column = group[name]
+    if hasattr(column, 'keys'):
+        # categorical column (anndata >= 0.8): codes + categories
+        return _h5_strings(column['categories'][:])[column['codes'][:]]
+    if 'categories' in column.attrs:
+        # categorical column (anndata < 0.8): codes + reference to categories
+        return _h5_strings(group.file[column.attrs['categories']][:])[column[:]]
+    return _h5_strings(column[:])
+
+
+def create_scell_pseudobulk_tb(matrix_path: str,
+                               cell_type_attr: str = 'CellType',
+                               gene_id_attr: str = None,
+                               chunk_size: int = 1000) -> hl.Table:
+    """
+    Create a Hail Table with pseudo-bulk gene expression per cell type from a single-cell
+    loom or h5ad file: mean expression and detection rate (fraction of cells with non-zero
+    counts) per cell type.
+
+    The cell x gene matrix is streamed from disk in chunks of `chunk_size` cells and reduced
+    with vectorized NumPy operations, so the full matrix is never loaded into memory. The
+    output is keyed by `gene_id` with one float32 field per cell type (the layout used by
+    `annotate_hca`) and `<cell_type>_detection_rate` fields. Cell type names are lowercased,
+    with non-alphanumeric characters replaced by underscores; labels that collide after this
+    normalization raise a `DataException`.
+
+    Ensembl gene ID versions are stripped. Genes sharing an ID after that (e.g. PAR_Y copies)
+    are merged: their counts are summed (mean expression of the merged gene) and their
+    detection rate is the highest one of the copies.
+
+    Requires `h5py`.
+
+    :param matrix_path: Path to a .loom or .h5ad file (local file system)
+    :param cell_type_attr: Cell attribute with cell type labels (loom `col_attrs` / h5ad `obs`)
+    :param gene_id_attr: Gene attribute with gene IDs (loom `row_attrs` / h5ad `var`). Defaults
+        to `Accession` for loom and to the `var` index for h5ad.
+    :param chunk_size: Number of cells read per chunk
+    :return: Hail Table
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading loom/h5ad files requires h5py (pip install h5py).")
+
+    is_loom = matrix_path.endswith('.loom')
+
+    with h5py.File(matrix_path, 'r') as h5:
+        if is_loom:
+            gene_ids = _h5_strings(h5['row_attrs'][gene_id_attr or 'Accession'][:])
+            cell_types = _h5_strings(h5['col_attrs'][cell_type_attr][:])
+            matrix = h5['matrix']  # genes x cells
+        else:
+            gene_ids = _h5ad_column(h5['var'], gene_id_attr)
+            cell_types = _h5ad_column(h5['obs'], cell_type_attr)
+            matrix = h5['X']  # cells x genes
+            if hasattr(matrix, 'keys'):
+                encoding = matrix.attrs.get('encoding-type', b'csr_matrix')
+                encoding = encoding.decode() if isinstance(encoding, bytes) else encoding
+                if encoding != 'csr_matrix':
+                    raise DataException(f"Unsupported sparse encoding for chunked reading: {encoding}")
+
+        categories, codes = np.unique(cell_types, return_inverse=True)
+        n_types, n_genes, n_cells = len(categories), len(gene_ids), len(cell_types)
+
+        sums = np.zeros((n_types, n_genes))
+        detected = np.zeros((n_types, n_genes))
+
+        for start in range(0, n_cells, chunk_size):
+            end = min(start + chunk_size, n_cells)
+            chunk_codes = codes[start:end]
+
+            if hasattr(matrix, 'keys'):
+                # CSR: accumulate non-zero values with a single bincount per chunk
+                indptr = matrix['indptr'][start:end + 1]
+                data = matrix['data'][indptr[0]:indptr[-1]]
+                indices = matrix['indices'][indptr[0]:indptr[-1]]
+                flat = np.repeat(chunk_codes, np.diff(indptr)) * n_genes + indices
+                sums += np.bincount(flat, weights=data, minlength=n_types * n_genes).reshape(n_types, n_genes)
+                detected += np.bincount(flat, weights=data > 0, minlength=n_types * n_genes).reshape(n_types, n_genes)
+            else:
+                # dense: grouped sums as a product with the cell type indicator matrix
+                indicator = np.zeros((n_types, end - start))
+                indicator[chunk_codes, np.arange(end - start)] = 1
+                x = matrix[:, start:end].T if is_loom else matrix[start:end, :]
+                sums += indicator @ x
+                detected += indicator @ (x > 0)
+
+    names = [re.sub('[^0-9a-z]+', '_', c.lower()).strip('_') for c in categories]
+    fields = names + [f'{n}_detection_rate' for n in names]
+    if '' in names or len(set(fields)) != len(fields):
+        collisions = {}
+        for c, n in zip(categories, names):
+            collisions.setdefault(n, []).append(c)
+        collisions = {n: labels for n, labels in collisions.items()
+                      if len(labels) > 1 or n == '' or f'{n}_detection_rate' in names}
+        raise DataException(f"Cell type labels collide after name normalization: "
+                            f"{', '.join(f'{n!r} <- {labels}' for n, labels in collisions.items())}")
+
+    # strip Ensembl ID versions, as for the HCA table, and merge genes with the same ID
+    gene_ids = np.array([g.split('.')[0] if g.startswith('ENS') else g for g in gene_ids])
+    gene_ids, gene_codes = np.unique(gene_ids, return_inverse=True)
+    if len(gene_ids) < n_genes:
+        merged_sums = np.zeros((n_types, len(gene_ids)))
+        np.add.at(merged_sums, (slice(None), gene_codes), sums)
+        merged_detected = np.zeros((n_types, len(gene_ids)))
+        np.maximum.at(merged_detected, (slice(None), gene_codes), detected)
+        sums, detected = merged_sums, merged_detected
+
+    n_cells_per_type = np.bincount(codes, minlength=n_types)[:, None]
+    means = sums / n_cells_per_type
+    detection_rates = detected / n_cells_per_type
+
+    columns = {**{n: means[i] for i, n in enumerate(names)},
+               **{f'{n}_detection_rate': detection_rates[i] for i, n in enumerate(names)}}
+
+    tb = _table_from_columns('gene_id', list(gene_ids), columns)
+    tb = tb.annotate_globals(n_cells=hl.literal({n: int(n_cells_per_type[i, 0]) for i, n in enumerate(names)},
+                                                dtype=hl.tdict(hl.tstr, hl.tint64)))
+
+    return tb
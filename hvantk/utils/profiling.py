@@ -0,0 +1,235 @@
+"""
+Helpers to measure the work done by Hail: wall time, Spark jobs/stages and their I/O metrics
+(from the Spark monitoring REST API) and peak memory growth.
+
+`run_stages` runs a pipeline of table transformations one stage at a time, checkpointing
+each stage so that its cost is measured in isolation, and `write_report` writes the
+resulting run report as JSON and HTML.
+
+"""
+
+import contextlib
+import html
+import json
+import resource
+import time
+import urllib.request
+
+import hail as hl
+
+
+def _spark_api(endpoint: str):
+    sc = hl.spark_context()
+    url = f'{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{endpoint}'
+    with urllib.request.urlopen(url, timeout=10) as r:
+        return json.load(r)
+
+
+def _peak_jvm_heap_bytes(executors: list) -> int:
+    return max((e.get('peakMemoryMetrics', {}).get('JVMHeapMemory', 0) for e in executors), default=0)
+
+
+def spark_snapshot() -> dict:
+    """
+    Return the IDs of the Spark jobs and stages run so far and the peak JVM heap so far, or
+    None if the Spark UI (monitoring REST API) is not available.
+
+    :return: Dict with `jobs` and `stages` ID sets and `peak_jvm_heap_bytes`
+    """
+    try:
+        return {'jobs': {j['jobId'] for j in _spark_api('jobs')},
+                'stages': {(s['stageId'], s['attemptId']) for s in _spark_api('stages')},
+                'peak_jvm_heap_bytes': _peak_jvm_heap_bytes(_spark_api('executors'))}
+    except Exception:
+        return None
+
+
+def spark_metrics_since(snapshot: dict) -> dict:
+    """
+    Return the number of Spark jobs and stages run since `snapshot` (see `spark_snapshot`),
+    with their aggregated input and shuffle bytes, and the growth of the peak JVM heap (0 if
+    the peak reached before `snapshot` was not exceeded).
+
+    :param snapshot: Previous snapshot, or None
+    :return: Dict of metrics (empty if the Spark UI is not available)
+    """
+    if snapshot is None:
+        return {}
+    try:
+        jobs = [j for j in _spark_api('jobs') if j['jobId'] not in snapshot['jobs']]
+        stages = [s for s in _spark_api('stages?status=complete')
+                  if (s['stageId'], s['attemptId']) not in snapshot['stages']]
+        peak_jvm_heap = _peak_jvm_heap_bytes(_spark_api('executors'))
+    except Exception:
+        return {}
+
+    return {
+        'spark_jobs': len(jobs),
+        'spark_stages': len(stages),
+        'input_bytes': sum(s.get('inputBytes', 0) for s in stages),
+        'shuffle_read_bytes': sum(s.get('shuffleReadBytes', 0) for s in stages),
+        'shuffle_write_bytes': sum(s.get('shuffleWriteBytes', 0) for s in stages),
+        'peak_jvm_heap_growth_bytes': max(peak_jvm_heap - snapshot['peak_jvm_heap_bytes'], 0),
+    }
+
+
+def peak_memory_mb() -> float:
+    """
+    Return the peak resident memory (MB) of the Python driver process.
+
+    :return: Peak RSS in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def measure():
+    """
+    Context manager measuring the wall time, Spark jobs/stages, I/O and peak memory growth of
+    the enclosed block. Note that Hail is lazy: only actions (e.g. write, count, collect) run
+    in the block are measured.
+
+    Peak memory is only tracked per process, so the block reports how much it raised the
+    process peak (`peak_rss_growth_mb`, `peak_jvm_heap_growth_bytes`): a block that stays below
+    the peak of an earlier block reports 0.
+
+    Example:
+        with measure() as metrics:
+            ht.write(path)
+        print(metrics['wall_time_s'])
+
+    :return: Dict, filled with the metrics when the block exits
+    """
+    metrics = {}
+    snapshot = spark_snapshot()
+    peak_rss = peak_memory_mb()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics['wall_time_s'] = time.perf_counter() - start
+        metrics.update(spark_metrics_since(snapshot))
+        metrics['peak_rss_growth_mb'] = peak_memory_mb() - peak_rss
+
+
+def table_size_bytes(path: str) -> int:
+    """
+    Return the on-disk size of the row data of a Hail Table.
+
+    :param path: Path to Hail Table
+    :return: Size in bytes
+    """
+    return sum(f['size'] for f in hl.hadoop_ls(f'{path}/rows/parts') if not f['is_dir'])
+
+
+def _reference_table_stats(path: str) -> dict:
+    try:
+        parts = [f for f in hl.hadoop_ls(f'{path}/rows/parts') if not f['is_dir']]
+    except Exception:
+        return {'path': path}
+    return {'path': path,
+            'n_partitions': len(parts),
+            'on_disk_bytes': sum(f['size'] for f in parts)}
+
+
+def run_stages(ht: hl.Table,
+               stages: list,
+               explain: bool = False) -> tuple:
+    """
+    Run a pipeline of table transformations stage by stage. The output of every stage is
+    checkpointed to a temporary table, so that the wall time, Spark jobs/stages and bytes read
+    of each stage are measured in isolation (see `measure`), and counted.
+
+    Checkpointing every stage changes the execution plan of the pipeline (no fusion across
+    stages), so this is meant for profiling runs, not production runs.
+
+    Spark only reports input bytes per stage, not per file, so the bytes read from the
+    reference tables of a stage are an estimate (`reference_bytes_read_est`): the stage input
+    bytes minus the size of the previous checkpoint. Reference tables are listed with their
+    full on-disk size (`on_disk_bytes`), which overstates what is read when intervals are
+    pushed down.
+
+    :param ht: Input Hail Table
+    :param stages: List of (name, function Table -> Table, list of reference table paths)
+    :param explain: Include the Hail table IR of every stage in the report
+    :return: Output Hail Table and list of stage reports
+    """
+    input_path = hl.utils.new_temp_file(extension='ht')
+    ht = ht.checkpoint(input_path)
+    n_rows = ht.count()
+    input_bytes = table_size_bytes(input_path)
+
+    reports = []
+    for name, fn, reference_paths in stages:
+        stage_ht = fn(ht)
+        report = {'stage': name,
+                  'input_rows': n_rows,
+                  'reference_tables': [_reference_table_stats(p) for p in reference_paths]}
+        if explain:
+            report['explain'] = str(stage_ht._tir)
+
+        output_path = hl.utils.new_temp_file(extension='ht')
+        with measure() as metrics:
+            ht = stage_ht.checkpoint(output_path)
+        n_rows = ht.count()
+
+        report.update(metrics)
+        report['output_rows'] = n_rows
+        if 'input_bytes' in metrics and reference_paths:
+            report['reference_bytes_read_est'] = max(metrics['input_bytes'] - input_bytes, 0)
+        input_bytes = table_size_bytes(output_path)
+        reports.append(report)
+
+        print(f'[{name}] {metrics["wall_time_s"]:.2f}s, {n_rows} rows')
+
+    return ht, reports
+
+
+_REPORT_COLUMNS = ['stage', 'wall_time_s', 'spark_jobs', 'spark_stages', 'input_rows', 'output_rows',
+                   'input_bytes', 'reference_bytes_read_est', 'shuffle_read_bytes', 'shuffle_write_bytes',
+                   'peak_rss_growth_mb']
+
+
+def _report_html(report: dict) -> str:
+    def _cell(v):
+        if isinstance(v, float):
+            v = f'{v:.2f}'
+        return f'<td>{html.escape(str(v))}</td>' if v is not None else '<td></td>'
+
+    rows = []
+    for stage in report['stages']:
+        rows.append('<tr>' + ''.join(_cell(stage.get(c)) for c in _REPORT_COLUMNS) + '</tr>')
+        refs = ', '.join(f"{r['path']} ({r.get('on_disk_bytes', '?')} bytes on disk, "
+                         f"{r.get('n_partitions', '?')} partitions)"
+                         for r in stage['reference_tables'])
+        if refs:
+            rows.append(f'<tr><td></td><td colspan="{len(_REPORT_COLUMNS) - 1}">'
+                        f'{html.escape(refs)}</td></tr>')
+        if 'explain' in stage:
+            rows.append(f'<tr><td></td><td colspan="{len(_REPORT_COLUMNS) - 1}">'
+                        f'<details><summary>explain</summary><pre>{html.escape(stage["explain"])}</pre>'
+                        f'</details></td></tr>')
+
+    params = ''.join(f'<li>{html.escape(str(k))}: {html.escape(str(v))}</li>'
+                     for k, v in report.get('params', {}).items())
+    header = ''.join(f'<th>{c}</th>' for c in _REPORT_COLUMNS)
+
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>hvantk run report</title>'
+            f'<style>table {{border-collapse: collapse}} td, th {{border: 1px solid #ccc; padding: 4px}}'
+            f'</style></head><body>\n<h1>hvantk run report</h1>\n<ul>{params}</ul>\n'
+            f'<p>Total wall time: {report["wall_time_s"]:.2f}s</p>\n'
+            f'<table><tr>{header}</tr>\n' + '\n'.join(rows) + '\n</table>\n</body></html>\n')
+
+
+def write_report(report: dict,
+                 output_prefix: str):
+    """
+    Write a run report as `<output_prefix>.json` and `<output_prefix>.html`.
+
+    :param report: Run report: dict with `params`, `wall_time_s` and `stages` (see `run_stages`)
+    :param output_prefix: Output path prefix
+    """
+    with hl.hadoop_open(f'{output_prefix}.json', 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    with hl.hadoop_open(f'{output_prefix}.html', 'w') as f:
+        f.write(_report_html(report))
@@ -0,0 +1,172 @@
+"""
+Spark-free lookups of variant-level annotations from a local SQLite index.
+
+The index is exported by mktables (see `hvantk.utils.io.export_variant_index`) from the variant
+bundle, CCR and interactome tables. `VariantIndex.annotate` answers batch lookups for small
+variant lists in pure Python, with the same output fields and values as the Hail annotators
+(`annotate_clinvar_clnsig`, `annotate_ccr`, `annotate_gnomad_af`, `annotate_ppi` and
+`annotate_dbnsfp_scores`, or `annotate_variant_bundle`).
+
+This module must not import Hail.
+
+"""
+
+import json
+import sqlite3
+
+# Version of the index layout
+VARIANT_INDEX_VERSION = 2
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS variants (
+    contig TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    alt TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (contig, pos, ref, alt)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ccr (
+    contig TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    ccr_pct REAL,
+    PRIMARY KEY (contig, pos)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ppi (
+    contig TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    includes_start INTEGER NOT NULL,
+    includes_end INTEGER NOT NULL
+);
+"""
+
+INDEX_POST_LOAD = """
+CREATE INDEX IF NOT EXISTS ppi_start ON ppi (contig, start);
+"""
+
+
+def create_index(path: str) -> sqlite3.Connection:
+    """
+    Create an empty variant index (overwriting any existing one) for bulk loading.
+
+    :param path: Local path to the SQLite file
+    :return: SQLite connection
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript('DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS variants; '
+                       'DROP TABLE IF EXISTS ccr; DROP TABLE IF EXISTS ppi;')
+    conn.executescript(INDEX_SCHEMA)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    return conn
+
+
+def finalize_index(conn: sqlite3.Connection,
+                   meta: dict):
+    """
+    Write the index metadata, build the secondary indexes and compact the file.
+
+    :param conn: SQLite connection (see `create_index`)
+    :param meta: Metadata (values are stored as JSON)
+    """
+    conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                     [(k, json.dumps(v)) for k, v in {**meta, 'version': VARIANT_INDEX_VERSION}.items()])
+    conn.executescript(INDEX_POST_LOAD)
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def parse_variant_id(vid: str) -> tuple:
+    """
+    Parse a variant ID 'chr:position:ref:alt' (see `annotate_variant_id`).
+
+    :param vid: Variant ID
+    :return: (contig, position, ref, alt) tuple
+    """
+    contig, pos, ref, alt = vid.split(':')
+    return contig, int(pos), ref, alt
+
+
+def _score(value,
+           transcript_id: str):
+    # per-transcript scores are dicts, exported by Hail to JSON as lists of {key, value}
+    # structs; variant-level scores (e.g. CADD) are single values
+    if isinstance(value, list):
+        return {e['key']: e['value'] for e in value}.get(transcript_id)
+    if isinstance(value, dict):
+        return value.get(transcript_id)
+    return value
+
+
+class VariantIndex:
+    """
+    Read-only variant-level annotation index.
+
+    Example:
+        with VariantIndex('variant.index.GRCh38.sqlite') as index:
+            rows = index.annotate([('chr1', 55051215, 'G', 'A')], transcript_ids=['ENST00000302118'])
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self.meta = {k: json.loads(v) for k, v in self.conn.execute('SELECT key, value FROM meta')}
+        if self.meta.get('version') != VARIANT_INDEX_VERSION:
+            raise ValueError(f'Unsupported variant index version: {self.meta.get("version")}')
+        self.score_fields = self.meta['score_fields']
+        self.ppi_max_length = self.meta['ppi_max_length']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _ppi_site(self, contig: str, pos: int) -> int:
+        row = self.conn.execute('SELECT 1 FROM ppi '
+                                'WHERE contig = ? AND start BETWEEN ? AND ? '
+                                'AND (start < ? OR includes_start) '
+                                'AND (end > ? OR (end = ? AND includes_end)) LIMIT 1',
+                                (contig, pos - self.ppi_max_length, pos, pos, pos, pos)).fetchone()
+        return int(row is not None)
+
+    def annotate(self,
+                 variants: list,
+                 transcript_ids: list = None) -> list:
+        """
+        Annotate variants with Clinvar significance, CCR percentile, gnomad AF, interactome
+        sites and (if transcript IDs are given) transcript-specific dbNSFP scores.
+
+        :param variants: List of (contig, position, ref, alt) tuples
+        :param transcript_ids: Ensembl transcript ID of each variant, or None
+        :return: List of dicts with the annotations of each variant
+        """
+        if transcript_ids is None:
+            transcript_ids = [None] * len(variants)
+
+        rows = []
+        for (contig, pos, ref, alt), transcript_id in zip(variants, transcript_ids):
+            found = self.conn.execute('SELECT value FROM variants WHERE contig = ? AND pos = ? AND ref = ? AND alt = ?',
+                                      (contig, pos, ref, alt)).fetchone()
+            value = json.loads(found[0]) if found is not None else {}
+
+            ccr = self.conn.execute('SELECT ccr_pct FROM ccr WHERE contig = ? AND pos = ?',
+                                    (contig, pos)).fetchone()
+
+            row = {'clinvar_clnsig': value.get('clinvar_clnsig'),
+                   'ccr_pct': ccr[0] if ccr is not None else None,
+                   'gnomad_af_genomes': value.get('gnomad_af_genomes') or 0.0,
+                   'ppi_site': self._ppi_site(contig, pos)}
+            if transcript_id is not None:
+                row.update({f: _score(value.get(f), transcript_id) for f in self.score_fields})
+            rows.append(row)
+
+        return rows
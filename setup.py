@@ -12,15 +12,19 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="",  # TODO: Update github url
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=[
         "click",
         "setuptools",
         "hail"
     ],
+    extras_require={
+        # loom/h5ad single-cell ingestion
+        "scell": ["h5py"],
+    },
     entry_points={
         'console_scripts': [
-            'hvantk=hvantk.pyvatk_cli:pyvatk_main',
+            'hvantk=hvantk.hvantk:main',
         ],
     },
     classifiers=[